@@ -0,0 +1,14 @@
+"""Location of the files the application keeps on the user's machine."""
+import os
+import sys
+
+
+def user_data_path(*parts):
+    """Return a path under the per-user data directory of the application (not created)."""
+    if sys.platform == 'win32':
+        base = os.getenv("LOCALAPPDATA") or os.path.expanduser("~\\AppData\\Local")
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser("~/Library/Application Support")
+    else:
+        base = os.getenv("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.path.join(base, "tid", *parts)
@@ -0,0 +1,55 @@
+"""Compare two benchmark result files written by run.py.
+
+    python benchmarks/compare.py before.json after.json --threshold 0.2
+
+Prints the median of every benchmark in both runs and exits with status 1
+when one got slower by more than the threshold (and by more than --min-ms,
+so sub-millisecond noise is not reported).
+"""
+import argparse
+import json
+import sys
+
+
+def load(path):
+    with open(path) as file:
+        report = json.load(file)
+    return report['meta'], {(result['name'], result['posts']): result for result in report['results']}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark runs")
+    parser.add_argument('baseline', help="results of the reference run")
+    parser.add_argument('current', help="results of the run to check")
+    parser.add_argument('--threshold', type=float, default=0.2, help="allowed slowdown as a fraction (0.2 = 20%%)")
+    parser.add_argument('--min-ms', type=float, default=1.0, help="ignore slowdowns smaller than this")
+    args = parser.parse_args()
+
+    baseline_meta, baseline = load(args.baseline)
+    current_meta, current = load(args.current)
+    print(f"baseline: {baseline_meta.get('commit', '?')[:10]}  {baseline_meta.get('started_at', '')}")
+    print(f"current:  {current_meta.get('commit', '?')[:10]}  {current_meta.get('started_at', '')}")
+    if baseline_meta.get('parameters') != current_meta.get('parameters'):
+        print("warning: the runs used different parameters")
+    print()
+
+    regressions = 0
+    print(f"{'benchmark':<32} {'posts':>8} {'baseline ms':>12} {'current ms':>12} {'change':>8}")
+    for key in sorted(set(baseline) | set(current), key=lambda key: (key[1], key[0])):
+        name, posts = key
+        old = baseline.get(key, {}).get('median_ms')
+        new = current.get(key, {}).get('median_ms')
+        if old is None or new is None:
+            print(f"{name:<32} {posts:>8} {old or '-':>12} {new or '-':>12} {'':>8}")
+            continue
+
+        change = (new - old) / old if old else 0.0
+        slower = change > args.threshold and new - old > args.min_ms
+        regressions += slower
+        print(f"{name:<32} {posts:>8} {old:>12.3f} {new:>12.3f} {change:>+7.0%}{'  SLOWER' if slower else ''}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
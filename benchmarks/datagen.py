@@ -0,0 +1,120 @@
+"""Synthetic data for the benchmarks.
+
+Builds the schema with migrations.py in its own PostgreSQL schema and fills
+it with generate_series, so even a million posts load in one round trip per
+table. The data is loaded between migration 2 and the rest: the change log
+and rollup triggers don't fire for every generated row, the indexes are built
+once over the full tables and the rollups are filled by their migration.
+"""
+from psycopg2 import sql
+
+# Stats rows only reference this share of the posts; the others can be deleted
+STATS_POST_SHARE = 0.5
+
+# Distinct media contents the generated media rows share
+MEDIA_BLOBS = 20
+
+
+def reset_schema(connection, schema):
+    with connection.cursor() as cursor:
+        cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {schema} CASCADE").format(schema=sql.Identifier(schema)))
+        cursor.execute(sql.SQL("CREATE SCHEMA {schema}").format(schema=sql.Identifier(schema)))
+    connection.commit()
+
+
+def drop_schema(connection, schema):
+    with connection.cursor() as cursor:
+        # Large objects live outside the schema
+        cursor.execute(sql.SQL("SELECT lo_unlink(media_oid) FROM {schema}.{blobs}").format(
+            schema=sql.Identifier(schema), blobs=sql.Identifier(_names()['media_blobs'])))
+        cursor.execute(sql.SQL("DROP SCHEMA IF EXISTS {schema} CASCADE").format(schema=sql.Identifier(schema)))
+    connection.commit()
+
+
+def _names():
+    import migrations
+    return migrations._table_names()
+
+
+def generate(connection, posts, media_per_post=3, days_per_post=3, times_per_post=4, stats_per_post=10):
+    """Create the schema on connection (search_path set to the bench schema) and fill it."""
+    import migrations
+
+    migrations.apply_migrations(connection, target=2)
+
+    names = migrations._schema_names()
+    params = {
+        'posts': posts,
+        'media': media_per_post,
+        'days': days_per_post,
+        'times': times_per_post,
+        'stats': stats_per_post,
+        'stats_posts': max(1, int(posts * STATS_POST_SHARE)),
+        'blobs': MEDIA_BLOBS,
+    }
+    statements = [
+        """
+        INSERT INTO {tt} (time)
+        SELECT time '00:00' + m * interval '5 minutes' FROM generate_series(0, 287) m
+        """,
+        """
+        INSERT INTO {tpd} (name, text, is_random)
+        SELECT 'post ' || p, repeat('lorem ipsum ', 10 + p %% 20), p %% 2 = 0 FROM generate_series(1, %(posts)s) p
+        """,
+        """
+        INSERT INTO {media_blobs} (sha256, media_oid, size, ref_count)
+        SELECT lpad(to_hex(b), 64, '0'), lo_from_bytea(0, convert_to(repeat('x', 1024 * b), 'UTF8')), 1024 * b, 0
+        FROM generate_series(1, %(blobs)s) b
+        """,
+        """
+        INSERT INTO {media} (tpd_id, media_name, media_type, blob_sha256)
+        SELECT p, 'file_' || f, '.png', lpad(to_hex(1 + (p + f) %% %(blobs)s), 64, '0')
+        FROM generate_series(1, %(posts)s) p, generate_series(1, %(media)s) f
+        """,
+        """
+        UPDATE {media_blobs} b SET ref_count = m.refs
+        FROM (SELECT blob_sha256, count(*) AS refs FROM {media} GROUP BY blob_sha256) m
+        WHERE b.sha256 = m.blob_sha256
+        """,
+        """
+        INSERT INTO {tpd_wd} (tpd_id, wd_id)
+        SELECT p, 1 + (p + d) %% 7 FROM generate_series(1, %(posts)s) p, generate_series(1, %(days)s) d
+        """,
+        """
+        INSERT INTO {tpd_tt} (tpd_id, tt_id)
+        SELECT p, 1 + (p * 7 + t * 31) %% 288 FROM generate_series(1, %(posts)s) p, generate_series(1, %(times)s) t
+        """,
+        """
+        INSERT INTO {stats} (tpd_id, date, time, wd_id, status)
+        SELECT 1 + s %% %(stats_posts)s,
+               date '2024-01-01' + (s %% 365),
+               time '00:00' + (s %% 288) * interval '5 minutes',
+               1 + (s %% 7),
+               CASE WHEN s %% 10 = 0 THEN 'error' ELSE 'success' END
+        FROM generate_series(1, %(posts)s * %(stats)s) s
+        """,
+    ]
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(sql.SQL(statement).format(**names), params)
+    connection.commit()
+
+    migrations.apply_migrations(connection)
+
+    old_autocommit = connection.autocommit
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        # Fresh statistics and visibility maps, as on a database that has settled
+        for table in migrations._table_names().values():
+            cursor.execute(sql.SQL("VACUUM ANALYZE {table}").format(table=sql.Identifier(table)))
+    connection.autocommit = old_autocommit
+
+    return params
+
+
+def deletable_ids(connection, count):
+    """Ids of the newest posts, which no stats row refers to."""
+    with connection.cursor() as cursor:
+        cursor.execute(sql.SQL("SELECT id FROM {tpd} ORDER BY id DESC LIMIT %s").format(
+            tpd=sql.Identifier(_names()['tpd'])), (count,))
+        return [row[0] for row in cursor.fetchall()]
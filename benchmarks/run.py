@@ -0,0 +1,331 @@
+"""Benchmark suite for db.py and the table models.
+
+Runs against a throwaway PostgreSQL database: for every size, a fresh schema
+(tid_bench) is created with migrations.py, filled with synthetic posts, media,
+week days, tweet times and stats (datagen.py), timed, and dropped at the end.
+Nothing outside that schema is touched, apart from the media large objects,
+which are removed with it.
+
+    BENCH_DSN=postgresql://postgres@localhost/postgres python benchmarks/run.py \\
+        --sizes 10000 100000 --output before.json
+    python benchmarks/compare.py before.json after.json
+
+Results are JSON: run metadata (commit, versions, parameters) and one entry per
+benchmark and size with the median, min and max time in milliseconds.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import parse_dsn
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import datagen  # noqa: E402
+
+BENCH_SCHEMA = "tid_bench"
+
+# Used when .env doesn't name the tables
+DEFAULT_TABLE_NAMES = {
+    'TABLE_NAME_TPD': "tweet_post_data",
+    'TABLE_NAME_MEDIA': "media",
+    'TABLE_NAME_TPD_WD': "tpd_wd",
+    'TABLE_NAME_TPD_TT': "tpd_tt",
+    'TABLE_NAME_WD': "week_days",
+    'TABLE_NAME_TT': "tweet_times",
+    'TABLE_NAME_STATS': "stats",
+}
+
+# The query select_from_db_view_data used before the per-relation rewrite
+LEGACY_VIEW_DATA_SQL = """
+SELECT
+    tpd.id,
+    tpd.name,
+    tpd.text,
+    ARRAY_AGG(DISTINCT media.media_name) AS media_files,
+    tpd.is_random,
+    ARRAY_AGG(DISTINCT wd.day_name) AS week_days,
+    ARRAY_AGG(DISTINCT tt.time) AS tweet_times
+FROM
+    {tpd} tpd
+LEFT JOIN
+    {media} media ON tpd.id = media.tpd_id
+LEFT JOIN
+    {tpd_wd} tpd_wd ON tpd.id = tpd_wd.tpd_id
+LEFT JOIN
+    {wd} wd ON tpd_wd.wd_id = wd.id
+LEFT JOIN
+    {tpd_tt} tpd_tt ON tpd.id = tpd_tt.tpd_id
+LEFT JOIN
+    {tt} tt ON tpd_tt.tt_id = tt.id
+GROUP BY
+    tpd.id, tpd.name, tpd.text, tpd.is_random
+"""
+
+
+def configure(dsn):
+    """Point db.py at the bench schema of the given database; call before importing it."""
+    params = parse_dsn(dsn)
+    for variable, key in (('DB_HOST', 'host'), ('DB_PORT', 'port'), ('DB_NAME', 'dbname'),
+                          ('DB_USER', 'user'), ('DB_PASSWORD', 'password')):
+        os.environ[variable] = params.get(key, '')
+    # Every libpq connection, including the pooled ones, resolves tables in the bench schema only
+    os.environ['PGOPTIONS'] = f"-c search_path={BENCH_SCHEMA}"
+    os.environ['DB_AUTO_MIGRATE'] = '1'
+    for variable, table in DEFAULT_TABLE_NAMES.items():
+        os.environ.setdefault(variable, table)
+
+
+def measure(fn, repeat, setup=None):
+    """Call fn repeat times and return the timings in ms and the last result.
+
+    setup(i), when given, returns the arguments of call i and is not timed.
+    Output printed by db.py is swallowed.
+    """
+    timings = []
+    result = None
+    for i in range(repeat):
+        args = setup(i) if setup else ()
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            result = fn(*args)
+            timings.append((time.perf_counter() - started) * 1000)
+    return timings, result
+
+
+def summarize(name, posts, timings, **extra):
+    return dict({
+        'name': name,
+        'posts': posts,
+        'repeat': len(timings),
+        'median_ms': round(statistics.median(timings), 3),
+        'min_ms': round(min(timings), 3),
+        'max_ms': round(max(timings), 3),
+    }, **extra)
+
+
+def explain_ms(connection, query, params, repeat):
+    """Server-side execution times (ms) of a query, from EXPLAIN ANALYZE."""
+    timings = []
+    with connection.cursor() as cursor:
+        for _ in range(repeat):
+            cursor.execute(sql.SQL("EXPLAIN (ANALYZE, FORMAT JSON) ") + query, params)
+            timings.append(cursor.fetchone()[0][0]['Execution Time'])
+    connection.rollback()
+    return timings
+
+
+def run_size(connection, posts, args):
+    import db
+    import migrations
+
+    results = []
+
+    def record(result):
+        results.append(result)
+        print(f"  {result['name']:<32} {result['median_ms']:>12.3f} ms", file=sys.stderr, flush=True)
+
+    # View Data
+    timings, rows = measure(db.select_from_db_view_data, args.repeat)
+    record(summarize('select_from_db_view_data', posts, timings, rows=len(rows or [])))
+
+    # Regression check of the per-relation rewrite: the current query must not be
+    # slower than the single GROUP BY it replaced, on the same data
+    legacy_query = sql.SQL(LEGACY_VIEW_DATA_SQL).format(**migrations._schema_names())
+    legacy = summarize('view_data_query_legacy', posts, explain_ms(connection, legacy_query, None, args.repeat))
+    query, params = db._view_data_query()
+    current = summarize('view_data_query', posts, explain_ms(connection, query, params, args.repeat))
+    current['legacy_median_ms'] = legacy['median_ms']
+    current['speedup'] = round(legacy['median_ms'] / current['median_ms'], 2) if current['median_ms'] else None
+    current['regression'] = current['median_ms'] > legacy['median_ms'] * args.view_data_tolerance
+    record(current)
+    record(legacy)
+
+    # Table models
+    try:
+        from models import RowTableModel
+    except ImportError as error:
+        print(f"  skipping model benchmarks: {error}", file=sys.stderr)
+    else:
+        headers = ["ID", "Name", "Text", "Media", "Is Random", "Week Days", "Tweet Times"]
+        timings, _ = measure(lambda: RowTableModel(headers).set_rows(rows), args.repeat)
+        record(summarize('model_set_rows', posts, timings, rows=len(rows)))
+
+        # A refresh where 1% of the rows changed
+        model = RowTableModel(headers)
+        model.set_rows(rows)
+        changed = [list(row) for row in rows]
+        for row in changed[::100]:
+            row[1] = f"{row[1]} (edited)"
+        timings, _ = measure(lambda: model.replace_rows(changed), 1)
+        record(summarize('model_replace_rows', posts, timings, rows=len(rows)))
+
+    # Search
+    from search import SearchIndex
+    for query in ('post 12345', 'lorem'):
+        timings, found = measure(db.search_posts, args.repeat, setup=lambda i: (query,))
+        record(summarize(f"search_posts '{query}'", posts, timings, rows=len(found or [])))
+    texts = [(row[0], (row[1], row[2], *row[3])) for row in rows]
+    timings, index = measure(lambda: SearchIndex(texts), args.repeat)
+    record(summarize('search_index_build', posts, timings))
+    # One search per keystroke, as typed into the search box; max_ms is the slowest keystroke
+    queries = ['p', 'po', 'pos', 'post', 'post 1', 'post 12', 'post 123', 'post 1234', 'post 12345']
+    timings = [measure(index.search, 1, setup=lambda i: (query,))[0][0] for query in queries]
+    record(summarize('search_index_keystroke', posts, timings, keystrokes=len(queries)))
+
+    # Upcoming schedule
+    from schedule import ScheduleIndex
+    timings, schedule_rows = measure(db.select_schedule, args.repeat)
+    record(summarize('select_schedule', posts, timings, rows=len(schedule_rows or [])))
+    timings, index = measure(lambda: ScheduleIndex(schedule_rows), args.repeat)
+    record(summarize('schedule_index_build', posts, timings))
+    start = datetime(2024, 1, 1, 9, 0)
+    for label, hours in (('hour', 1), ('day', 24)):
+        timings, fired = measure(lambda: index.upcoming(start, start + timedelta(hours=hours)), args.repeat)
+        record(summarize(f'schedule_upcoming_{label}', posts, timings, rows=len(fired)))
+    changed = schedule_rows[::100]
+    timings, _ = measure(lambda: [index.add_post(*row) for row in changed], 1)
+    record(summarize('schedule_update_posts', posts, timings, rows=len(changed)))
+
+    # Statistics
+    timings, stats = measure(db.select_from_db_stats, args.repeat)
+    record(summarize('select_from_db_stats', posts, timings, rows=len(stats)))
+    del stats
+    timings, _ = measure(db.select_stats_page, args.repeat)
+    record(summarize('select_stats_page', posts, timings))
+    timings, _ = measure(db.select_stats_summary_by_post, args.repeat)
+    record(summarize('select_stats_summary_by_post', posts, timings))
+
+    # Writes
+    with tempfile.NamedTemporaryFile(suffix='.png') as media_file:
+        media_file.write(os.urandom(64 * 1024))
+        media_file.flush()
+        timings, _ = measure(
+            lambda i: db.save_complete_tpd(f"bench {i}", "benchmark post", False, [media_file.name],
+                                           ["Monday", "Friday"], ["09:00", "18:30"]),
+            args.calls, setup=lambda i: (i,)
+        )
+    record(summarize('save_complete_tpd', posts, timings))
+
+    # Read back the media file of the last post saved
+    with connection.cursor() as cursor:
+        cursor.execute(sql.SQL("SELECT max(id) FROM {media}").format(**migrations._schema_names()))
+        media_id = cursor.fetchone()[0]
+    connection.rollback()
+    timings, chunks = measure(lambda: list(db.read_media_chunks(media_id)), args.repeat)
+    record(summarize('read_media_chunks', posts, timings, bytes=sum(map(len, chunks))))
+
+    ids = datagen.deletable_ids(connection, args.calls + args.bulk * args.repeat)
+    single_ids, bulk_ids = ids[:args.calls], ids[args.calls:]
+    timings, _ = measure(db.delete_record_from_db, len(single_ids), setup=lambda i: (single_ids[i],))
+    record(summarize('delete_record_from_db', posts, timings))
+    timings, _ = measure(db.delete_records_from_db, args.repeat,
+                         setup=lambda i: (bulk_ids[i * args.bulk:(i + 1) * args.bulk],))
+    record(summarize('delete_records_from_db', posts, timings, ids_per_call=args.bulk))
+
+    return results
+
+
+def metadata(connection, args):
+    def git(*command):
+        try:
+            return subprocess.run(['git', *command], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        except OSError:
+            return None
+
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW server_version")
+        server_version = cursor.fetchone()[0]
+    connection.rollback()
+
+    return {
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git('rev-parse', 'HEAD'),
+        'dirty': bool(git('status', '--porcelain', '--untracked-files=no')),
+        'python': platform.python_version(),
+        'psycopg2': psycopg2.__version__,
+        'postgres': server_version,
+        'machine': platform.platform(),
+        'parameters': {
+            'sizes': args.sizes,
+            'media_per_post': args.media,
+            'days_per_post': args.days,
+            'times_per_post': args.times,
+            'stats_per_post': args.stats,
+            'repeat': args.repeat,
+            'calls': args.calls,
+            'bulk': args.bulk,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark db.py against a throwaway database")
+    parser.add_argument('--dsn', default=os.getenv("BENCH_DSN"), help="throwaway database (default: $BENCH_DSN)")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help="numbers of posts")
+    parser.add_argument('--media', type=int, default=3, help="media rows per post")
+    parser.add_argument('--days', type=int, default=3, help="week days per post")
+    parser.add_argument('--times', type=int, default=4, help="tweet times per post")
+    parser.add_argument('--stats', type=int, default=1, help="stats rows per post")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per read benchmark, the median is reported")
+    parser.add_argument('--calls', type=int, default=20, help="calls per single-post write benchmark")
+    parser.add_argument('--bulk', type=int, default=100, help="posts per delete_records_from_db call")
+    parser.add_argument('--output', help="write the results as JSON to this file (default: stdout)")
+    parser.add_argument('--keep', action='store_true', help="keep the last generated schema for inspection")
+    parser.add_argument('--view-data-tolerance', type=float, default=1.0,
+                        help="exit with 1 when the View Data query takes longer than the legacy one times this")
+    args = parser.parse_args()
+
+    if not args.dsn:
+        parser.error("pass --dsn or set BENCH_DSN to a throwaway database")
+
+    configure(args.dsn)
+    import db
+
+    connection = psycopg2.connect(args.dsn)
+    report = {'meta': metadata(connection, args), 'results': []}
+
+    try:
+        for posts in args.sizes:
+            print(f"{posts} posts: generating data...", file=sys.stderr, flush=True)
+            datagen.reset_schema(connection, BENCH_SCHEMA)
+            started = time.perf_counter()
+            datagen.generate(connection, posts, args.media, args.days, args.times, args.stats)
+            print(f"  generated in {time.perf_counter() - started:.1f}s", file=sys.stderr, flush=True)
+            db.invalidate_lookup_cache()
+
+            report['results'].extend(run_size(connection, posts, args))
+    finally:
+        db.close_pool()
+        if not args.keep:
+            datagen.drop_schema(connection, BENCH_SCHEMA)
+        connection.close()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+    regressions = [result for result in report['results'] if result.get('regression')]
+    for result in regressions:
+        print(f"REGRESSION: {result['name']} at {result['posts']} posts took {result['median_ms']} ms, "
+              f"the legacy query {result['legacy_median_ms']} ms", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
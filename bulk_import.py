@@ -0,0 +1,175 @@
+"""Bulk import of posts from a JSONL file, without the GUI.
+
+Every line is one post with the fields of the Add Data form:
+
+    {"name": "...", "text": "...", "is_random": false, "media_files": ["img/a.png"],
+     "week_days": ["Monday", "Friday"], "tweet_times": ["09:30", "18:00"]}
+
+Times are local 'HH:MM', as in the form; relative media paths are resolved
+against the directory of the JSONL file. Posts are saved in batches through
+db.save_posts_batch, one transaction per batch. Invalid lines are reported
+and skipped; if the database can't be reached, the import stops:
+
+    python bulk_import.py posts.jsonl --batch-size 1000 --rejects rejected.jsonl
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import db
+import metrics
+
+TIME_PATTERN = re.compile(r"^([01]\d|2[0-3]):[0-5]\d$")
+WEEK_DAYS = {"Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"}
+
+
+class ImportAborted(Exception):
+    """The database failed for a reason other than the posts themselves."""
+
+
+def parse_post(line, base_dir):
+    """Return the post described by a JSONL line; raise ValueError if it is invalid."""
+    try:
+        record = json.loads(line)
+    except ValueError as error:
+        raise ValueError(f"invalid JSON: {error}")
+    if not isinstance(record, dict):
+        raise ValueError("expected a JSON object")
+
+    name = record.get('name')
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("name must be a non-empty string")
+    text = record.get('text', '')
+    if not isinstance(text, str):
+        raise ValueError("text must be a string")
+    is_random = record.get('is_random', False)
+    if not isinstance(is_random, bool):
+        raise ValueError("is_random must be true or false")
+
+    lists = {}
+    for field in ('media_files', 'week_days', 'tweet_times'):
+        values = record.get(field, [])
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"{field} must be a list of strings")
+        lists[field] = values
+
+    media_files = [os.path.join(base_dir, path) for path in lists['media_files']]
+    for path in media_files:
+        if not os.path.isfile(path):
+            raise ValueError(f"media file not found: {path}")
+    for value in lists['week_days']:
+        if value not in WEEK_DAYS:
+            raise ValueError(f"unknown week day: {value!r}")
+    for value in lists['tweet_times']:
+        if not TIME_PATTERN.match(value):
+            raise ValueError(f"tweet time must be 'HH:MM': {value!r}")
+
+    return {
+        'name': name,
+        'text': text,
+        'is_random': is_random,
+        'media_files': media_files,
+        'week_days': lists['week_days'],
+        'tweet_times': lists['tweet_times'],
+    }
+
+
+class BulkImport:
+    def __init__(self, batch_size, rejects=None):
+        self.batch_size = batch_size
+        self.rejects = rejects
+        self.batch = []
+        self.lines = 0
+        self.imported = 0
+        self.rejected = 0
+        self.started = time.monotonic()
+
+    def add_line(self, line_number, line, base_dir):
+        self.lines += 1
+        try:
+            post = parse_post(line, base_dir)
+        except ValueError as error:
+            self.reject(line_number, line, str(error))
+            return
+        self.batch.append((line_number, line, post))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        batch, self.batch = self.batch, []
+
+        self.save(batch)
+        print(f"{self.lines} lines read, {self.imported} imported, {self.rejected} rejected, "
+              f"{self.rate():.0f} posts/s", flush=True)
+
+    def save(self, batch):
+        result = db.save_posts_batch([post for _, _, post in batch])
+        if result == 0:
+            self.imported += len(batch)
+            return
+        if result != 1:
+            # Retrying halves of the batch would fail the same way
+            raise ImportAborted(f"the database failed on the batch starting at line {batch[0][0]} "
+                                f"(see the error above); it and the lines after it were not imported")
+        if len(batch) == 1:
+            line_number, line, _ = batch[0]
+            self.reject(line_number, line, "rejected by the database (see the error above)")
+            return
+        # Narrow the failure down by halves, so the valid posts are still saved
+        middle = len(batch) // 2
+        self.save(batch[:middle])
+        self.save(batch[middle:])
+
+    def reject(self, line_number, line, reason):
+        self.rejected += 1
+        print(f"line {line_number}: {reason}", file=sys.stderr)
+        if self.rejects:
+            self.rejects.write(json.dumps({'line': line_number, 'reason': reason, 'data': line.rstrip('\n')}) + "\n")
+
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return self.imported / elapsed if elapsed > 0 else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import posts from a JSONL file")
+    parser.add_argument('path', help="JSONL file, one post per line ('-' for stdin)")
+    parser.add_argument('--batch-size', type=int, default=1000, help="posts committed per transaction")
+    parser.add_argument('--rejects', help="write rejected lines with the reason to this JSONL file")
+    args = parser.parse_args()
+    metrics.start_exporters()
+
+    if args.path == '-':
+        source, base_dir = sys.stdin, os.getcwd()
+    else:
+        source, base_dir = open(args.path, encoding='utf-8'), os.path.dirname(os.path.abspath(args.path))
+    rejects = open(args.rejects, 'w', encoding='utf-8') if args.rejects else None
+
+    importer = BulkImport(args.batch_size, rejects)
+    try:
+        for line_number, line in enumerate(source, 1):
+            if line.strip():
+                importer.add_line(line_number, line, base_dir)
+        importer.flush()
+    except ImportAborted as error:
+        print(f"Import aborted: {error}. {importer.imported} posts were imported before.", file=sys.stderr)
+        return 2
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if rejects:
+            rejects.close()
+        db.close_pool()
+
+    elapsed = time.monotonic() - importer.started
+    print(f"Done in {elapsed:.1f}s: {importer.imported} posts imported, {importer.rejected} lines rejected "
+          f"({importer.rate():.0f} posts/s, {importer.lines / elapsed if elapsed else 0:.0f} lines/s)")
+    return 1 if importer.rejected else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
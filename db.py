@@ -3,9 +3,17 @@ from psycopg2 import sql
 from dotenv import load_dotenv
 import os
 import psycopg2.extras
-from datetime import datetime, time
-import pytz
-from tzlocal import get_localzone
+import psycopg2.pool
+import atexit
+import csv
+import hashlib
+import io
+import threading
+import time as time_module
+from datetime import time as time_of_day
+import metrics
+import timeconv
+from textutil import words
 
 # Load environment variables from .env file
 load_dotenv()
@@ -24,17 +32,258 @@ TABLE_NAME_TPD_TT = os.getenv("TABLE_NAME_TPD_TT")
 TABLE_NAME_WD = os.getenv("TABLE_NAME_WD")
 TABLE_NAME_TT = os.getenv("TABLE_NAME_TT")
 TABLE_NAME_STATS = os.getenv("TABLE_NAME_STATS")
+TABLE_NAME_MEDIA_BLOBS = os.getenv("TABLE_NAME_MEDIA_BLOBS", "media_blobs")
+TABLE_NAME_CHANGE_LOG = os.getenv("TABLE_NAME_CHANGE_LOG", "change_log")
+TABLE_NAME_STATS_DAILY = os.getenv("TABLE_NAME_STATS_DAILY", "stats_daily")
+TABLE_NAME_STATS_HOURLY = os.getenv("TABLE_NAME_STATS_HOURLY", "stats_hourly")
+
+# Connection pool configuration (DB_POOL_MIN warm connections are kept open between calls)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "300"))
+DB_POOL_HEALTH_CHECK = os.getenv("DB_POOL_HEALTH_CHECK", "1").lower() in ("1", "true", "yes")
+# Only connections idle for longer than this are probed before being handed out
+DB_POOL_HEALTH_CHECK_IDLE = float(os.getenv("DB_POOL_HEALTH_CHECK_IDLE", "30"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+# Media files are streamed to the database in chunks of this many bytes
+MEDIA_CHUNK_SIZE = int(os.getenv("MEDIA_CHUNK_SIZE", str(1024 * 1024)))
+
+# Convert tweet times to the local zone in SQL (AT TIME ZONE) instead of in Python
+CONVERT_TIMES_IN_DB = os.getenv("CONVERT_TIMES_IN_DB", "0").lower() in ("1", "true", "yes")
+
+# Number of stats rows loaded per page in the Statistics tab
+STATS_PAGE_SIZE = int(os.getenv("STATS_PAGE_SIZE", "200"))
+
+# Rows fetched per round trip when streaming stats into a Parquet export
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "50000"))
+
+# stats.status value counted as a success in the Statistics summaries
+STATS_SUCCESS_STATUS = os.getenv("STATS_SUCCESS_STATUS", "success")
+
+# Session-local staging tables used by save_posts_batch; emptied on commit
+STAGING_TABLES = [
+    "CREATE TEMP TABLE IF NOT EXISTS tid_staging_posts "
+    "(tpd_id integer, name text, text text, is_random boolean, submission_key uuid) ON COMMIT DELETE ROWS",
+    "CREATE TEMP TABLE IF NOT EXISTS tid_staging_days (tpd_id integer, day_name text) ON COMMIT DELETE ROWS",
+    "CREATE TEMP TABLE IF NOT EXISTS tid_staging_times (tpd_id integer, time time) ON COMMIT DELETE ROWS",
+]
+
+# Apply pending migrations (migrations.py) when the connection pool is opened;
+# off by default, so desktop clients don't run DDL: use `python migrations.py migrate`
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "0").lower() in ("1", "true", "yes")
+
+# Channel the change log triggers send NOTIFY events on
+NOTIFY_CHANNEL = os.getenv("NOTIFY_CHANNEL", "tid_changes")
+
+# Change log entries older than this are pruned; clients idle for longer do a full reload
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv("CHANGE_LOG_RETENTION_DAYS", "7"))
+
+# In-process cache of the week_days / tweet_times dictionary tables
+_lookup_lock = threading.Lock()
+_wd_ids = None
+_tt_ids = None
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(
+                DB_POOL_MIN,
+                DB_POOL_MAX,
+                dbname=DB_NAME,
+                user=DB_USER,
+                password=DB_PASSWORD,
+                host=DB_HOST,
+                port=DB_PORT,
+                connection_factory=metrics.InstrumentedConnection
+            )
+            _ensure_schema(_pool)
+        return _pool
+
+def _ensure_schema(pool):
+    # Imported here: migrations.py reads the table names from this module
+    from migrations import apply_migrations, pending_migrations
+
+    connection = pool.getconn()
+    try:
+        if DB_AUTO_MIGRATE:
+            apply_migrations(connection)
+        else:
+            pending = pending_migrations(connection)
+            if pending:
+                print(f"Database schema is out of date ({len(pending)} pending migrations); "
+                      f"run `python migrations.py migrate`")
+    except Exception as error:
+        print(f"Error updating database schema: {error}")
+        connection.rollback()
+    finally:
+        pool.putconn(connection)
 
-def get_connection():
+def get_direct_connection():
+    """Open a connection outside the pool, for sessions held open for a long time (LISTEN)."""
     return psycopg2.connect(
         dbname=DB_NAME,
         user=DB_USER,
         password=DB_PASSWORD,
         host=DB_HOST,
-        port=DB_PORT
+        port=DB_PORT,
+        # Detect a silently dropped link instead of waiting on it forever
+        keepalives=1,
+        keepalives_idle=30,
+        keepalives_interval=10,
+        keepalives_count=3,
+        connection_factory=metrics.InstrumentedConnection
     )
 
-def select_from_db_view_data():
+def _is_healthy(connection, idle):
+    """Check that a pooled connection is still usable before handing it out.
+
+    Recently used connections are trusted without a round trip to the server.
+    """
+    if connection.closed:
+        return False
+    if not DB_POOL_HEALTH_CHECK or idle <= DB_POOL_HEALTH_CHECK_IDLE:
+        return True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        connection.rollback()
+        return True
+    except Exception:
+        return False
+
+def get_connection():
+    """Borrow a connection from the shared pool.
+
+    Connections idle for longer than DB_POOL_MAX_IDLE seconds are recycled, and
+    those idle for longer than DB_POOL_HEALTH_CHECK_IDLE seconds are probed and
+    replaced if broken. Every connection must be given back with
+    release_connection().
+    """
+    started = time_module.perf_counter()
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise psycopg2.pool.PoolError("Timed out waiting for a database connection")
+
+    try:
+        pool = _get_pool()
+        while True:
+            connection = pool.getconn()
+            # Kept on the connection itself: ids of closed connections get reused
+            idle_since = getattr(connection, 'idle_since', None)
+            connection.idle_since = None
+            idle = time_module.monotonic() - idle_since if idle_since is not None else 0
+            # idle_since is None for connections freshly opened by the pool
+            if idle <= DB_POOL_MAX_IDLE and _is_healthy(connection, idle):
+                metrics.connection_borrowed(time_module.perf_counter() - started)
+                return connection
+            pool.putconn(connection, close=True)
+    except Exception:
+        _pool_slots.release()
+        raise
+
+def release_connection(connection, discard=False):
+    """Return a connection to the pool; broken or discarded ones are closed."""
+    metrics.connection_returned()
+    try:
+        if _pool is None or _pool.closed:
+            connection.close()
+            return
+        discard = discard or connection.closed
+        if not discard:
+            connection.idle_since = time_module.monotonic()
+        _pool.putconn(connection, close=discard)
+    finally:
+        _pool_slots.release()
+
+def close_pool():
+    """Close every pooled connection (called on application exit)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+atexit.register(close_pool)
+
+def _view_data_query(ids=None, tz_name=None):
+    """Build the View Data query and its parameters.
+
+    Media, week days and tweet times are each aggregated per post on their own
+    and then joined once, so a post never expands into files x days x times
+    intermediate rows.
+    """
+    if tz_name:
+        time_value = sql.SQL(
+            "to_char(((now() AT TIME ZONE 'UTC')::date + tt.time) AT TIME ZONE 'UTC' AT TIME ZONE %(tz_name)s, "
+            "'HH24:MI:SS')"
+        )
+    else:
+        time_value = sql.SQL("tt.time")
+
+    if ids is not None:
+        link_filter = sql.SQL("WHERE tpd_id = ANY(%(ids)s)")
+        tpd_filter = sql.SQL("WHERE tpd.id = ANY(%(ids)s)")
+    else:
+        link_filter = sql.SQL("")
+        tpd_filter = sql.SQL("")
+
+    select_sql = """
+    WITH post_media AS (
+        SELECT tpd_id, ARRAY_AGG(DISTINCT media_name) AS media_files
+        FROM {media}
+        {link_filter}
+        GROUP BY tpd_id
+    ), post_days AS (
+        SELECT tpd_id, ARRAY_AGG(DISTINCT wd.day_name) AS week_days
+        FROM {tpd_wd} JOIN {wd} wd ON wd.id = wd_id
+        {link_filter}
+        GROUP BY tpd_id
+    ), post_times AS (
+        SELECT tpd_id, ARRAY_AGG(DISTINCT {time_value}) AS tweet_times
+        FROM {tpd_tt} JOIN {tt} tt ON tt.id = tt_id
+        {link_filter}
+        GROUP BY tpd_id
+    )
+    SELECT
+        tpd.id,
+        tpd.name,
+        tpd.text,
+        COALESCE(pm.media_files, '{{}}') AS media_files,
+        tpd.is_random,
+        COALESCE(pd.week_days, '{{}}') AS week_days,
+        COALESCE(pt.tweet_times, '{{}}') AS tweet_times
+    FROM {tpd} tpd
+    LEFT JOIN post_media pm ON pm.tpd_id = tpd.id
+    LEFT JOIN post_days pd ON pd.tpd_id = tpd.id
+    LEFT JOIN post_times pt ON pt.tpd_id = tpd.id
+    {tpd_filter}
+    ORDER BY tpd.id
+    """
+    select_query = sql.SQL(select_sql).format(
+        tpd=sql.Identifier(TABLE_NAME_TPD),
+        media=sql.Identifier(TABLE_NAME_MEDIA),
+        tpd_wd=sql.Identifier(TABLE_NAME_TPD_WD),
+        wd=sql.Identifier(TABLE_NAME_WD),
+        tpd_tt=sql.Identifier(TABLE_NAME_TPD_TT),
+        tt=sql.Identifier(TABLE_NAME_TT),
+        time_value=time_value,
+        link_filter=link_filter,
+        tpd_filter=tpd_filter
+    )
+    params = {'tz_name': tz_name, 'ids': list(ids) if ids is not None else None}
+    return select_query, params
+
+def select_from_db_view_data(ids=None, tz_name=None):
+    """Return the View Data rows, optionally only for the given post ids.
+
+    With tz_name (an IANA zone, defaulting to the local zone when
+    CONVERT_TIMES_IN_DB is set) the tweet times are converted by the database.
+    """
     connection = None
     cursor = None
 
@@ -43,36 +292,14 @@ def select_from_db_view_data():
         # Użycie DictCursor, aby fetchall() zwróciło listę słowników
         cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
-        # SQL query to join tables and select the desired fields
-        select_sql = f"""
-        SELECT 
-            tpd.id, 
-            tpd.name, 
-            tpd.text, 
-            ARRAY_AGG(DISTINCT media.media_name) AS media_files,
-            tpd.is_random, 
-            ARRAY_AGG(DISTINCT wd.day_name) AS week_days, 
-            ARRAY_AGG(DISTINCT tt.time) AS tweet_times
-        FROM 
-            {TABLE_NAME_TPD} tpd
-        LEFT JOIN 
-            {TABLE_NAME_MEDIA} ON tpd.id = media.tpd_id
-        LEFT JOIN 
-            {TABLE_NAME_TPD_WD} ON tpd.id = tpd_wd.tpd_id
-        LEFT JOIN 
-            {TABLE_NAME_WD} wd ON tpd_wd.wd_id = wd.id
-        LEFT JOIN 
-            {TABLE_NAME_TPD_TT} ON tpd.id = tpd_tt.tpd_id
-        LEFT JOIN 
-            {TABLE_NAME_TT} tt ON tpd_tt.tt_id = tt.id
-        GROUP BY 
-            tpd.id, tpd.name, tpd.text, tpd.is_random;
-        """
-        cursor.execute(select_sql)
+        tz_name = _display_timezone(tz_name, cursor)
+        select_query, params = _view_data_query(ids, tz_name)
+        cursor.execute(select_query, params)
         results = cursor.fetchall()
-        
-        for record in results:
-            record['tweet_times'] = times_utc_to_local(record['tweet_times'])
+
+        if not tz_name:
+            for record in results:
+                record['tweet_times'] = times_utc_to_local(record['tweet_times'])
 
         return results
 
@@ -84,56 +311,369 @@ def select_from_db_view_data():
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
+            release_connection(connection)
+
+def _get_change_watermark(cursor):
+    # Every transaction older than the snapshot xmin has finished, so changes
+    # logged by transactions still running are picked up by the next refresh
+    cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+    return cursor.fetchone()[0]
+
+def get_change_watermark():
+    """Return the watermark to pass to the *_changes functions after a full load.
+
+    Read it before running the full query; changes made meanwhile are then
+    reported again by the next delta, which is harmless.
+    """
+    connection = None
+    cursor = None
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        return _get_change_watermark(cursor)
+
+    except Exception as error:
+        print(f"Error reading change watermark: {error}")
+        return None
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+def _select_changed_ids(cursor, source, since):
+    select_sql = """
+    SELECT DISTINCT row_id FROM {change_log} WHERE source = %s AND txid >= %s
+    """
+    cursor.execute(
+        sql.SQL(select_sql).format(change_log=sql.Identifier(TABLE_NAME_CHANGE_LOG)),
+        (source, since)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def prune_change_log():
+    """Delete change log entries older than CHANGE_LOG_RETENTION_DAYS."""
+    connection = None
+    cursor = None
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+
+        delete_sql = """
+        DELETE FROM {change_log} WHERE changed_at < now() - %s * interval '1 day'
+        """
+        cursor.execute(
+            sql.SQL(delete_sql).format(change_log=sql.Identifier(TABLE_NAME_CHANGE_LOG)),
+            (CHANGE_LOG_RETENTION_DAYS,)
+        )
+        connection.commit()
+        return 0
+
+    except Exception as error:
+        print(f"Error pruning change log: {error}")
+        return 1
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+def select_view_data_changes(since):
+    """Return (rows, deleted_ids, watermark) for posts changed since the watermark.
+
+    rows are the current View Data rows of inserted or updated posts. Returns
+    None on error, in which case the caller should fall back to a full reload.
+    """
+    connection = None
+    cursor = None
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+
+        watermark = _get_change_watermark(cursor)
+        changed_ids = _select_changed_ids(cursor, 'tpd', since)
+
+    except Exception as error:
+        print(f"Error retrieving data changes from database: {error}")
+        return None
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+    if not changed_ids:
+        return [], [], watermark
+
+    rows = select_from_db_view_data(ids=changed_ids)
+    if rows is None:
+        return None
+
+    found_ids = {row['id'] for row in rows}
+    deleted_ids = [item_id for item_id in changed_ids if item_id not in found_ids]
+    return rows, deleted_ids, watermark
+
+def search_posts(query, limit=None):
+    """Return the ids of the posts matching a search query, in ascending order.
+
+    Each word of the query must occur in the name, the text or a media name of
+    the post, ignoring case (see search.py). The ILIKE conditions use the
+    pg_trgm indexes of migration 7. Returns None on error.
+    """
+    terms = words(query)
+    if not terms:
+        return []
+
+    connection = None
+    cursor = None
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+
+        # Posts matching each word, intersected; every branch can use a trigram index
+        term_sql = sql.SQL("""
+            (SELECT id FROM {tpd} WHERE name ILIKE %s OR text ILIKE %s
+             UNION
+             SELECT tpd_id FROM {media} WHERE media_name ILIKE %s)
+        """).format(tpd=sql.Identifier(TABLE_NAME_TPD), media=sql.Identifier(TABLE_NAME_MEDIA))
+        select_query = sql.SQL("SELECT id FROM ({matches}) matches ORDER BY id {limit}").format(
+            matches=sql.SQL(" INTERSECT ").join([term_sql] * len(terms)),
+            limit=sql.SQL("LIMIT %s") if limit is not None else sql.SQL("")
+        )
+        params = []
+        for term in terms:
+            # Words may contain '_', which LIKE would take for any character
+            pattern = "%" + term.replace("_", "\\_") + "%"
+            params.extend([pattern] * 3)
+        if limit is not None:
+            params.append(limit)
+
+        cursor.execute(select_query, params)
+        return [row[0] for row in cursor.fetchall()]
+
+    except Exception as error:
+        print(f"Error searching posts: {error}")
+        return None
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+def select_schedule(ids=None):
+    """Return (id, name, is_random, week_days, tweet_times) of every post, or of the given ids.
+
+    Posts without week days or tweet times never fire and are left out.
+    tweet_times are local 'HH:MM:SS' strings, as in View Data. Returns None on error.
+    """
+    connection = None
+    cursor = None
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+
+        # Same shape as the View Data query, without the text and media nobody needs here
+        select_sql = """
+        WITH post_days AS (
+            SELECT tpd_id, ARRAY_AGG(wd.day_name) AS week_days
+            FROM {tpd_wd} JOIN {wd} wd ON wd.id = wd_id
+            {link_filter}
+            GROUP BY tpd_id
+        ), post_times AS (
+            SELECT tpd_id, ARRAY_AGG(tt.time) AS tweet_times
+            FROM {tpd_tt} JOIN {tt} tt ON tt.id = tt_id
+            {link_filter}
+            GROUP BY tpd_id
+        )
+        SELECT tpd.id, tpd.name, tpd.is_random, pd.week_days, pt.tweet_times
+        FROM {tpd} tpd
+        JOIN post_days pd ON pd.tpd_id = tpd.id
+        JOIN post_times pt ON pt.tpd_id = tpd.id
+        {tpd_filter}
+        """
+        cursor.execute(sql.SQL(select_sql).format(
+            tpd=sql.Identifier(TABLE_NAME_TPD),
+            tpd_wd=sql.Identifier(TABLE_NAME_TPD_WD),
+            wd=sql.Identifier(TABLE_NAME_WD),
+            tpd_tt=sql.Identifier(TABLE_NAME_TPD_TT),
+            tt=sql.Identifier(TABLE_NAME_TT),
+            link_filter=sql.SQL("WHERE tpd_id = ANY(%(ids)s)" if ids is not None else ""),
+            tpd_filter=sql.SQL("WHERE tpd.id = ANY(%(ids)s)" if ids is not None else "")
+        ), {'ids': list(ids) if ids is not None else None})
+        rows = cursor.fetchall()
+
+        # Convert the times of every post in one pass
+        local_times = iter(times_utc_to_local([time for row in rows for time in row[4]]))
+        return [(post_id, name, is_random, week_days, [next(local_times) for _ in utc_times])
+                for post_id, name, is_random, week_days, utc_times in rows]
+
+    except Exception as error:
+        print(f"Error retrieving schedule from database: {error}")
+        return None
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+def select_schedule_changes(since):
+    """Return (rows, deleted_ids, watermark) for posts whose schedule may have changed since the watermark.
+
+    Returns None on error, in which case the caller should reload the schedule.
+    """
+    connection = None
+    cursor = None
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+
+        watermark = _get_change_watermark(cursor)
+        changed_ids = _select_changed_ids(cursor, 'tpd', since)
+
+    except Exception as error:
+        print(f"Error retrieving schedule changes from database: {error}")
+        return None
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+    if not changed_ids:
+        return [], [], watermark
+
+    rows = select_schedule(ids=changed_ids)
+    if rows is None:
+        return None
+
+    found_ids = {row[0] for row in rows}
+    deleted_ids = [item_id for item_id in changed_ids if item_id not in found_ids]
+    return rows, deleted_ids, watermark
 
 def times_local_to_utc(local_times_list):
-    utc_times_list = []
-    for local_time_str in local_times_list:
-        utc_time_str = time_local_to_utc(local_time_str)
-        utc_times_list.append(utc_time_str)
-    return utc_times_list
-    
+    return timeconv.local_to_utc_column(local_times_list)
+
 def times_utc_to_local(utc_times_list):
-    local_times_list = []
-    for utc_time_str in utc_times_list:
-        local_time_str = time_utc_to_local(utc_time_str)
-        local_times_list.append(local_time_str)
-    return local_times_list
+    return timeconv.utc_to_local_column(utc_times_list)
+
+def _release_media_blobs(cursor, tpd_ids):
+    """Decrement blob reference counts for the media of the given posts.
+
+    Large objects owned directly by media rows (uploaded before deduplication)
+    are unlinked here. Returns the hashes of the blobs that were released.
+    """
+    cursor.execute(
+        sql.SQL("""
+        SELECT lo_unlink(media_oid) FROM {media} WHERE tpd_id = ANY(%s) AND media_oid IS NOT NULL
+        """).format(media=sql.Identifier(TABLE_NAME_MEDIA)),
+        (tpd_ids,)
+    )
 
-def delete_record_from_db(item_id):
+    release_sql = """
+    UPDATE {media_blobs} b
+    SET ref_count = b.ref_count - m.refs
+    FROM (
+        SELECT blob_sha256, COUNT(*) AS refs
+        FROM {media}
+        WHERE tpd_id = ANY(%s) AND blob_sha256 IS NOT NULL
+        GROUP BY blob_sha256
+    ) m
+    WHERE b.sha256 = m.blob_sha256
+    RETURNING b.sha256
+    """
+    cursor.execute(
+        sql.SQL(release_sql).format(
+            media_blobs=sql.Identifier(TABLE_NAME_MEDIA_BLOBS),
+            media=sql.Identifier(TABLE_NAME_MEDIA)
+        ),
+        (tpd_ids,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def _delete_unused_media_blobs(cursor, hashes):
+    """Delete released blobs no post refers to anymore, with their large objects."""
+    if not hashes:
+        return
+
+    delete_sql = """
+    WITH deleted AS (
+        DELETE FROM {media_blobs} WHERE sha256 = ANY(%s) AND ref_count <= 0
+        RETURNING media_oid
+    )
+    SELECT lo_unlink(media_oid) FROM deleted
+    """
+    cursor.execute(
+        sql.SQL(delete_sql).format(media_blobs=sql.Identifier(TABLE_NAME_MEDIA_BLOBS)),
+        (hashes,)
+    )
+
+def delete_records_from_db(item_ids):
+    """Delete posts with their media, week days and tweet times in one transaction.
+
+    Every table gets one DELETE ... WHERE tpd_id = ANY(%s), however many posts
+    are deleted. Returns 0 on success, also when some ids no longer exist, and
+    1 on error, in which case the transaction is rolled back and nothing is
+    deleted.
+    """
     connection = None
     cursor = None
+    item_ids = list(item_ids)
 
     try:
         connection = get_connection()
         cursor = connection.cursor()
 
-        # SQL queries to delete from all related tables
-        delete_sqls = [
-            "DELETE FROM tpd_tt WHERE tpd_id = %s",
-            "DELETE FROM tpd_wd WHERE tpd_id = %s",
-            "DELETE FROM media WHERE tpd_id = %s",
-            "DELETE FROM tweet_post_data WHERE id = %s"
-        ]
+        # Drop the posts' references to shared media blobs
+        shared_blobs = _release_media_blobs(cursor, item_ids)
 
-        for sql in delete_sqls:
-            cursor.execute(sql, (item_id,))
+        # Delete from all related tables, the post itself last
+        delete_sql = """
+        DELETE FROM {tpd_tt} WHERE tpd_id = ANY(%(ids)s);
+        DELETE FROM {tpd_wd} WHERE tpd_id = ANY(%(ids)s);
+        DELETE FROM {media} WHERE tpd_id = ANY(%(ids)s);
+        DELETE FROM {tpd} WHERE id = ANY(%(ids)s);
+        """
+        delete_query = sql.SQL(delete_sql).format(
+            tpd_tt=sql.Identifier(TABLE_NAME_TPD_TT),
+            tpd_wd=sql.Identifier(TABLE_NAME_TPD_WD),
+            media=sql.Identifier(TABLE_NAME_MEDIA),
+            tpd=sql.Identifier(TABLE_NAME_TPD)
+        )
+        cursor.execute(delete_query, {'ids': item_ids})
+
+        _delete_unused_media_blobs(cursor, shared_blobs)
 
         connection.commit()
         return 0  # Indicate success
 
     except Exception as error:
-        print(f"Error deleting record from database: {error}")
-        connection.rollback()
+        print(f"Error deleting records from database: {error}")
+        if connection:
+            connection.rollback()
         return 1  # Indicate error
 
     finally:
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
+            release_connection(connection)
+
+def delete_record_from_db(item_id):
+    return delete_records_from_db([item_id])
 
-def select_from_db_stats():
+def select_from_db_stats(tz_name=None):
     connection = None
     cursor = None
     results = []
@@ -143,18 +683,27 @@ def select_from_db_stats():
         # Użycie DictCursor, aby fetchall() zwróciło listę słowników
         cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
 
+        tz_name = _display_timezone(tz_name, cursor)
+        time_column, params = _stats_time_column(tz_name)
+
         # SQL query to join stats with tweet_post_data and select the desired fields
         select_sql = """
-        SELECT s.id, tpd.name, s.date, s.time, wd.day_name, s.status
-        FROM public.stats s
-        JOIN public.tweet_post_data tpd ON s.tpd_id = tpd.id
-        JOIN public.week_days wd ON s.wd_id = wd.id
+        SELECT s.id, tpd.name, s.date, {time_column}, wd.day_name, s.status
+        FROM {stats} s
+        JOIN {tpd} tpd ON s.tpd_id = tpd.id
+        JOIN {wd} wd ON s.wd_id = wd.id
         """
-        cursor.execute(select_sql)
+        select_query = sql.SQL(select_sql).format(
+            time_column=time_column,
+            stats=sql.Identifier(TABLE_NAME_STATS),
+            tpd=sql.Identifier(TABLE_NAME_TPD),
+            wd=sql.Identifier(TABLE_NAME_WD)
+        )
+        cursor.execute(select_query, params)
         results = cursor.fetchall()
 
-        for record in results:
-            record['time'] = time_utc_to_local(record['time'])
+        if not tz_name:
+            _convert_stats_times(results)
     except Exception as error:
         print(f"Error retrieving data from database: {error}")
 
@@ -162,28 +711,533 @@ def select_from_db_stats():
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
+            release_connection(connection)
 
     return results
 
-def insert_into_db_tpd(name, text, is_random):
+def _display_timezone(tz_name, cursor):
+    # A local zone the database doesn't know is converted in Python instead
+    if tz_name is None and CONVERT_TIMES_IN_DB:
+        return timeconv.sql_zone_name(cursor)
+    return tz_name
+
+def _stats_time_column(tz_name):
+    """Select expression for the stats time, converted in SQL when tz_name is set."""
+    if not tz_name:
+        return sql.SQL("s.time"), []
+    # Each row is converted as of its own date, so DST is right for old rows too
+    expression = "to_char((s.date + s.time) AT TIME ZONE 'UTC' AT TIME ZONE %s, 'HH24:MI:SS') AS time"
+    return sql.SQL(expression), [tz_name]
+
+def _convert_stats_times(records):
+    # Convert the whole time column in one call, each row as of its own date
+    local_times = timeconv.utc_to_local_column([record['time'] for record in records],
+                                               [record['date'] for record in records])
+    for record, local_time in zip(records, local_times):
+        record['time'] = local_time
+
+def _stats_filters(name=None, status=None, date_from=None, date_to=None):
+    conditions = []
+    params = []
+    if name:
+        conditions.append(sql.SQL("tpd.name ILIKE %s"))
+        params.append(f"%{name}%")
+    if status:
+        conditions.append(sql.SQL("s.status = %s"))
+        params.append(status)
+    if date_from:
+        conditions.append(sql.SQL("s.date >= %s"))
+        params.append(date_from)
+    if date_to:
+        conditions.append(sql.SQL("s.date <= %s"))
+        params.append(date_to)
+    return conditions, params
+
+def select_stats_page(after=None, limit=STATS_PAGE_SIZE, name=None, status=None, date_from=None, date_to=None,
+                      tz_name=None):
+    """Return one page of stats rows, newest first, using keyset pagination.
+
+    after is the (date, time, id) key of the last row of the previous page.
+    Returns (rows, next_key); next_key is None on the last page. Rows end with
+    the stored UTC time (utc_time), which the keys are built from.
+    """
     connection = None
     cursor = None
-    tpd_id = None
+    results = []
+    next_key = None
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+        tz_name = _display_timezone(tz_name, cursor)
+        time_column, params = _stats_time_column(tz_name)
+
+        conditions, filter_params = _stats_filters(name, status, date_from, date_to)
+        params.extend(filter_params)
+        if after is not None:
+            conditions.append(sql.SQL("(s.date, s.time, s.id) < (%s, %s, %s)"))
+            params.extend(after)
+        where = sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+
+        select_sql = """
+        SELECT s.id, tpd.name, s.date, {time_column}, wd.day_name, s.status, s.time AS utc_time
+        FROM {stats} s
+        JOIN {tpd} tpd ON s.tpd_id = tpd.id
+        JOIN {wd} wd ON s.wd_id = wd.id
+        {where}
+        ORDER BY s.date DESC, s.time DESC, s.id DESC
+        LIMIT %s
+        """
+        select_query = sql.SQL(select_sql).format(
+            time_column=time_column,
+            stats=sql.Identifier(TABLE_NAME_STATS),
+            tpd=sql.Identifier(TABLE_NAME_TPD),
+            wd=sql.Identifier(TABLE_NAME_WD),
+            where=where
+        )
+        cursor.execute(select_query, params + [limit])
+        results = cursor.fetchall()
+
+        if len(results) == limit:
+            last = results[-1]
+            next_key = (last['date'], last['utc_time'], last['id'])
+
+        if not tz_name:
+            _convert_stats_times(results)
+    except Exception as error:
+        print(f"Error retrieving data from database: {error}")
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+    return results, next_key
+
+def count_stats_estimate(name=None, status=None, date_from=None, date_to=None):
+    """Return the planner's row estimate for the filtered stats query.
+
+    This is much cheaper than COUNT(*) on a large table, but only approximate.
+    """
+    connection = None
+    cursor = None
+    estimate = None
 
     try:
         connection = get_connection()
         cursor = connection.cursor()
 
-        # Insert data into TPD table and return the generated ID
-        insert_sql = """
-        INSERT INTO {table_name} (name, text, is_random)
-        VALUES (%s, %s, %s) RETURNING id
+        conditions, params = _stats_filters(name, status, date_from, date_to)
+        where = sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+
+        explain_sql = """
+        EXPLAIN (FORMAT JSON)
+        SELECT 1
+        FROM {stats} s
+        JOIN {tpd} tpd ON s.tpd_id = tpd.id
+        {where}
+        """
+        explain_query = sql.SQL(explain_sql).format(
+            stats=sql.Identifier(TABLE_NAME_STATS),
+            tpd=sql.Identifier(TABLE_NAME_TPD),
+            where=where
+        )
+        cursor.execute(explain_query, params)
+        plan = cursor.fetchone()[0]
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+    except Exception as error:
+        print(f"Error estimating stats count: {error}")
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+    return estimate
+
+def select_stats_changes(since, name=None, status=None, date_from=None, date_to=None, tz_name=None):
+    """Return (rows, deleted_ids, watermark) for stats rows changed since the watermark.
+
+    Rows that changed but no longer match the filters are reported as deleted.
+    Returns None on error.
+    """
+    connection = None
+    cursor = None
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+        watermark = _get_change_watermark(cursor)
+        changed_ids = _select_changed_ids(cursor, 'stats', since)
+        if not changed_ids:
+            return [], [], watermark
+
+        tz_name = _display_timezone(tz_name, cursor)
+        time_column, params = _stats_time_column(tz_name)
+
+        conditions, filter_params = _stats_filters(name, status, date_from, date_to)
+        params.extend(filter_params)
+        conditions.append(sql.SQL("s.id = ANY(%s)"))
+        params.append(changed_ids)
+
+        select_sql = """
+        SELECT s.id, tpd.name, s.date, {time_column}, wd.day_name, s.status, s.time AS utc_time
+        FROM {stats} s
+        JOIN {tpd} tpd ON s.tpd_id = tpd.id
+        JOIN {wd} wd ON s.wd_id = wd.id
+        WHERE {conditions}
+        ORDER BY s.date DESC, s.time DESC, s.id DESC
+        """
+        select_query = sql.SQL(select_sql).format(
+            time_column=time_column,
+            stats=sql.Identifier(TABLE_NAME_STATS),
+            tpd=sql.Identifier(TABLE_NAME_TPD),
+            wd=sql.Identifier(TABLE_NAME_WD),
+            conditions=sql.SQL(" AND ").join(conditions)
+        )
+        cursor.execute(select_query, params)
+        results = cursor.fetchall()
+
+        if not tz_name:
+            _convert_stats_times(results)
+
+        found_ids = {record['id'] for record in results}
+        deleted_ids = [item_id for item_id in changed_ids if item_id not in found_ids]
+        return results, deleted_ids, watermark
+
+    except Exception as error:
+        print(f"Error retrieving stats changes from database: {error}")
+        return None
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+def select_stats_summary_by_post(date_from=None, date_to=None, by_weekday=False,
+                                 success_status=STATS_SUCCESS_STATUS):
+    """Return stats totals and success rates per post (and week day) from the daily rollup.
+
+    Rows have id, name, [week_day,] total, successes and success_rate (percent).
+    The week day is the one of the stats date.
+    """
+    connection = None
+    cursor = None
+    results = []
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+        conditions = []
+        params = {'success': success_status, 'date_from': date_from, 'date_to': date_to}
+        if date_from:
+            conditions.append(sql.SQL("r.date >= %(date_from)s"))
+        if date_to:
+            conditions.append(sql.SQL("r.date <= %(date_to)s"))
+        where = sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+
+        if by_weekday:
+            weekday_column = sql.SQL("to_char(r.date, 'FMDay') AS week_day,")
+            weekday_group = sql.SQL(", extract(isodow FROM r.date), to_char(r.date, 'FMDay')")
+        else:
+            weekday_column = weekday_group = sql.SQL("")
+
+        select_sql = """
+        SELECT tpd.id, tpd.name, {weekday_column}
+               sum(r.count)::bigint AS total,
+               COALESCE(sum(r.count) FILTER (WHERE r.status = %(success)s), 0)::bigint AS successes,
+               round(100.0 * COALESCE(sum(r.count) FILTER (WHERE r.status = %(success)s), 0) / sum(r.count), 1)::float
+                   AS success_rate
+        FROM {stats_daily} r
+        JOIN {tpd} tpd ON r.tpd_id = tpd.id
+        {where}
+        GROUP BY tpd.id, tpd.name{weekday_group}
+        HAVING sum(r.count) > 0
+        ORDER BY tpd.name, tpd.id{weekday_group}
+        """
+        select_query = sql.SQL(select_sql).format(
+            weekday_column=weekday_column,
+            weekday_group=weekday_group,
+            stats_daily=sql.Identifier(TABLE_NAME_STATS_DAILY),
+            tpd=sql.Identifier(TABLE_NAME_TPD),
+            where=where
+        )
+        cursor.execute(select_query, params)
+        results = cursor.fetchall()
+    except Exception as error:
+        print(f"Error retrieving stats summary from database: {error}")
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+    return results
+
+def select_stats_summary_by_hour(success_status=STATS_SUCCESS_STATUS):
+    """Return stats totals and success rates per week day and UTC hour from the hourly rollup.
+
+    Rows have week_day, hour, total, successes and success_rate (percent).
+    """
+    connection = None
+    cursor = None
+    results = []
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+
+        select_sql = """
+        SELECT wd.day_name AS week_day, r.hour,
+               sum(r.count)::bigint AS total,
+               COALESCE(sum(r.count) FILTER (WHERE r.status = %(success)s), 0)::bigint AS successes,
+               round(100.0 * COALESCE(sum(r.count) FILTER (WHERE r.status = %(success)s), 0) / sum(r.count), 1)::float
+                   AS success_rate
+        FROM {stats_hourly} r
+        JOIN {wd} wd ON r.wd_id = wd.id
+        GROUP BY wd.id, wd.day_name, r.hour
+        HAVING sum(r.count) > 0
+        ORDER BY wd.id, r.hour
         """
-        insert_query = sql.SQL(insert_sql).format(table_name=sql.Identifier(TABLE_NAME_TPD))
+        select_query = sql.SQL(select_sql).format(
+            stats_hourly=sql.Identifier(TABLE_NAME_STATS_HOURLY),
+            wd=sql.Identifier(TABLE_NAME_WD)
+        )
+        cursor.execute(select_query, {'success': success_status})
+        results = cursor.fetchall()
+    except Exception as error:
+        print(f"Error retrieving stats summary from database: {error}")
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+    return results
+
+def _stats_export_query(tz_name, name=None, status=None, date_from=None, date_to=None):
+    """Build the export query; without tz_name time_local holds the UTC time, to be converted in Python."""
+    conditions, params = _stats_filters(name, status, date_from, date_to)
+    where = sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+    if tz_name:
+        time_local = sql.SQL("((s.date + s.time) AT TIME ZONE 'UTC' AT TIME ZONE %s)::time AS time_local")
+        params = [tz_name] + params
+    else:
+        time_local = sql.SQL("s.time AS time_local")
+
+    # Oldest first, in the order of the stats (date, time, id) index, so no sort is needed
+    select_sql = """
+    SELECT s.id, tpd.name, s.date, s.time AS time_utc, {time_local},
+           wd.day_name AS week_day, s.status
+    FROM {stats} s
+    JOIN {tpd} tpd ON s.tpd_id = tpd.id
+    JOIN {wd} wd ON s.wd_id = wd.id
+    {where}
+    ORDER BY s.date, s.time, s.id
+    """
+    select_query = sql.SQL(select_sql).format(
+        stats=sql.Identifier(TABLE_NAME_STATS),
+        tpd=sql.Identifier(TABLE_NAME_TPD),
+        wd=sql.Identifier(TABLE_NAME_WD),
+        time_local=time_local,
+        where=where
+    )
+    return select_query, params
+
+def _localize_export_rows(rows):
+    # Each row converted as of its own date, as the SQL conversion does
+    local_times = timeconv.utc_to_local_column([row[3] for row in rows], [row[2] for row in rows])
+    return [row[:4] + (time_of_day.fromisoformat(local_time) if local_time else None,) + row[5:]
+            for row, local_time in zip(rows, local_times)]
+
+class _CountingWriter:
+    """File wrapper counting the CSV lines written through it."""
+
+    def __init__(self, file, progress_callback=None, report_every=10000):
+        self.file = file
+        self.progress_callback = progress_callback
+        self.report_every = report_every
+        self.lines = 0
+        self.reported = 0
+
+    def write(self, data):
+        self.file.write(data)
+        self.lines += data.count(b"\n" if isinstance(data, bytes) else "\n")
+        # COPY writes one line at a time; report only every report_every lines
+        if self.progress_callback and self.lines - self.reported >= self.report_every:
+            self.reported = self.lines
+            # The header line is not a row
+            self.progress_callback(self.lines - 1, None)
+
+def export_stats_csv(file, name=None, status=None, date_from=None, date_to=None, progress_callback=None):
+    """Stream the filtered stats, joined with their post, into a binary file as CSV.
+
+    Uses COPY ... TO STDOUT, so the rows are never held in memory.
+    progress_callback(rows_written, None) is called as data arrives. Returns
+    the number of rows exported, or None on error.
+    """
+    connection = None
+    cursor = None
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+
+        tz_name = timeconv.sql_zone_name(cursor)
+        select_query, params = _stats_export_query(tz_name, name, status, date_from, date_to)
+        if not tz_name:
+            cursor.close()
+            cursor = None
+            exported = _export_stats_csv_localized(connection, file, select_query, params, progress_callback)
+            connection.rollback()
+            return exported
+
+        copy_sql = b"COPY (" + cursor.mogrify(select_query, params) + b") TO STDOUT WITH (FORMAT csv, HEADER)"
+        cursor.copy_expert(copy_sql, _CountingWriter(file, progress_callback))
+        connection.rollback()
+        return cursor.rowcount
+
+    except Exception as error:
+        print(f"Error exporting stats: {error}")
+        if connection:
+            connection.rollback()
+        return None
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+def _export_stats_csv_localized(connection, file, select_query, params, progress_callback):
+    # COPY can't convert to a zone the database doesn't know; rows go through Python instead
+    with connection.cursor(name='tid_stats_export') as cursor:
+        cursor.itersize = EXPORT_CHUNK_SIZE
+        cursor.execute(select_query, params)
+        text_file = io.TextIOWrapper(file, encoding='utf-8', newline='', write_through=True)
+        try:
+            writer = csv.writer(text_file, lineterminator='\n')
+            writer.writerow(['id', 'name', 'date', 'time_utc', 'time_local', 'week_day', 'status'])
+            exported = 0
+            while True:
+                rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                writer.writerows(_localize_export_rows(rows))
+                exported += len(rows)
+                if progress_callback:
+                    progress_callback(exported, None)
+        finally:
+            # Leave the caller's file open
+            text_file.detach()
+    return exported
+
+def export_stats_parquet(file, name=None, status=None, date_from=None, date_to=None, progress_callback=None):
+    """Stream the filtered stats into a binary file as Parquet (requires pyarrow).
+
+    Rows are read through a server-side cursor and written as one row group per
+    EXPORT_CHUNK_SIZE rows, so memory use does not grow with the table.
+    progress_callback(rows_written, None) is called after every chunk. Returns
+    the number of rows exported, or None on error.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        print("Error exporting stats: Parquet export needs pyarrow (pip install pyarrow)")
+        return None
+
+    schema = pyarrow.schema([
+        ('id', pyarrow.int32()),
+        ('name', pyarrow.string()),
+        ('date', pyarrow.date32()),
+        ('time_utc', pyarrow.time64('us')),
+        ('time_local', pyarrow.time64('us')),
+        ('week_day', pyarrow.string()),
+        ('status', pyarrow.string()),
+    ])
+
+    connection = None
+    cursor = None
+    writer = None
+    exported = 0
+
+    try:
+        connection = get_connection()
+        with connection.cursor() as zone_cursor:
+            tz_name = timeconv.sql_zone_name(zone_cursor)
+        # Named cursor: rows stay on the server until fetched
+        cursor = connection.cursor(name='tid_stats_export')
+        cursor.itersize = EXPORT_CHUNK_SIZE
+
+        select_query, params = _stats_export_query(tz_name, name, status, date_from, date_to)
+        cursor.execute(select_query, params)
+
+        writer = pyarrow.parquet.ParquetWriter(file, schema)
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+            if not rows:
+                break
+            if not tz_name:
+                rows = _localize_export_rows(rows)
+            columns = list(zip(*rows))
+            writer.write_batch(pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+            exported += len(rows)
+            if progress_callback:
+                progress_callback(exported, None)
+
+        if exported == 0:
+            # Still write a valid file with the schema
+            writer.write_table(schema.empty_table())
+        writer.close()
+        writer = None
+        return exported
+
+    except Exception as error:
+        print(f"Error exporting stats: {error}")
+        return None
+
+    finally:
+        if writer:
+            writer.close()
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.rollback()
+            release_connection(connection)
+
+def _insert_tpd(cursor, name, text, is_random):
+    # Insert data into TPD table and return the generated ID
+    insert_sql = """
+    INSERT INTO {table_name} (name, text, is_random)
+    VALUES (%s, %s, %s) RETURNING id
+    """
+    insert_query = sql.SQL(insert_sql).format(table_name=sql.Identifier(TABLE_NAME_TPD))
+
+    cursor.execute(insert_query, (name, text, is_random))
+    return cursor.fetchone()[0]  # Fetch the generated id
 
-        cursor.execute(insert_query, (name, text, is_random))
-        tpd_id = cursor.fetchone()[0]  # Fetch the generated id
+def insert_into_db_tpd(name, text, is_random):
+    connection = None
+    cursor = None
+    tpd_id = None
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+
+        tpd_id = _insert_tpd(cursor, name, text, is_random)
         connection.commit()
 
     except Exception as error:
@@ -193,11 +1247,131 @@ def insert_into_db_tpd(name, text, is_random):
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
+            release_connection(connection)
 
     return tpd_id
 
-def insert_into_db_media(tpd_id, media_files):
+def _write_large_object(connection, media_file, progress=None):
+    """Stream a file into a new large object, MEDIA_CHUNK_SIZE bytes at a time."""
+    large_object = connection.lobject(0, 'wb')
+    try:
+        with open(media_file, 'rb') as file:
+            while True:
+                chunk = file.read(MEDIA_CHUNK_SIZE)
+                if not chunk:
+                    break
+                large_object.write(chunk)
+                if progress:
+                    progress(len(chunk))
+        return large_object.oid
+    finally:
+        large_object.close()
+
+def hash_media_file(media_file):
+    """Return the SHA-256 hex digest and size of a file, read in chunks."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(media_file, 'rb') as file:
+        while True:
+            chunk = file.read(MEDIA_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+def _insert_media(cursor, tpd_id, media_files, progress_callback=None):
+    """Insert the media rows of a post, uploading only content the server lacks.
+
+    Files are hashed locally; blobs already stored under the same SHA-256 are
+    reused and only get their reference count bumped.
+    progress_callback(bytes_sent, total_bytes) is called after every chunk.
+    """
+    if not media_files:
+        return
+
+    hashed_files = [(media_file,) + hash_media_file(media_file) for media_file in media_files]
+    hashes = list(dict.fromkeys(sha256 for _, sha256, _ in hashed_files))
+
+    # Lock the blobs we are going to reuse so they cannot be deleted meanwhile
+    select_sql = """
+    SELECT sha256 FROM {media_blobs} WHERE sha256 = ANY(%s) FOR UPDATE
+    """
+    cursor.execute(
+        sql.SQL(select_sql).format(media_blobs=sql.Identifier(TABLE_NAME_MEDIA_BLOBS)),
+        (hashes,)
+    )
+    stored_hashes = {row[0] for row in cursor.fetchall()}
+
+    new_files = {}
+    for media_file, sha256, size in hashed_files:
+        if sha256 not in stored_hashes:
+            new_files.setdefault(sha256, (media_file, size))
+
+    total_bytes = sum(size for _, size in new_files.values())
+    bytes_sent = 0
+
+    def progress(chunk_size):
+        nonlocal bytes_sent
+        bytes_sent += chunk_size
+        if progress_callback:
+            progress_callback(bytes_sent, total_bytes)
+
+    if new_files:
+        new_blobs = []
+        for sha256, (media_file, size) in new_files.items():
+            media_oid = _write_large_object(cursor.connection, media_file, progress)
+            new_blobs.append((sha256, media_oid, size))
+
+        insert_blobs_sql = """
+        INSERT INTO {media_blobs} (sha256, media_oid, size)
+        VALUES %s
+        ON CONFLICT (sha256) DO NOTHING
+        RETURNING sha256
+        """
+        inserted = psycopg2.extras.execute_values(
+            cursor,
+            sql.SQL(insert_blobs_sql).format(
+                media_blobs=sql.Identifier(TABLE_NAME_MEDIA_BLOBS)
+            ).as_string(cursor),
+            new_blobs,
+            page_size=len(new_blobs),
+            fetch=True
+        )
+
+        # Another client stored the same content concurrently; drop our copy
+        inserted_hashes = {row[0] for row in inserted}
+        orphaned_oids = [media_oid for sha256, media_oid, _ in new_blobs if sha256 not in inserted_hashes]
+        if orphaned_oids:
+            cursor.execute("SELECT lo_unlink(oid) FROM unnest(%s::oid[]) AS oid", (orphaned_oids,))
+
+    insert_sql = """
+    WITH inserted AS (
+        INSERT INTO {media} (tpd_id, media_name, media_type, blob_sha256)
+        VALUES %s
+        RETURNING blob_sha256
+    )
+    UPDATE {media_blobs} b
+    SET ref_count = b.ref_count + i.refs
+    FROM (SELECT blob_sha256, COUNT(*) AS refs FROM inserted GROUP BY blob_sha256) i
+    WHERE b.sha256 = i.blob_sha256
+    """
+    insert_query = sql.SQL(insert_sql).format(
+        media=sql.Identifier(TABLE_NAME_MEDIA),
+        media_blobs=sql.Identifier(TABLE_NAME_MEDIA_BLOBS)
+    )
+
+    media_rows = []
+    for media_file, sha256, _ in hashed_files:
+        # Get the file name with extension
+        file_name_with_extension = os.path.basename(media_file)
+        # Split the file name and extension
+        file_name, file_extension = os.path.splitext(file_name_with_extension)
+        media_rows.append((tpd_id, file_name, file_extension, sha256))
+
+    psycopg2.extras.execute_values(cursor, insert_query.as_string(cursor), media_rows, page_size=len(media_rows))
+
+def insert_into_db_media(tpd_id, media_files, progress_callback=None):
     connection = None
     cursor = None
 
@@ -205,22 +1379,7 @@ def insert_into_db_media(tpd_id, media_files):
         connection = get_connection()
         cursor = connection.cursor()
 
-        insert_sql = """
-        INSERT INTO {table_name} (tpd_id, media_name, media_type, media_data)
-        VALUES (%s, %s, %s, %s)
-        """
-        insert_query = sql.SQL(insert_sql).format(table_name=sql.Identifier(TABLE_NAME_MEDIA))
-
-        for media_file in media_files:
-            # Get the file name with extension
-            file_name_with_extension = os.path.basename(media_file)
-            # Split the file name and extension
-            file_name, file_extension = os.path.splitext(file_name_with_extension)
-
-            with open(media_file, 'rb') as file:
-                media_data = file.read()
-                cursor.execute(insert_query, (tpd_id, file_name, file_extension, psycopg2.Binary(media_data)))
-        
+        _insert_media(cursor, tpd_id, media_files, progress_callback)
         connection.commit()
 
     except Exception as error:
@@ -231,40 +1390,204 @@ def insert_into_db_media(tpd_id, media_files):
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
+            release_connection(connection)
     return 0
 
-def get_wd_id(day_name):
-    """Retrieve week_day ID based on the day name."""
+def read_media_chunks(media_id, chunk_size=MEDIA_CHUNK_SIZE):
+    """Yield the content of a media row in chunks without loading it whole.
+
+    The content is read from the shared blob in media_blobs, from the row's own
+    large object, or from the inline media_data of rows stored before either
+    existed. The connection is borrowed until the generator is exhausted or
+    closed; to stop early, read it inside contextlib.closing().
+    """
     connection = None
     cursor = None
-    wd_id = None
 
     try:
         connection = get_connection()
         cursor = connection.cursor()
 
         select_sql = """
-        SELECT id FROM {table_name} WHERE day_name = %s
+        SELECT COALESCE(b.media_oid, m.media_oid)
+        FROM {table_name} m
+        LEFT JOIN {media_blobs} b ON b.sha256 = m.blob_sha256
+        WHERE m.id = %s
         """
-        select_query = sql.SQL(select_sql).format(table_name=sql.Identifier(TABLE_NAME_WD))
-
-        cursor.execute(select_query, (day_name,))
+        select_query = sql.SQL(select_sql).format(
+            table_name=sql.Identifier(TABLE_NAME_MEDIA),
+            media_blobs=sql.Identifier(TABLE_NAME_MEDIA_BLOBS)
+        )
+        cursor.execute(select_query, (media_id,))
         result = cursor.fetchone()
+        if result is None:
+            return
+
+        media_oid = result[0]
+        if media_oid is not None:
+            large_object = connection.lobject(media_oid, 'rb')
+            try:
+                while True:
+                    chunk = large_object.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                large_object.close()
+        else:
+            chunk_sql = """
+            SELECT substring(media_data FROM %s FOR %s) FROM {table_name} WHERE id = %s
+            """
+            chunk_query = sql.SQL(chunk_sql).format(table_name=sql.Identifier(TABLE_NAME_MEDIA))
+            offset = 1
+            while True:
+                cursor.execute(chunk_query, (offset, chunk_size, media_id))
+                chunk = cursor.fetchone()[0]
+                if not chunk:
+                    break
+                yield bytes(chunk)
+                offset += chunk_size
 
-        if result:
-            wd_id = result[0]
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+def _load_lookup_cache(cursor):
+    global _wd_ids, _tt_ids
+
+    select_sql = """
+    SELECT 'wd', id, day_name FROM {wd_table}
+    UNION ALL
+    SELECT 'tt', id, to_char(time, 'HH24:MI:SS') FROM {tt_table}
+    """
+    select_query = sql.SQL(select_sql).format(
+        wd_table=sql.Identifier(TABLE_NAME_WD),
+        tt_table=sql.Identifier(TABLE_NAME_TT)
+    )
+    cursor.execute(select_query)
+
+    wd_ids = {}
+    tt_ids = {}
+    for kind, item_id, key in cursor.fetchall():
+        if kind == 'wd':
+            wd_ids[key] = item_id
+        else:
+            tt_ids[key] = item_id
+
+    with _lookup_lock:
+        _wd_ids = wd_ids
+        _tt_ids = tt_ids
+
+def load_lookup_cache():
+    """Load the week_days and tweet_times dictionaries into memory with one query."""
+    connection = None
+    cursor = None
+
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+        _load_lookup_cache(cursor)
+        return 0
 
     except Exception as error:
-        print(f"Error retrieving week day ID: {error}")
+        print(f"Error loading lookup cache: {error}")
+        return 1
 
     finally:
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
+            release_connection(connection)
+
+def invalidate_lookup_cache():
+    """Drop the cached week_days/tweet_times ids; they are reloaded on next use."""
+    global _wd_ids, _tt_ids
+    with _lookup_lock:
+        _wd_ids = None
+        _tt_ids = None
+
+def _lookup_ids(kind, keys, cursor=None):
+    """Resolve keys to ids from the cache, reloading it once when a key is unknown."""
+    cache = _wd_ids if kind == 'wd' else _tt_ids
+    if cache is None or any(key not in cache for key in keys):
+        if cursor is not None:
+            _load_lookup_cache(cursor)
+        elif load_lookup_cache() != 0:
+            return {}
+        cache = (_wd_ids if kind == 'wd' else _tt_ids) or {}
+    return {key: cache[key] for key in keys if key in cache}
+
+def upsert_tweet_times(utc_times, cursor=None):
+    """Return ids for the given UTC 'HH:MM:SS' times, inserting the missing ones."""
+    tt_ids = _lookup_ids('tt', utc_times, cursor)
+    missing = [utc_time for utc_time in dict.fromkeys(utc_times) if utc_time not in tt_ids]
+    if not missing:
+        return tt_ids
+
+    # A time inserted by a concurrent session is skipped by ON CONFLICT (after
+    # that session commits) and found by the separate SELECT, whose snapshot is newer
+    insert_sql = """
+    INSERT INTO {table_name} (time)
+    SELECT DISTINCT t.time FROM unnest(%s::time[]) AS t(time)
+    ON CONFLICT (time) DO NOTHING
+    """
+    insert_query = sql.SQL(insert_sql).format(table_name=sql.Identifier(TABLE_NAME_TT))
+    select_sql = "SELECT id, to_char(time, 'HH24:MI:SS') FROM {table_name} WHERE time = ANY(%s::time[])"
+    select_query = sql.SQL(select_sql).format(table_name=sql.Identifier(TABLE_NAME_TT))
+
+    connection = None
+    own_cursor = cursor is None
+    try:
+        if own_cursor:
+            connection = get_connection()
+            cursor = connection.cursor()
 
-    return wd_id
+        cursor.execute(insert_query, (missing,))
+        cursor.execute(select_query, (missing,))
+        new_ids = {key: item_id for item_id, key in cursor.fetchall()}
+
+        if own_cursor:
+            connection.commit()
+
+    finally:
+        if own_cursor:
+            if cursor:
+                cursor.close()
+            if connection:
+                release_connection(connection)
+
+    with _lookup_lock:
+        if _tt_ids is not None:
+            _tt_ids.update(new_ids)
+
+    tt_ids.update(new_ids)
+    return tt_ids
+
+def get_wd_id(day_name):
+    """Retrieve week_day ID based on the day name."""
+    return _lookup_ids('wd', [day_name]).get(day_name)
+
+def _insert_tpd_wd(cursor, tpd_id, week_days):
+    """Link a post to its week days using the cached day ids."""
+    if not week_days:
+        return
+
+    wd_ids = _lookup_ids('wd', week_days, cursor)
+    for day in week_days:
+        if day not in wd_ids:
+            print(f"Week day '{day}' not found in the week_days table.")
+    if not wd_ids:
+        return
+
+    insert_sql = """
+    INSERT INTO {table_name} (tpd_id, wd_id)
+    SELECT %s, unnest(%s::integer[])
+    """
+    insert_query = sql.SQL(insert_sql).format(table_name=sql.Identifier(TABLE_NAME_TPD_WD))
+
+    cursor.execute(insert_query, (tpd_id, list(set(wd_ids.values()))))
 
 def insert_into_db_tpd_wd(tpd_id, week_days):
     connection = None
@@ -274,19 +1597,7 @@ def insert_into_db_tpd_wd(tpd_id, week_days):
         connection = get_connection()
         cursor = connection.cursor()
 
-        insert_sql = """
-        INSERT INTO {table_name} (tpd_id, wd_id)
-        VALUES (%s, %s)
-        """
-        insert_query = sql.SQL(insert_sql).format(table_name=sql.Identifier(TABLE_NAME_TPD_WD))
-
-        for day in week_days:
-            wd_id = get_wd_id(day)
-            if wd_id is not None:
-                cursor.execute(insert_query, (tpd_id, wd_id))
-            else:
-                print(f"Week day '{day}' not found in the week_days table.")
-
+        _insert_tpd_wd(cursor, tpd_id, week_days)
         connection.commit()
 
     except Exception as error:
@@ -296,85 +1607,65 @@ def insert_into_db_tpd_wd(tpd_id, week_days):
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
+            release_connection(connection)
 
 def time_utc_to_local(utc_time_str):
-    if utc_time_str is None:
-        return None
-    if not isinstance(utc_time_str, str):
-        utc_time_str = utc_time_str.strftime('%H:%M:%S')
+    return timeconv.utc_to_local(utc_time_str)
 
-    # Pobierz aktualną datę
-    current_date = datetime.now(pytz.utc).date()
-    
-    # Połącz datę i czas, aby uzyskać pełny obiekt datetime w UTC
-    utc_time = datetime.combine(current_date, time.fromisoformat(utc_time_str)).replace(tzinfo=pytz.utc)
-    
-    # Pobierz lokalną strefę czasową
-    local_tz = get_localzone()
-    
-    # Przekształć czas UTC na lokalny czas
-    local_time = utc_time.astimezone(local_tz)
-    
-    return local_time.strftime('%H:%M:%S')
-    
 def time_local_to_utc(local_time_str):
-    if local_time_str is None:
-        return None
-    if not isinstance(local_time_str, str):
-        local_time_str = local_time_str.strftime('%H:%M:%S')
-
-    # Pobierz aktualną datę
-    current_date = datetime.now().date()
-    
-    # Pobierz lokalną strefę czasową
-    local_tz = get_localzone()
-    
-    # Połącz datę i czas, aby uzyskać pełny obiekt datetime w lokalnej strefie czasowej
-    local_time = datetime.combine(current_date, time.fromisoformat(local_time_str)).replace(tzinfo=local_tz)
-    
-    # Przekształć lokalny czas na czas UTC
-    utc_time = local_time.astimezone(pytz.utc)
-    
-    return utc_time.strftime('%H:%M:%S')
+    return timeconv.local_to_utc(local_time_str)
 
 def get_tt_id(tweet_time):
     """Retrieve tweet_time ID based on the tweet time."""
+    # Convert 'HH:MM' to 'HH:MM:SS' format to match database format
+    tweet_time_formatted = time_local_to_utc(f"{tweet_time}:00")
+    return _lookup_ids('tt', [tweet_time_formatted]).get(tweet_time_formatted)
+
+def _insert_tpd_tt(cursor, tpd_id, tweet_times):
+    """Link a post to its tweet times, adding times missing from tweet_times."""
+    if not tweet_times:
+        return
+
+    # Convert 'HH:MM' to 'HH:MM:SS' in UTC to match database format
+    utc_times = timeconv.local_to_utc_column([f"{time}:00" for time in tweet_times])
+    tt_ids = upsert_tweet_times(utc_times, cursor)
+
+    insert_sql = """
+    INSERT INTO {table_name} (tpd_id, tt_id)
+    SELECT %s, unnest(%s::integer[])
+    """
+    insert_query = sql.SQL(insert_sql).format(table_name=sql.Identifier(TABLE_NAME_TPD_TT))
+
+    cursor.execute(insert_query, (tpd_id, list(set(tt_ids.values()))))
+
+def insert_into_db_tpd_tt(tpd_id, tweet_times):
     connection = None
     cursor = None
-    tt_id = None
 
     try:
         connection = get_connection()
         cursor = connection.cursor()
 
-        select_sql = """
-        SELECT id FROM {table_name} WHERE time = %s
-        """
-        select_query = sql.SQL(select_sql).format(table_name=sql.Identifier(TABLE_NAME_TT))
-
-        # Convert 'HH:MM' to 'HH:MM:SS' format to match database format
-        tweet_time_formatted = f"{tweet_time}:00"
-        tweet_time_formatted = time_local_to_utc(tweet_time_formatted)
-        
-        cursor.execute(select_query, (tweet_time_formatted,))
-        result = cursor.fetchone()
-
-        if result:
-            tt_id = result[0]
+        _insert_tpd_tt(cursor, tpd_id, tweet_times)
+        connection.commit()
 
     except Exception as error:
-        print(f"Error retrieving tt ID: {error}")
+        print(f"Error saving to database(tpd_tt): {error}")
 
     finally:
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
+            release_connection(connection)
 
-    return tt_id
+def save_complete_tpd(name, text, is_random, media_files, week_days, tweet_times, progress_callback=None):
+    """Save a post with its media, week days and tweet times in one transaction.
 
-def insert_into_db_tpd_tt(tpd_id, tweet_times):
+    Every table gets a single set-based statement, so the number of round trips
+    does not depend on how many files, days or times the post has. Any failure
+    rolls the whole post back. Media uploads report progress through
+    progress_callback(bytes_sent, total_bytes).
+    """
     connection = None
     cursor = None
 
@@ -382,41 +1673,175 @@ def insert_into_db_tpd_tt(tpd_id, tweet_times):
         connection = get_connection()
         cursor = connection.cursor()
 
-        insert_sql = """
-        INSERT INTO {table_name} (tpd_id, tt_id)
-        VALUES (%s, %s)
-        """
-        insert_query = sql.SQL(insert_sql).format(table_name=sql.Identifier(TABLE_NAME_TPD_TT))
+        # Insert into TPD table and get the generated ID
+        tpd_id = _insert_tpd(cursor, name, text, is_random)
 
-        for time in tweet_times:
-            tt_id = get_tt_id(time)
-            if tt_id is not None:
-                cursor.execute(insert_query, (tpd_id, tt_id))
-            else:
-                print(f"Tweet time '{time}' not found in the tweet_times table.")
+        # Insert related data into other tables
+        _insert_media(cursor, tpd_id, media_files, progress_callback)
+        _insert_tpd_wd(cursor, tpd_id, week_days)
+        _insert_tpd_tt(cursor, tpd_id, tweet_times)
 
         connection.commit()
+        print("Done to insert into TPD table.")
+        return 0
 
     except Exception as error:
-        print(f"Error saving to database(tpd_tt): {error}")
+        print(f"Failed to insert into TPD table: {error}")
+        if connection:
+            connection.rollback()
+        # Cached ids may be stale or include rows added by the rolled back transaction
+        invalidate_lookup_cache()
+        return 1
 
     finally:
         if cursor:
             cursor.close()
         if connection:
-            connection.close()
+            release_connection(connection)
+
+def _copy_rows(cursor, table_name, columns, rows, null_columns=()):
+    """Load rows into a table with a single COPY FROM STDIN.
+
+    The csv module writes None as a quoted empty string, like ''; in
+    null_columns an empty string is loaded as NULL instead.
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC).writerows(rows)
+    buffer.seek(0)
+
+    copy_sql = "COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv{force_null})"
+    copy_query = sql.SQL(copy_sql).format(
+        table_name=sql.Identifier(table_name),
+        columns=sql.SQL(', ').join(map(sql.Identifier, columns)),
+        force_null=sql.SQL(", FORCE_NULL ({})").format(sql.SQL(', ').join(map(sql.Identifier, null_columns)))
+        if null_columns else sql.SQL('')
+    )
+    cursor.copy_expert(copy_query.as_string(cursor), buffer)
+
+def save_posts_batch(posts, progress_callback=None):
+    """Save many posts in one transaction through COPY into staging tables.
+
+    posts is a list of dicts with the arguments of save_complete_tpd (name,
+    text, is_random, media_files, week_days, tweet_times) and optionally a
+    submission_key (UUID string); posts whose key is already stored are
+    skipped, so a batch can be sent again safely. Post ids are taken from the
+    sequence up front, so the staging rows can reference them and every link
+    table is filled with one INSERT ... SELECT. Media files are uploaded per
+    post as in save_complete_tpd; progress_callback(bytes_done, total_bytes)
+    reports them over the whole batch, counting content the server already
+    has as done. Returns 0 on success, 1 if the batch was
+    rolled back because of its data (a constraint violation, an invalid value,
+    an unknown week day or a missing media file) and 2 if it was rolled back
+    for any other reason, such as a lost connection, which may pass on retry.
+    """
+    connection = None
+    cursor = None
 
-def save_complete_tpd(name, text, is_random, media_files, week_days, tweet_times):
-    # Insert into TPD table and get the generated ID
-    tpd_id = insert_into_db_tpd(name, text, is_random)
-    
-    if tpd_id:
-        # Insert related data into other tables
-        insert_into_db_media(tpd_id, media_files)
-        insert_into_db_tpd_wd(tpd_id, week_days)
-        insert_into_db_tpd_tt(tpd_id, tweet_times)
-        print("Done to insert into TPD table.")
+    try:
+        connection = get_connection()
+        cursor = connection.cursor()
+
+        for statement in STAGING_TABLES:
+            cursor.execute(statement)
+
+        keys = [post['submission_key'] for post in posts if post.get('submission_key')]
+        if keys:
+            stored_sql = "SELECT submission_key::text FROM {tpd} WHERE submission_key = ANY(%s::uuid[])"
+            cursor.execute(sql.SQL(stored_sql).format(tpd=sql.Identifier(TABLE_NAME_TPD)), (keys,))
+            stored_keys = {row[0] for row in cursor.fetchall()}
+            posts = [post for post in posts if post.get('submission_key') not in stored_keys]
+            if not posts:
+                connection.commit()
+                return 0
+
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(quote_ident(%s), 'id')) FROM generate_series(1, %s)",
+            (TABLE_NAME_TPD, len(posts))
+        )
+        tpd_ids = [row[0] for row in cursor.fetchall()]
+
+        post_rows = []
+        day_rows = []
+        time_rows = []
+        for tpd_id, post in zip(tpd_ids, posts):
+            post_rows.append((tpd_id, post['name'], post['text'], post['is_random'], post.get('submission_key')))
+            day_rows.extend((tpd_id, day) for day in post['week_days'])
+            time_rows.extend((tpd_id, f"{time}:00") for time in post['tweet_times'])
+
+        # Convert the whole batch of local 'HH:MM:SS' times to UTC at once
+        utc_times = timeconv.local_to_utc_column([time for _, time in time_rows])
+        time_rows = [(tpd_id, utc_time) for (tpd_id, _), utc_time in zip(time_rows, utc_times)]
+        upsert_tweet_times(list(dict.fromkeys(utc_times)), cursor)
+
+        _copy_rows(cursor, 'tid_staging_posts', ('tpd_id', 'name', 'text', 'is_random', 'submission_key'), post_rows,
+                   null_columns=('submission_key',))
+        _copy_rows(cursor, 'tid_staging_days', ('tpd_id', 'day_name'), day_rows)
+        _copy_rows(cursor, 'tid_staging_times', ('tpd_id', 'time'), time_rows)
+
+        unknown_sql = """
+        SELECT DISTINCT s.day_name FROM tid_staging_days s
+        WHERE NOT EXISTS (SELECT 1 FROM {wd} wd WHERE wd.day_name = s.day_name)
+        """
+        cursor.execute(sql.SQL(unknown_sql).format(wd=sql.Identifier(TABLE_NAME_WD)))
+        unknown_days = [row[0] for row in cursor.fetchall()]
+        if unknown_days:
+            raise ValueError(f"Week days not found in the week_days table: {', '.join(unknown_days)}")
+
+        insert_sql = """
+        INSERT INTO {tpd} (id, name, text, is_random, submission_key)
+        SELECT tpd_id, name, text, is_random, submission_key FROM tid_staging_posts;
+
+        INSERT INTO {tpd_wd} (tpd_id, wd_id)
+        SELECT DISTINCT s.tpd_id, wd.id FROM tid_staging_days s JOIN {wd} wd ON wd.day_name = s.day_name;
+
+        INSERT INTO {tpd_tt} (tpd_id, tt_id)
+        SELECT DISTINCT s.tpd_id, tt.id FROM tid_staging_times s JOIN {tt} tt ON tt.time = s.time;
+        """
+        cursor.execute(sql.SQL(insert_sql).format(
+            tpd=sql.Identifier(TABLE_NAME_TPD),
+            tpd_wd=sql.Identifier(TABLE_NAME_TPD_WD),
+            tpd_tt=sql.Identifier(TABLE_NAME_TPD_TT),
+            wd=sql.Identifier(TABLE_NAME_WD),
+            tt=sql.Identifier(TABLE_NAME_TT)
+        ))
+
+        batch_bytes = sum(os.path.getsize(media_file) for post in posts for media_file in post['media_files'])
+        done_bytes = 0
+        for tpd_id, post in zip(tpd_ids, posts):
+            post_progress = None
+            if progress_callback:
+                post_progress = lambda sent, total, done=done_bytes: progress_callback(done + sent, batch_bytes)
+            _insert_media(cursor, tpd_id, post['media_files'], post_progress)
+            if progress_callback and post['media_files']:
+                done_bytes += sum(os.path.getsize(media_file) for media_file in post['media_files'])
+                progress_callback(done_bytes, batch_bytes)
+
+        connection.commit()
         return 0
-    else:
-        print("Failed to insert into TPD table.")
+
+    except (psycopg2.IntegrityError, psycopg2.DataError, ValueError, OSError) as error:
+        print(f"Failed to insert batch of {len(posts)} posts: {error}")
+        if connection:
+            connection.rollback()
+        invalidate_lookup_cache()
         return 1
+
+    except Exception as error:
+        print(f"Failed to insert batch of {len(posts)} posts: {error}")
+        if connection and not connection.closed:
+            connection.rollback()
+        invalidate_lookup_cache()
+        return 2
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            release_connection(connection)
+
+# Time every public function and attribute its statements to it (metrics.py).
+# Pure time conversions and cache lookups are left out: they run per row.
+metrics.instrument_module(globals(), __name__, exclude={
+    'close_pool', 'get_direct_connection', 'hash_media_file', 'get_wd_id', 'get_tt_id',
+    'times_local_to_utc', 'times_utc_to_local', 'time_utc_to_local', 'time_local_to_utc',
+})
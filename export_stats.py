@@ -0,0 +1,68 @@
+"""Export stats joined with their post to CSV or Parquet, without the GUI.
+
+    python export_stats.py stats.csv --from 2024-01-01 --to 2024-01-31
+    python export_stats.py stats.parquet --status success
+    python export_stats.py - | gzip > stats.csv.gz
+
+The format follows the file extension unless --format is given; '-' writes
+CSV to stdout. Parquet needs pyarrow (pip install pyarrow). Rows are
+streamed, so memory use does not depend on the number of rows.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import date
+import db
+import metrics
+
+EXPORTERS = {
+    'csv': db.export_stats_csv,
+    'parquet': db.export_stats_parquet,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export stats to CSV or Parquet")
+    parser.add_argument('output', help="output file, or '-' for CSV on stdout")
+    parser.add_argument('--format', choices=sorted(EXPORTERS), help="default: from the file extension")
+    parser.add_argument('--from', dest='date_from', type=date.fromisoformat, help="first date (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='date_to', type=date.fromisoformat, help="last date (YYYY-MM-DD)")
+    parser.add_argument('--name', help="only posts whose name contains this text")
+    parser.add_argument('--status', help="only rows with this status")
+    args = parser.parse_args()
+    metrics.start_exporters()
+
+    file_format = args.format
+    if file_format is None:
+        file_format = 'parquet' if args.output.lower().endswith('.parquet') else 'csv'
+    if args.output == '-' and file_format != 'csv':
+        parser.error("only CSV can be written to stdout")
+
+    def progress(rows, total):
+        print(f"\r{rows:,} rows", end='', file=sys.stderr, flush=True)
+
+    started = time.monotonic()
+    to_stdout = args.output == '-'
+    file = sys.stdout.buffer if to_stdout else open(args.output, 'wb')
+    try:
+        exported = EXPORTERS[file_format](file, name=args.name, status=args.status,
+                                          date_from=args.date_from, date_to=args.date_to,
+                                          progress_callback=progress)
+    finally:
+        if not to_stdout:
+            file.close()
+        db.close_pool()
+
+    if exported is None:
+        if not to_stdout:
+            os.remove(args.output)
+        return 1
+
+    elapsed = time.monotonic() - started
+    print(f"\r{exported:,} rows exported in {elapsed:.1f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
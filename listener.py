@@ -0,0 +1,68 @@
+import json
+import os
+import select
+from PyQt6.QtCore import QThread, pyqtSignal
+from psycopg2 import sql
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from db import get_direct_connection, NOTIFY_CHANNEL
+
+# Seconds to wait before reconnecting after the listener connection dropped
+LISTEN_RECONNECT_SECONDS = float(os.getenv("LISTEN_RECONNECT_SECONDS", "10"))
+
+
+class ChangeListener(QThread):
+    """Hold a LISTEN connection and forward change notifications as signals.
+
+    changed(source, ids) is emitted for every NOTIFY sent by the change log
+    triggers; ids is None when the statement touched too many rows to list them.
+    connected/disconnected report the state of the connection so the window
+    can fall back to polling while it is down.
+    """
+
+    changed = pyqtSignal(str, object)
+    connected = pyqtSignal()
+    disconnected = pyqtSignal(str)
+
+    def run(self):
+        while not self.isInterruptionRequested():
+            connection = None
+            try:
+                connection = get_direct_connection()
+                connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with connection.cursor() as cursor:
+                    cursor.execute(sql.SQL("LISTEN {}").format(sql.Identifier(NOTIFY_CHANNEL)))
+                self.connected.emit()
+
+                while not self.isInterruptionRequested():
+                    # Wake up regularly to notice an interruption request
+                    if select.select([connection], [], [], 1.0) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self.handle_notify(connection.notifies.pop(0))
+
+            except Exception as error:
+                print(f"Change listener connection lost: {error}")
+                self.disconnected.emit(str(error))
+                self.wait_for_reconnect()
+
+            finally:
+                if connection:
+                    connection.close()
+
+    def handle_notify(self, notify):
+        try:
+            payload = json.loads(notify.payload)
+            self.changed.emit(payload['source'], payload.get('ids'))
+        except (ValueError, KeyError) as error:
+            print(f"Ignoring malformed change notification: {error}")
+
+    def wait_for_reconnect(self):
+        remaining = LISTEN_RECONNECT_SECONDS
+        while remaining > 0 and not self.isInterruptionRequested():
+            self.msleep(200)
+            remaining -= 0.2
+
+    def stop(self):
+        self.requestInterruption()
+        self.wait()
@@ -1,13 +1,17 @@
+import time
+STARTED_AT = time.perf_counter()
+
 import sys
 from PyQt6.QtWidgets import QApplication
+import metrics
 from ui import MainWindow
 
 def main():
+    metrics.start_exporters()
     app = QApplication(sys.argv)
-    window = MainWindow()
+    window = MainWindow(started_at=STARTED_AT)
     window.show()
     sys.exit(app.exec())
 
 if __name__ == '__main__':
     main()
-
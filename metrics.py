@@ -0,0 +1,565 @@
+"""Instrumentation of the database layer.
+
+Every public db.py function is wrapped by instrument_module() and every
+connection is an InstrumentedConnection, whose cursors time each execute,
+COPY, commit and rollback and count rows and bytes. Queries are attributed to
+the db.py function running on the same thread.
+
+The numbers are kept in REGISTRY and can be read as:
+  - Prometheus text: render_prometheus(), METRICS_FILE (rewritten every
+    METRICS_FILE_INTERVAL seconds) or an HTTP endpoint on METRICS_PORT
+  - structured logs: JSON lines on the 'tid.db' logger (slow queries and
+    errors as warnings, connections as info, every call as debug); METRICS_LOG
+    sends them to a file or '-' for stderr
+  - function_summary(), shown by the debug panel of the main window
+"""
+import atexit
+import bisect
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+import psycopg2.extensions
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Queries slower than this are logged as warnings
+SLOW_QUERY_SECONDS = float(os.getenv("DB_SLOW_QUERY_MS", "500")) / 1000
+
+# Estimate the bytes of fetched rows
+COUNT_BYTES = os.getenv("DB_METRICS_BYTES", "1").lower() in ("1", "true", "yes")
+BYTES_SAMPLE_ROWS = 500
+
+METRICS_FILE = os.getenv("METRICS_FILE")
+METRICS_FILE_INTERVAL = float(os.getenv("METRICS_FILE_INTERVAL", "15"))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_LOG = os.getenv("METRICS_LOG")
+METRICS_LOG_LEVEL = os.getenv("METRICS_LOG_LEVEL", "INFO").upper()
+
+logger = logging.getLogger("tid.db")
+# Events go nowhere unless METRICS_LOG attaches a handler (start_exporters)
+logger.addHandler(logging.NullHandler())
+
+HELP = {
+    'tid_db_function_duration_seconds': ("histogram", "Duration of db.py function calls"),
+    'tid_db_function_errors_total': ("counter", "db.py function calls that raised"),
+    'tid_db_query_duration_seconds': ("histogram", "Duration of statements (execute, COPY)"),
+    'tid_db_query_errors_total': ("counter", "Statements that failed"),
+    'tid_db_round_trips_total': ("counter", "Server round trips (statements, COPY, commit, rollback, large object I/O)"),
+    'tid_db_rows_total': ("counter", "Rows fetched or copied"),
+    'tid_db_bytes_sent_total': ("counter", "Bytes of statements and large object data sent"),
+    'tid_db_bytes_received_total': ("counter", "Approximate bytes of rows and large object data received"),
+    'tid_db_connections_opened_total': ("counter", "Database connections opened"),
+    'tid_db_connections_closed_total': ("counter", "Database connections closed"),
+    'tid_db_connections_in_use': ("gauge", "Pooled connections currently borrowed"),
+    'tid_db_pool_wait_seconds': ("histogram", "Time spent waiting for a pooled connection"),
+    'tid_startup_seconds': ("gauge", "Time from the start of main.py to a startup phase"),
+}
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (the maximum for the last bucket)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def copy(self):
+        histogram = Histogram()
+        histogram.counts = list(self.counts)
+        histogram.count, histogram.sum, histogram.max = self.count, self.sum, self.max
+        return histogram
+
+
+class Registry:
+    """Thread-safe counters, gauges and histograms keyed by name and labels."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.gauges = defaultdict(float)
+        self.reset()
+
+    def reset(self):
+        """Clear counters and histograms; gauges describe the current state and are kept."""
+        with self.lock:
+            self.counters = defaultdict(float)
+            self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] += value
+
+    def set_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def add_gauge(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] += value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self.lock:
+            return (dict(self.counters), dict(self.gauges),
+                    {key: histogram.copy() for key, histogram in self.histograms.items()})
+
+
+REGISTRY = Registry()
+
+_context = threading.local()
+
+
+def _frames():
+    frames = getattr(_context, 'frames', None)
+    if frames is None:
+        frames = _context.frames = []
+    return frames
+
+
+def current_function():
+    frames = _frames()
+    return frames[-1]['function'] if frames else 'other'
+
+
+def _account(function, round_trips=0, rows=0, sent=0, received=0):
+    if round_trips:
+        REGISTRY.inc('tid_db_round_trips_total', round_trips, function=function)
+    if rows:
+        REGISTRY.inc('tid_db_rows_total', rows, function=function)
+    if sent:
+        REGISTRY.inc('tid_db_bytes_sent_total', sent, function=function)
+    if received:
+        REGISTRY.inc('tid_db_bytes_received_total', received, function=function)
+    # Per-call totals for the debug log line of the running function
+    for frame in _frames():
+        frame['round_trips'] += round_trips
+        frame['rows'] += rows
+
+
+def log_event(level, event, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, json.dumps(dict({'ts': round(time.time(), 3), 'event': event}, **fields), default=str))
+
+
+def _row_bytes(rows):
+    if not COUNT_BYTES or not rows:
+        return 0
+    # Large fetches are extrapolated from a sample of their rows
+    sample = rows[:BYTES_SAMPLE_ROWS]
+    size = 0
+    for row in sample:
+        for value in row:
+            if isinstance(value, (str, bytes, bytearray, memoryview)):
+                size += len(value)
+            elif value is not None:
+                size += 8
+    return size * len(rows) // len(sample)
+
+
+def _query_text(cursor, query):
+    # The statement as written, never with the bound values: those hold the users' posts
+    text = query
+    if isinstance(text, bytes):
+        return text.decode('utf-8', 'replace')
+    if isinstance(text, str):
+        return text
+    try:
+        return text.as_string(cursor)
+    except Exception:
+        return str(text)
+
+
+class InstrumentedCursorMixin:
+    def _timed(self, kind, call, query):
+        function = current_function()
+        started = time.perf_counter()
+        try:
+            result = call()
+        except Exception as error:
+            elapsed = time.perf_counter() - started
+            REGISTRY.observe('tid_db_query_duration_seconds', elapsed, function=function)
+            REGISTRY.inc('tid_db_query_errors_total', function=function)
+            _account(function, round_trips=1)
+            log_event(logging.WARNING, 'query_error', function=function, kind=kind, ms=round(elapsed * 1000, 3),
+                      error=str(error).strip(), query=_query_text(self, query)[:2000])
+            raise
+
+        elapsed = time.perf_counter() - started
+        REGISTRY.observe('tid_db_query_duration_seconds', elapsed, function=function)
+        sent = len(self.query) if isinstance(self.query, bytes) else 0
+        rows = self.rowcount if kind == 'copy' and self.rowcount > 0 else 0
+        _account(function, round_trips=1, rows=rows, sent=sent)
+        if elapsed >= SLOW_QUERY_SECONDS:
+            log_event(logging.WARNING, 'slow_query', function=function, kind=kind, ms=round(elapsed * 1000, 3),
+                      rowcount=self.rowcount, query=_query_text(self, query)[:2000])
+        return result
+
+    def execute(self, query, vars=None):
+        return self._timed('execute', lambda: super(InstrumentedCursorMixin, self).execute(query, vars), query)
+
+    def executemany(self, query, vars_list):
+        return self._timed('executemany', lambda: super(InstrumentedCursorMixin, self).executemany(query, vars_list),
+                           query)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._timed('copy', lambda: super(InstrumentedCursorMixin, self).copy_expert(sql, file, size), sql)
+
+    def _fetched(self, rows):
+        # Named cursors go back to the server for every fetch
+        round_trips = 1 if self.name else 0
+        _account(current_function(), round_trips=round_trips, rows=len(rows), received=_row_bytes(rows))
+        return rows
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self._fetched([row])
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        return self._fetched(rows)
+
+    def fetchall(self):
+        return self._fetched(super().fetchall())
+
+
+_cursor_classes = {}
+_cursor_classes_lock = threading.Lock()
+
+
+def instrumented_cursor_class(cursor_class):
+    """Return a subclass of cursor_class (plain, DictCursor, ...) that records metrics."""
+    if issubclass(cursor_class, InstrumentedCursorMixin):
+        return cursor_class
+    with _cursor_classes_lock:
+        instrumented = _cursor_classes.get(cursor_class)
+        if instrumented is None:
+            instrumented = type(f"Instrumented{cursor_class.__name__}", (InstrumentedCursorMixin, cursor_class), {})
+            _cursor_classes[cursor_class] = instrumented
+        return instrumented
+
+
+class InstrumentedLargeObject(psycopg2.extensions.lobject):
+    def write(self, data):
+        function = current_function()
+        written = super().write(data)
+        _account(function, round_trips=1, sent=written)
+        return written
+
+    def read(self, size=-1):
+        data = super().read(size)
+        _account(current_function(), round_trips=1, received=len(data))
+        return data
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Connection factory for psycopg2.connect() and the pool recording metrics."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        REGISTRY.inc('tid_db_connections_opened_total')
+        log_event(logging.INFO, 'connection_opened', function=current_function(), host=self.info.host)
+
+    def cursor(self, *args, **kwargs):
+        cursor_factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        kwargs['cursor_factory'] = instrumented_cursor_class(cursor_factory)
+        return super().cursor(*args, **kwargs)
+
+    def lobject(self, oid=0, mode='', new_oid=0, new_file=None, lobject_factory=InstrumentedLargeObject):
+        lobject = super().lobject(oid, mode, new_oid, new_file, lobject_factory)
+        _account(current_function(), round_trips=1)
+        return lobject
+
+    def _timed(self, call):
+        function = current_function()
+        started = time.perf_counter()
+        try:
+            return call()
+        finally:
+            REGISTRY.observe('tid_db_query_duration_seconds', time.perf_counter() - started, function=function)
+            _account(function, round_trips=1)
+
+    def commit(self):
+        self._timed(super().commit)
+
+    def rollback(self):
+        # Nothing is sent when no transaction is open
+        if self.status == psycopg2.extensions.STATUS_READY:
+            return super().rollback()
+        self._timed(super().rollback)
+
+    def close(self):
+        if not self.closed:
+            REGISTRY.inc('tid_db_connections_closed_total')
+            log_event(logging.INFO, 'connection_closed', function=current_function())
+        super().close()
+
+
+def connection_borrowed(wait_seconds):
+    REGISTRY.observe('tid_db_pool_wait_seconds', wait_seconds)
+    REGISTRY.add_gauge('tid_db_connections_in_use', 1)
+
+
+def connection_returned():
+    REGISTRY.add_gauge('tid_db_connections_in_use', -1)
+
+
+def record_startup(phase, seconds):
+    """Record how long after start-up a phase (window_shown, first_data) was reached."""
+    REGISTRY.set_gauge('tid_startup_seconds', seconds, phase=phase)
+    log_event(logging.INFO, 'startup', phase=phase, ms=round(seconds * 1000, 1))
+
+
+def startup_summary():
+    _, gauges, _ = REGISTRY.snapshot()
+    return {dict(labels)['phase']: round(value * 1000) for (name, labels), value in gauges.items()
+            if name == 'tid_startup_seconds'}
+
+
+def _begin(function):
+    frame = {'function': function, 'round_trips': 0, 'rows': 0, 'started': time.perf_counter()}
+    _frames().append(frame)
+    return frame
+
+
+def _end(frame, error=None):
+    _frames().pop()
+    elapsed = time.perf_counter() - frame['started']
+    REGISTRY.observe('tid_db_function_duration_seconds', elapsed, function=frame['function'])
+    if error is not None:
+        REGISTRY.inc('tid_db_function_errors_total', function=frame['function'])
+        log_event(logging.WARNING, 'call_error', function=frame['function'], ms=round(elapsed * 1000, 3),
+                  error=str(error))
+    else:
+        log_event(logging.DEBUG, 'call', function=frame['function'], ms=round(elapsed * 1000, 3),
+                  round_trips=frame['round_trips'], rows=frame['rows'])
+
+
+def instrument(fn):
+    """Time calls of fn and attribute the statements it runs to it."""
+    name = fn.__name__
+
+    if inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            # Timed from the first to the last item; statements run between items are attributed too
+            iterator = fn(*args, **kwargs)
+            try:
+                while True:
+                    frame = _begin(name)
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        _end(frame)
+                        return
+                    except Exception as error:
+                        _end(frame, error)
+                        raise
+                    _end(frame)
+                    yield item
+            finally:
+                # Closing the wrapper runs the cleanup of fn right away
+                iterator.close()
+        return generator_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        frame = _begin(name)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as error:
+            _end(frame, error)
+            raise
+        _end(frame)
+        return result
+
+    wrapper.__wrapped_by_metrics__ = True
+    return wrapper
+
+
+def instrument_module(namespace, module_name, exclude=()):
+    """Wrap every public function defined in a module with instrument()."""
+    for name, value in list(namespace.items()):
+        if (name.startswith('_') or name in exclude or not inspect.isfunction(value)
+                or value.__module__ != module_name or getattr(value, '__wrapped_by_metrics__', False)):
+            continue
+        namespace[name] = instrument(value)
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{str(value)}"' for key, value in pairs) + "}"
+
+
+def render_prometheus():
+    """Return all metrics in the Prometheus text exposition format."""
+    counters, gauges, histograms = REGISTRY.snapshot()
+    series = defaultdict(list)
+    for (name, labels), value in sorted(counters.items()):
+        series[name].append(f"{name}{_labels(labels)} {value:g}")
+    for (name, labels), value in sorted(gauges.items()):
+        series[name].append(f"{name}{_labels(labels)} {value:g}")
+    for (name, labels), histogram in sorted(histograms.items(), key=lambda item: item[0]):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float('inf') else f"{bound:g}"
+            series[name].append(f"{name}_bucket{_labels(labels, [('le', le)])} {cumulative}")
+        series[name].append(f"{name}_sum{_labels(labels)} {histogram.sum:.6f}")
+        series[name].append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+    lines = []
+    for name in sorted(series):
+        metric_type, help_text = HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(series[name])
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file(path):
+    # Written aside and renamed, so a scraper never reads half a file
+    temporary = f"{path}.tmp"
+    with open(temporary, 'w') as file:
+        file.write(render_prometheus())
+    os.replace(temporary, path)
+
+
+def function_summary():
+    """Per-function rows for the debug panel.
+
+    (function, calls, errors, avg ms, p50 ms, p95 ms, max ms, round trips,
+    rows, kB sent, kB received), slowest total time first.
+    """
+    counters, _, histograms = REGISTRY.snapshot()
+    per_function = defaultdict(dict)
+    for (name, labels), value in counters.items():
+        labels = dict(labels)
+        if 'function' in labels:
+            per_function[labels['function']][name] = value
+
+    rows = []
+    for (name, labels), histogram in histograms.items():
+        if name != 'tid_db_function_duration_seconds':
+            continue
+        function = dict(labels)['function']
+        values = per_function.get(function, {})
+        rows.append((
+            function,
+            histogram.count,
+            int(values.get('tid_db_function_errors_total', 0)),
+            round(histogram.sum / histogram.count * 1000, 1) if histogram.count else 0.0,
+            round(histogram.quantile(0.5) * 1000, 1),
+            round(histogram.quantile(0.95) * 1000, 1),
+            round(histogram.max * 1000, 1),
+            int(values.get('tid_db_round_trips_total', 0)),
+            int(values.get('tid_db_rows_total', 0)),
+            round(values.get('tid_db_bytes_sent_total', 0) / 1024, 1),
+            round(values.get('tid_db_bytes_received_total', 0) / 1024, 1),
+            histogram.sum,
+        ))
+    rows.sort(key=lambda row: row[-1], reverse=True)
+    return [row[:-1] for row in rows]
+
+
+def connection_summary():
+    counters, gauges, histograms = REGISTRY.snapshot()
+    wait = histograms.get(('tid_db_pool_wait_seconds', ()))
+    return {
+        'opened': int(counters.get(('tid_db_connections_opened_total', ()), 0)),
+        'closed': int(counters.get(('tid_db_connections_closed_total', ()), 0)),
+        'in_use': int(gauges.get(('tid_db_connections_in_use', ()), 0)),
+        'pool_wait_p95_ms': round(wait.quantile(0.95) * 1000, 1) if wait else 0.0,
+    }
+
+
+_exporters_started = False
+
+
+def start_exporters():
+    """Start the exporters configured in the environment (log file, metrics file, HTTP endpoint)."""
+    global _exporters_started
+    if _exporters_started:
+        return
+    _exporters_started = True
+
+    if METRICS_LOG:
+        handler = logging.StreamHandler() if METRICS_LOG == '-' else logging.FileHandler(METRICS_LOG)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(METRICS_LOG_LEVEL)
+        logger.propagate = False
+
+    if METRICS_FILE:
+        def write_periodically():
+            while True:
+                try:
+                    write_prometheus_file(METRICS_FILE)
+                except OSError as error:
+                    print(f"Error writing metrics file: {error}")
+                time.sleep(METRICS_FILE_INTERVAL)
+        threading.Thread(target=write_periodically, name="metrics-file", daemon=True).start()
+        # The last numbers of short runs (bulk_import.py, export_stats.py) are kept too
+        atexit.register(write_prometheus_file, METRICS_FILE)
+
+    if METRICS_PORT:
+        # Imported here, it is slow to import and only needed for the endpoint
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = render_prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
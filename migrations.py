@@ -0,0 +1,559 @@
+"""Versioned schema migrations for the TID database.
+
+Applied versions are recorded in the schema_migrations table. The application
+applies pending migrations when it opens its connection pool; they can also be
+run by hand:
+
+    python migrations.py status           # applied and pending versions
+    python migrations.py migrate          # apply pending migrations
+    python migrations.py check-indexes    # report queries without a usable index
+"""
+import argparse
+import json
+import sys
+from psycopg2 import sql
+import db
+
+MIGRATIONS_TABLE = "schema_migrations"
+
+# Key for pg_advisory_lock, so two clients starting at once don't migrate concurrently
+MIGRATIONS_LOCK_ID = 0x7469645f6d6967
+
+# (table key, change log source, id column) for the statement-level change log triggers
+CHANGE_LOG_SOURCES = [
+    ('tpd', 'tpd', 'id'),
+    ('media', 'tpd', 'tpd_id'),
+    ('tpd_wd', 'tpd', 'tpd_id'),
+    ('tpd_tt', 'tpd', 'tpd_id'),
+    ('stats', 'stats', 'id'),
+]
+
+# (table key, column) of every reference column the application looks rows up by
+FOREIGN_KEY_COLUMNS = [
+    ('media', 'tpd_id'),
+    ('media', 'blob_sha256'),
+    ('tpd_wd', 'tpd_id'),
+    ('tpd_wd', 'wd_id'),
+    ('tpd_tt', 'tpd_id'),
+    ('tpd_tt', 'tt_id'),
+    ('stats', 'tpd_id'),
+    ('stats', 'wd_id'),
+]
+
+
+def _change_log_triggers():
+    statements = []
+    for table, source, column in CHANGE_LOG_SOURCES:
+        for op, referencing in (('INSERT', 'NEW TABLE AS new_rows'),
+                                ('UPDATE', 'NEW TABLE AS new_rows OLD TABLE AS old_rows'),
+                                ('DELETE', 'OLD TABLE AS old_rows')):
+            statements.append(f"""
+            DO $$
+            BEGIN
+                IF NOT EXISTS (
+                    SELECT 1 FROM pg_trigger WHERE tgname = 'tid_log_{op.lower()}' AND tgrelid = '{{{table}}}'::regclass
+                ) THEN
+                    CREATE TRIGGER tid_log_{op.lower()} AFTER {op} ON {{{table}}}
+                    REFERENCING {referencing}
+                    FOR EACH STATEMENT EXECUTE PROCEDURE tid_log_changes('{source}', '{column}', {{change_log_name}});
+                END IF;
+            END
+            $$
+            """)
+    return statements
+
+
+def _stats_rollup_triggers():
+    statements = []
+    for op, referencing in (('INSERT', 'REFERENCING NEW TABLE AS new_rows'),
+                            ('UPDATE', 'REFERENCING NEW TABLE AS new_rows OLD TABLE AS old_rows'),
+                            ('DELETE', 'REFERENCING OLD TABLE AS old_rows'),
+                            ('TRUNCATE', '')):
+        statements.append(f"""
+        DO $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger WHERE tgname = 'tid_rollup_{op.lower()}' AND tgrelid = '{{stats}}'::regclass
+            ) THEN
+                CREATE TRIGGER tid_rollup_{op.lower()} AFTER {op} ON {{stats}}
+                {referencing}
+                FOR EACH STATEMENT EXECUTE PROCEDURE tid_stats_rollup();
+            END IF;
+        END
+        $$
+        """)
+    return statements
+
+
+def _foreign_key_indexes():
+    return [f"CREATE INDEX IF NOT EXISTS tid_{table}_{column}_idx ON {{{table}}} ({column})"
+            for table, column in FOREIGN_KEY_COLUMNS]
+
+
+# pg_trgm ships with the PostgreSQL contrib package, and creating it needs the
+# CREATE privilege on the database; without it search still works, scanning
+# the tables, and check-indexes reports the missing indexes.
+# Once the indexes exist this only looks them up, so it is run again on every
+# apply_migrations (see RETRIED_MIGRATIONS) and picks up contrib installed later.
+TRIGRAM_INDEXES = """
+DO $$
+DECLARE
+    trgm_schema text;
+BEGIN
+    IF to_regclass('tid_tpd_name_trgm_idx') IS NOT NULL AND to_regclass('tid_tpd_text_trgm_idx') IS NOT NULL
+       AND to_regclass('tid_media_name_trgm_idx') IS NOT NULL THEN
+        RETURN;
+    END IF;
+    IF NOT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        IF NOT EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+            RAISE WARNING 'pg_trgm is not available, post search is not indexed';
+            RETURN;
+        END IF;
+        BEGIN
+            CREATE EXTENSION pg_trgm;
+        -- No CREATE on the database, or on any schema in the search path
+        EXCEPTION WHEN insufficient_privilege OR invalid_schema_name THEN
+            RAISE WARNING 'not allowed to create the pg_trgm extension, post search is not indexed';
+            RETURN;
+        END;
+    END IF;
+
+    -- The extension may live in a schema outside the search path
+    SELECT extnamespace::regnamespace::text INTO trgm_schema FROM pg_extension WHERE extname = 'pg_trgm';
+    EXECUTE format('CREATE INDEX IF NOT EXISTS tid_tpd_name_trgm_idx ON {tpd} USING gin (name %s.gin_trgm_ops)',
+                   trgm_schema);
+    EXECUTE format('CREATE INDEX IF NOT EXISTS tid_tpd_text_trgm_idx ON {tpd} USING gin (text %s.gin_trgm_ops)',
+                   trgm_schema);
+    EXECUTE format('CREATE INDEX IF NOT EXISTS tid_media_name_trgm_idx ON {media} '
+                   'USING gin (media_name %s.gin_trgm_ops)', trgm_schema);
+END
+$$
+"""
+
+
+# (version, description, statements). Statements are formatted with the table
+# names from .env and must leave an existing database intact: the tables of
+# version 1 predate this module and already exist on older installations.
+# Never edit a released migration; add a new one instead.
+MIGRATIONS = [
+    (1, "Baseline tables", [
+        "CREATE TABLE IF NOT EXISTS {tpd} (id serial PRIMARY KEY, name text, text text, is_random boolean DEFAULT false)",
+        "CREATE TABLE IF NOT EXISTS {wd} (id serial PRIMARY KEY, day_name text)",
+        "CREATE TABLE IF NOT EXISTS {tt} (id serial PRIMARY KEY, time time)",
+        """
+        CREATE TABLE IF NOT EXISTS {media} (
+            id serial PRIMARY KEY,
+            tpd_id integer REFERENCES {tpd} (id),
+            media_name text,
+            media_type text,
+            media_data bytea
+        )
+        """,
+        "CREATE TABLE IF NOT EXISTS {tpd_wd} (id serial PRIMARY KEY, tpd_id integer REFERENCES {tpd} (id), wd_id integer REFERENCES {wd} (id))",
+        "CREATE TABLE IF NOT EXISTS {tpd_tt} (id serial PRIMARY KEY, tpd_id integer REFERENCES {tpd} (id), tt_id integer REFERENCES {tt} (id))",
+        """
+        CREATE TABLE IF NOT EXISTS {stats} (
+            id serial PRIMARY KEY,
+            tpd_id integer REFERENCES {tpd} (id),
+            date date,
+            time time,
+            wd_id integer REFERENCES {wd} (id),
+            status text
+        )
+        """,
+        """
+        INSERT INTO {wd} (day_name)
+        SELECT day_name FROM unnest(ARRAY['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']) AS d(day_name)
+        WHERE NOT EXISTS (SELECT 1 FROM {wd})
+        """,
+    ]),
+    (2, "Media content in large objects, stored once per SHA-256", [
+        # Media content is kept in a large object referenced by media_oid; media_data is only used by older rows
+        "ALTER TABLE {media} ADD COLUMN IF NOT EXISTS media_oid oid",
+        """
+        CREATE TABLE IF NOT EXISTS {media_blobs} (
+            sha256 char(64) PRIMARY KEY,
+            media_oid oid NOT NULL,
+            size bigint NOT NULL,
+            ref_count integer NOT NULL DEFAULT 0
+        )
+        """,
+        "ALTER TABLE {media} ADD COLUMN IF NOT EXISTS blob_sha256 char(64) REFERENCES {media_blobs} (sha256)",
+    ]),
+    (3, "Change log and NOTIFY triggers for incremental refresh", [
+        """
+        CREATE TABLE IF NOT EXISTS {change_log} (
+            id bigserial PRIMARY KEY,
+            txid bigint NOT NULL DEFAULT txid_current(),
+            source text NOT NULL,
+            row_id integer NOT NULL,
+            op char(1) NOT NULL,
+            changed_at timestamptz NOT NULL DEFAULT now()
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS change_log_txid_idx ON {change_log} (txid)",
+        """
+        CREATE OR REPLACE FUNCTION tid_log_changes() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            changed integer[] := ARRAY[]::integer[];
+            removed integer[] := ARRAY[]::integer[];
+        BEGIN
+            -- TG_ARGV: change log source, id column of the changed table, change log table
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                EXECUTE format('SELECT COALESCE(array_agg(DISTINCT %I), ARRAY[]::integer[]) FROM new_rows', TG_ARGV[1]) INTO changed;
+            END IF;
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                EXECUTE format('SELECT COALESCE(array_agg(DISTINCT %I), ARRAY[]::integer[]) FROM old_rows', TG_ARGV[1]) INTO removed;
+                changed := ARRAY(SELECT DISTINCT unnest(changed || removed));
+            END IF;
+            IF cardinality(changed) = 0 THEN
+                RETURN NULL;
+            END IF;
+
+            EXECUTE format('INSERT INTO %I (source, row_id, op) SELECT $1, unnest($2), $3', TG_ARGV[2])
+            USING TG_ARGV[0], changed, left(TG_OP, 1);
+
+            -- Listeners get the ids directly unless the payload would get too large
+            PERFORM pg_notify({notify_channel}, json_build_object(
+                'source', TG_ARGV[0],
+                'op', left(TG_OP, 1),
+                'ids', CASE WHEN cardinality(changed) <= 500 THEN changed END
+            )::text);
+            RETURN NULL;
+        END
+        $$
+        """,
+    ] + _change_log_triggers()),
+    (4, "Indexes on reference columns, dictionary lookups and the stats order", [
+        # Merge duplicate dictionary entries so the unique indexes can be built
+        """
+        WITH duplicates AS (
+            SELECT id, min(id) OVER (PARTITION BY time) AS keep_id FROM {tt}
+        )
+        UPDATE {tpd_tt} x SET tt_id = d.keep_id FROM duplicates d WHERE x.tt_id = d.id AND d.id <> d.keep_id
+        """,
+        "DELETE FROM {tt} a USING {tt} b WHERE a.time = b.time AND a.id > b.id",
+        """
+        WITH duplicates AS (
+            SELECT id, min(id) OVER (PARTITION BY day_name) AS keep_id FROM {wd}
+        )
+        UPDATE {tpd_wd} x SET wd_id = d.keep_id FROM duplicates d WHERE x.wd_id = d.id AND d.id <> d.keep_id
+        """,
+        """
+        WITH duplicates AS (
+            SELECT id, min(id) OVER (PARTITION BY day_name) AS keep_id FROM {wd}
+        )
+        UPDATE {stats} x SET wd_id = d.keep_id FROM duplicates d WHERE x.wd_id = d.id AND d.id <> d.keep_id
+        """,
+        "DELETE FROM {wd} a USING {wd} b WHERE a.day_name = b.day_name AND a.id > b.id",
+        "CREATE UNIQUE INDEX IF NOT EXISTS tid_tt_time_key ON {tt} (time)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS tid_wd_day_name_key ON {wd} (day_name)",
+        # Matches ORDER BY date DESC, time DESC, id DESC of the Statistics pages
+        "CREATE INDEX IF NOT EXISTS tid_stats_date_time_idx ON {stats} (date, time, id)",
+    ] + _foreign_key_indexes()),
+    (5, "Stats rollups per post, date and status and per week day, hour and status", [
+        """
+        CREATE TABLE IF NOT EXISTS {stats_daily} (
+            tpd_id integer NOT NULL,
+            date date NOT NULL,
+            status text NOT NULL,
+            count bigint NOT NULL,
+            PRIMARY KEY (tpd_id, date, status)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS {stats_hourly} (
+            wd_id integer NOT NULL,
+            hour smallint NOT NULL,
+            status text NOT NULL,
+            count bigint NOT NULL,
+            PRIMARY KEY (wd_id, hour, status)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS tid_stats_daily_date_idx ON {stats_daily} (date)",
+        """
+        CREATE OR REPLACE FUNCTION tid_stats_rollup() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            delta text;
+        BEGIN
+            IF TG_OP = 'TRUNCATE' THEN
+                TRUNCATE {stats_daily}, {stats_hourly};
+                RETURN NULL;
+            END IF;
+
+            -- Rows added by the statement count +1, rows removed -1
+            delta := CASE TG_OP
+                WHEN 'INSERT' THEN 'SELECT tpd_id, date, time, wd_id, status, 1 AS sign FROM new_rows'
+                WHEN 'DELETE' THEN 'SELECT tpd_id, date, time, wd_id, status, -1 AS sign FROM old_rows'
+                ELSE 'SELECT tpd_id, date, time, wd_id, status, 1 AS sign FROM new_rows
+                      UNION ALL SELECT tpd_id, date, time, wd_id, status, -1 FROM old_rows'
+            END;
+
+            EXECUTE format($sql$
+                INSERT INTO {stats_daily} AS r (tpd_id, date, status, count)
+                SELECT tpd_id, date, COALESCE(status, ''), sum(sign) FROM (%s) d
+                WHERE tpd_id IS NOT NULL AND date IS NOT NULL
+                GROUP BY 1, 2, 3 HAVING sum(sign) <> 0
+                ON CONFLICT (tpd_id, date, status) DO UPDATE SET count = r.count + EXCLUDED.count
+            $sql$, delta);
+
+            EXECUTE format($sql$
+                INSERT INTO {stats_hourly} AS r (wd_id, hour, status, count)
+                SELECT wd_id, extract(hour FROM time), COALESCE(status, ''), sum(sign) FROM (%s) d
+                WHERE wd_id IS NOT NULL AND time IS NOT NULL
+                GROUP BY 1, 2, 3 HAVING sum(sign) <> 0
+                ON CONFLICT (wd_id, hour, status) DO UPDATE SET count = r.count + EXCLUDED.count
+            $sql$, delta);
+            RETURN NULL;
+        END
+        $$
+        """,
+        # Keep rows from being added while the rollups are filled from the existing ones
+        "LOCK TABLE {stats} IN SHARE ROW EXCLUSIVE MODE",
+    ] + _stats_rollup_triggers() + [
+        """
+        INSERT INTO {stats_daily} (tpd_id, date, status, count)
+        SELECT tpd_id, date, COALESCE(status, ''), count(*) FROM {stats}
+        WHERE tpd_id IS NOT NULL AND date IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT DO NOTHING
+        """,
+        """
+        INSERT INTO {stats_hourly} (wd_id, hour, status, count)
+        SELECT wd_id, extract(hour FROM time), COALESCE(status, ''), count(*) FROM {stats}
+        WHERE wd_id IS NOT NULL AND time IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT DO NOTHING
+        """,
+    ]),
+    (6, "Idempotency key of posts sent from the local submission queue", [
+        "ALTER TABLE {tpd} ADD COLUMN IF NOT EXISTS submission_key uuid",
+        "CREATE UNIQUE INDEX IF NOT EXISTS tid_tpd_submission_key_key ON {tpd} (submission_key)",
+    ]),
+    (7, "Trigram indexes for post search", [TRIGRAM_INDEXES]),
+]
+
+# Versions whose statements apply_migrations runs again after they are recorded:
+# they depend on something the server may lack when they are first applied, and
+# do nothing once they have taken effect
+RETRIED_MIGRATIONS = {7}
+
+# Queries the application runs with a selective condition; each should be able
+# to use an index. The EXPLAIN check runs them with sequential scans disabled,
+# so a Seq Scan left in the plan means no index fits the query.
+INDEX_CHECKS = [
+    ("media of a post", "SELECT id FROM {media} WHERE tpd_id = 1", 'media'),
+    ("week days of a post", "SELECT wd_id FROM {tpd_wd} WHERE tpd_id = 1", 'tpd_wd'),
+    ("tweet times of a post", "SELECT tt_id FROM {tpd_tt} WHERE tpd_id = 1", 'tpd_tt'),
+    ("stats of a post", "SELECT id FROM {stats} WHERE tpd_id = 1", 'stats'),
+    ("posts using a week day", "SELECT tpd_id FROM {tpd_wd} WHERE wd_id = 1", 'tpd_wd'),
+    ("posts using a tweet time", "SELECT tpd_id FROM {tpd_tt} WHERE tt_id = 1", 'tpd_tt'),
+    ("stats on a week day", "SELECT id FROM {stats} WHERE wd_id = 1", 'stats'),
+    ("media sharing a blob", "SELECT id FROM {media} WHERE blob_sha256 = repeat('0', 64)::char(64)", 'media'),
+    ("tweet time lookup", "SELECT id FROM {tt} WHERE time = '12:00'", 'tt'),
+    ("week day lookup", "SELECT id FROM {wd} WHERE day_name = 'Monday'", 'wd'),
+    ("first stats page",
+     "SELECT id FROM {stats} s ORDER BY s.date DESC, s.time DESC, s.id DESC LIMIT 200", 'stats'),
+    ("next stats page",
+     "SELECT id FROM {stats} s WHERE (s.date, s.time, s.id) < ('2024-01-01', '12:00', 1) "
+     "ORDER BY s.date DESC, s.time DESC, s.id DESC LIMIT 200", 'stats'),
+    ("post by submission key",
+     "SELECT id FROM {tpd} WHERE submission_key = '00000000-0000-0000-0000-000000000000'", 'tpd'),
+    ("post search", "SELECT id FROM {tpd} WHERE name ILIKE '%post%' OR text ILIKE '%post%'", 'tpd'),
+    ("media search", "SELECT tpd_id FROM {media} WHERE media_name ILIKE '%file%'", 'media'),
+    ("change log delta", "SELECT row_id FROM {change_log} WHERE source = 'tpd' AND txid >= 1", 'change_log'),
+]
+
+
+def _table_names():
+    return {
+        'tpd': db.TABLE_NAME_TPD,
+        'media': db.TABLE_NAME_MEDIA,
+        'tpd_wd': db.TABLE_NAME_TPD_WD,
+        'tpd_tt': db.TABLE_NAME_TPD_TT,
+        'wd': db.TABLE_NAME_WD,
+        'tt': db.TABLE_NAME_TT,
+        'stats': db.TABLE_NAME_STATS,
+        'media_blobs': db.TABLE_NAME_MEDIA_BLOBS,
+        'change_log': db.TABLE_NAME_CHANGE_LOG,
+        'stats_daily': db.TABLE_NAME_STATS_DAILY,
+        'stats_hourly': db.TABLE_NAME_STATS_HOURLY,
+    }
+
+
+def _schema_names():
+    names = {key: sql.Identifier(table) for key, table in _table_names().items()}
+    names['change_log_name'] = sql.Literal(db.TABLE_NAME_CHANGE_LOG)
+    names['notify_channel'] = sql.Literal(db.NOTIFY_CHANNEL)
+    return names
+
+
+def _applied_versions(cursor):
+    create_sql = """
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        version integer PRIMARY KEY,
+        description text NOT NULL,
+        applied_at timestamptz NOT NULL DEFAULT now()
+    )
+    """
+    cursor.execute(sql.SQL(create_sql).format(table_name=sql.Identifier(MIGRATIONS_TABLE)))
+    cursor.execute(sql.SQL("SELECT version, applied_at FROM {table_name}").format(
+        table_name=sql.Identifier(MIGRATIONS_TABLE)))
+    return dict(cursor.fetchall())
+
+
+def pending_migrations(connection):
+    """Return the (version, description) of the migrations not applied yet; changes nothing."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", (MIGRATIONS_TABLE,))
+        applied = _applied_versions(cursor) if cursor.fetchone()[0] else {}
+    connection.commit()
+    return [(version, description) for version, description, _ in MIGRATIONS if version not in applied]
+
+
+def apply_migrations(connection, target=None):
+    """Apply pending migrations up to target (all by default), each in its own transaction.
+
+    Returns the list of versions applied. A failing migration is rolled back
+    and the error is raised; the migrations before it stay applied. The
+    statements of RETRIED_MIGRATIONS applied earlier are run again.
+    """
+    names = _schema_names()
+    applied_now = []
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATIONS_LOCK_ID,))
+        try:
+            applied = _applied_versions(cursor)
+            connection.commit()
+
+            for version, description, statements in MIGRATIONS:
+                if version in applied or (target is not None and version > target):
+                    continue
+                try:
+                    for statement in statements:
+                        cursor.execute(sql.SQL(statement).format(**names))
+                    cursor.execute(
+                        sql.SQL("INSERT INTO {table_name} (version, description) VALUES (%s, %s)").format(
+                            table_name=sql.Identifier(MIGRATIONS_TABLE)),
+                        (version, description)
+                    )
+                    connection.commit()
+                except Exception:
+                    connection.rollback()
+                    raise
+                applied_now.append(version)
+
+            for version, description, statements in MIGRATIONS:
+                if version in RETRIED_MIGRATIONS and version in applied:
+                    try:
+                        for statement in statements:
+                            cursor.execute(sql.SQL(statement).format(**names))
+                        connection.commit()
+                    except Exception:
+                        connection.rollback()
+                        raise
+        finally:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATIONS_LOCK_ID,))
+            connection.commit()
+
+    return applied_now
+
+
+def _seq_scans(plan, found=None):
+    found = [] if found is None else found
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan)
+    for child in plan.get('Plans', []):
+        _seq_scans(child, found)
+    return found
+
+
+def report_missing_indexes(connection):
+    """Return a list of (problem, detail) pairs for lookups without a usable index.
+
+    Reference columns are checked in the catalog (no index starting with the
+    column), and the queries in INDEX_CHECKS with EXPLAIN. Nothing is changed.
+    """
+    tables = _table_names()
+    names = _schema_names()
+    problems = []
+
+    with connection.cursor() as cursor:
+        index_sql = """
+        SELECT 1
+        FROM pg_index i
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = to_regclass(%s) AND a.attname = %s
+        """
+        for table, column in FOREIGN_KEY_COLUMNS:
+            cursor.execute(index_sql, (tables[table], column))
+            if cursor.fetchone() is None:
+                problems.append((f"{tables[table]}.{column}", "no index starts with this column"))
+
+        for description, query, table in INDEX_CHECKS:
+            try:
+                # Only scans with no index to use are left once seq scans are heavily penalised
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute(sql.SQL("EXPLAIN (FORMAT JSON) ") + sql.SQL(query).format(**names))
+                plan = cursor.fetchone()[0][0]['Plan']
+            except Exception as error:
+                problems.append((description, f"could not be explained: {error}"))
+                connection.rollback()
+                continue
+            connection.rollback()
+
+            for node in _seq_scans(plan):
+                if node.get('Relation Name') == tables[table]:
+                    condition = node.get('Filter') or "full scan"
+                    problems.append((description, f"Seq Scan on {tables[table]} ({condition})"))
+
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TID database migrations")
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('status', help="list applied and pending migrations")
+    migrate = commands.add_parser('migrate', help="apply pending migrations")
+    migrate.add_argument('--target', type=int, help="stop after this version")
+    check = commands.add_parser('check-indexes', help="report lookups without a usable index (EXPLAIN)")
+    check.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    connection = db.get_direct_connection()
+    try:
+        if args.command == 'status':
+            with connection.cursor() as cursor:
+                applied = _applied_versions(cursor)
+            connection.commit()
+            for version, description, _ in MIGRATIONS:
+                state = f"applied {applied[version]:%Y-%m-%d %H:%M}" if version in applied else "pending"
+                print(f"{version:4}  {state:24}  {description}")
+            return 0
+
+        if args.command == 'migrate':
+            try:
+                versions = apply_migrations(connection, args.target)
+            except Exception as error:
+                print(f"Migration failed: {error}")
+                return 1
+            print(f"Applied: {', '.join(map(str, versions))}" if versions else "Database is up to date")
+            return 0
+
+        problems = report_missing_indexes(connection)
+        if args.json:
+            print(json.dumps([{'check': check, 'problem': detail} for check, detail in problems], indent=2))
+        else:
+            for check, detail in problems:
+                print(f"{check}: {detail}")
+            if not problems:
+                print("Every checked lookup can use an index")
+        return 1 if problems else 0
+
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
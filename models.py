@@ -0,0 +1,175 @@
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+
+
+class RowTableModel(QAbstractTableModel):
+    """Table model keeping rows as plain tuples and rendering cells on demand.
+
+    The first column is the row id. Rows already held in memory are exposed to
+    the view in batches as the user scrolls; when they run out, fetch_more() is
+    called to load the next batch from its source. fetch_more() either returns
+    a (rows, has_more) pair, or None when it loads the batch asynchronously and
+    hands it over later through append_rows() (or fetch_failed()).
+    """
+
+    def __init__(self, headers, fetch_more=None, batch_size=200, parent=None):
+        super().__init__(parent)
+        self.headers = list(headers)
+        self.fetch_more = fetch_more
+        self.batch_size = batch_size
+        self.rows = []
+        self.visible_rows = 0
+        self.has_more = False
+        self.fetching = False
+        self.row_index = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.visible_rows
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.headers)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        return str(self.rows[index.row()][index.column()])
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
+            return self.headers[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return False
+        if self.visible_rows < len(self.rows):
+            return True
+        return self.has_more and self.fetch_more is not None and not self.fetching
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        if self.visible_rows >= len(self.rows):
+            self.fetching = True
+            result = self.fetch_more()
+            if result is None:
+                return
+            self.fetching = False
+            rows, self.has_more = result
+            self.rows.extend(tuple(row) for row in rows)
+            self._reindex(self.visible_rows)
+        self._expose(self.visible_rows + self.batch_size)
+
+    def fetch_failed(self):
+        """Allow fetchMore() to be retried after an asynchronous fetch failed."""
+        self.fetching = False
+
+    def row_id(self, row):
+        return self.rows[row][0]
+
+    def row_count_loaded(self):
+        return len(self.rows)
+
+    def set_rows(self, rows, has_more=False):
+        """Replace all rows, e.g. after the filters changed."""
+        self.beginResetModel()
+        self.rows = [tuple(row) for row in rows]
+        self.visible_rows = min(len(self.rows), self.batch_size)
+        self.has_more = has_more
+        self.fetching = False
+        self._reindex()
+        self.endResetModel()
+
+    def append_rows(self, rows, has_more=False):
+        """Add rows fetched elsewhere (e.g. asynchronously) after the loaded ones."""
+        self.rows.extend(tuple(row) for row in rows)
+        self.has_more = has_more
+        self.fetching = False
+        self._reindex(self.visible_rows)
+        self._expose(self.visible_rows + self.batch_size)
+
+    def replace_rows(self, rows):
+        """Bring the model in line with a fresh result set without a reset.
+
+        Unchanged rows are left alone, changed rows are updated in place, new rows
+        are appended and rows missing from the result set are removed.
+        """
+        rows = [tuple(row) for row in rows]
+        new_ids = {row[0] for row in rows}
+        self.remove_ids([row_id for row_id in self.row_index if row_id not in new_ids])
+        self.upsert_rows(rows)
+
+    def upsert_rows(self, rows, at_top=False):
+        """Update rows with known ids in place and add the others.
+
+        New rows are appended, or inserted above the existing ones with at_top
+        (for tables sorted newest first).
+        """
+        new_rows = []
+        for row in rows:
+            row = tuple(row)
+            position = self.row_index.get(row[0])
+            if position is None:
+                new_rows.append(row)
+            elif self.rows[position] != row:
+                self.rows[position] = row
+                if position < self.visible_rows:
+                    self.dataChanged.emit(
+                        self.index(position, 0),
+                        self.index(position, len(self.headers) - 1)
+                    )
+
+        if new_rows and at_top:
+            self.beginInsertRows(QModelIndex(), 0, len(new_rows) - 1)
+            self.rows[0:0] = new_rows
+            self.visible_rows += len(new_rows)
+            self._reindex()
+            self.endInsertRows()
+        elif new_rows:
+            expose_all = self.visible_rows == len(self.rows)
+            self.rows.extend(new_rows)
+            self._reindex(len(self.rows) - len(new_rows))
+            if expose_all:
+                self._expose(len(self.rows))
+
+    def remove_ids(self, row_ids):
+        """Remove the rows with the given ids, in as few contiguous blocks as possible."""
+        positions = sorted((self.row_index.pop(row_id) for row_id in set(row_ids) if row_id in self.row_index),
+                           reverse=True)
+        if not positions:
+            return
+
+        # Group descending positions into contiguous blocks
+        blocks = []
+        for position in positions:
+            if blocks and blocks[-1][0] == position + 1:
+                blocks[-1][0] = position
+            else:
+                blocks.append([position, position])
+
+        for first, last in blocks:
+            visible_last = min(last, self.visible_rows - 1)
+            if first < self.visible_rows:
+                self.beginRemoveRows(QModelIndex(), first, visible_last)
+            del self.rows[first:last + 1]
+            if first < self.visible_rows:
+                self.visible_rows -= visible_last - first + 1
+                self.endRemoveRows()
+
+        self._reindex(positions[-1])
+
+    def _expose(self, count):
+        count = min(count, len(self.rows))
+        if count > self.visible_rows:
+            self.beginInsertRows(QModelIndex(), self.visible_rows, count - 1)
+            self.visible_rows = count
+            self.endInsertRows()
+
+    def _reindex(self, start=0):
+        if start == 0:
+            self.row_index = {}
+        for position in range(start, len(self.rows)):
+            self.row_index[self.rows[position][0]] = position
@@ -0,0 +1,133 @@
+"""In-memory index of when posts fire.
+
+A post fires on each of its week days at each of its tweet times, read as the
+local wall-clock times shown in View Data. Posts are bucketed by minute of the
+week (Monday 00:00 is 0), and the occupied minutes are kept sorted, so the
+posts firing in any time range are found with two binary searches instead of a
+scan over every post; slots recur every week, so the range simply wraps.
+
+Posts with is_random set compete for their slot: when several random posts
+share a minute, one of them is picked. The pick is seeded by the slot, so the
+same slot always previews the same post.
+"""
+import bisect
+import functools
+import random
+from datetime import datetime, timedelta
+
+# Index of each day name, as returned by datetime.weekday()
+WEEK_DAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+DAY_INDEX = {day: index for index, day in enumerate(WEEK_DAYS)}
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+@functools.lru_cache(maxsize=None)
+def _minute_of_day(time_value):
+    # 'HH:MM[:SS]' strings as well as datetime.time
+    if isinstance(time_value, str):
+        return int(time_value[0:2]) * 60 + int(time_value[3:5])
+    return time_value.hour * 60 + time_value.minute
+
+
+class ScheduleIndex:
+    def __init__(self, rows=()):
+        # post id -> (name, is_random, minutes of the week it fires at)
+        self.posts = {}
+        # minute of the week -> ids of the posts firing then
+        self.fixed = {}
+        self.random = {}
+        # Sorted minutes of the week with at least one post
+        self.minutes = []
+        self.load(rows)
+
+    def __len__(self):
+        return len(self.posts)
+
+    def load(self, rows):
+        """Replace the index with (id, name, is_random, week_days, tweet_times) rows."""
+        self.posts = {}
+        self.fixed = {}
+        self.random = {}
+        for post_id, name, is_random, week_days, tweet_times in rows:
+            self._insert(post_id, name, is_random, week_days, tweet_times)
+        self.minutes = sorted(self.fixed.keys() | self.random.keys())
+
+    def add_post(self, post_id, name, is_random, week_days, tweet_times):
+        """Add a post, or update it if it's already in the index."""
+        self.remove_post(post_id)
+        for minute in self._insert(post_id, name, is_random, week_days, tweet_times):
+            position = bisect.bisect_left(self.minutes, minute)
+            if position == len(self.minutes) or self.minutes[position] != minute:
+                self.minutes.insert(position, minute)
+
+    def remove_post(self, post_id):
+        post = self.posts.pop(post_id, None)
+        if post is None:
+            return
+        name, is_random, slots = post
+        buckets = self.random if is_random else self.fixed
+        for minute in slots:
+            bucket = buckets[minute]
+            bucket.discard(post_id)
+            if not bucket:
+                del buckets[minute]
+                if minute not in self.fixed and minute not in self.random:
+                    del self.minutes[bisect.bisect_left(self.minutes, minute)]
+
+    def _insert(self, post_id, name, is_random, week_days, tweet_times):
+        day_starts = [DAY_INDEX[day] * MINUTES_PER_DAY for day in week_days if day in DAY_INDEX]
+        day_minutes = {_minute_of_day(time_value) for time_value in tweet_times}
+        slots = sorted({day_start + minute for day_start in day_starts for minute in day_minutes})
+        self.posts[post_id] = (name, bool(is_random), slots)
+        buckets = self.random if is_random else self.fixed
+        for minute in slots:
+            bucket = buckets.get(minute)
+            if bucket is None:
+                buckets[minute] = {post_id}
+            else:
+                bucket.add(post_id)
+        return slots
+
+    def _slots(self, start):
+        # (when, minute of the week) of every occupied slot from start on, in order
+        start = start.replace(second=0, microsecond=0)
+        week_start = (start - timedelta(days=start.weekday())).replace(hour=0, minute=0)
+        offset = start.weekday() * MINUTES_PER_DAY + start.hour * 60 + start.minute
+        while self.minutes:
+            position = bisect.bisect_left(self.minutes, offset)
+            for minute in self.minutes[position:]:
+                yield week_start + timedelta(minutes=minute), minute
+            week_start += timedelta(days=7)
+            offset = 0
+
+    def _fire(self, when, minute):
+        # (when, id, name, is_random) of the posts firing at a slot
+        fired = sorted(self.fixed.get(minute, ()))
+        candidates = self.random.get(minute)
+        if candidates:
+            seed = when.toordinal() * MINUTES_PER_DAY + when.hour * 60 + when.minute
+            fired.append(random.Random(seed).choice(sorted(candidates)))
+        return [(when, post_id, self.posts[post_id][0], self.posts[post_id][1]) for post_id in fired]
+
+    def upcoming(self, start, end):
+        """Return (when, id, name, is_random) of the posts firing from start until before end, in order.
+
+        start and end are naive local datetimes.
+        """
+        fired = []
+        for when, minute in self._slots(start):
+            if when >= end:
+                break
+            fired.extend(self._fire(when, minute))
+        return fired
+
+    def next_slots(self, count, start=None):
+        """Return the next count (when, id, name, is_random) firings from start (now by default)."""
+        fired = []
+        for when, minute in self._slots(start or datetime.now()):
+            if len(fired) >= count:
+                break
+            fired.extend(self._fire(when, minute))
+        return fired[:count]
@@ -0,0 +1,82 @@
+"""Search over the posts shown in View Data.
+
+A query matches the posts in which each of its words occurs in the name, the
+text or a media file name, ignoring case ("ips" finds "Lorem Ipsum"). The
+database answers it with ILIKE on pg_trgm indexes (db.search_posts);
+SearchIndex answers it from the rows already loaded.
+
+SearchIndex is an inverted index filled on demand: the first time a word is
+searched for, the texts of all posts are checked for it once and the ids of the
+posts containing it are kept. As the user types, each new word contains the
+one searched for a keystroke earlier, so only that word's posts are checked.
+Added and removed posts update the words already indexed, so the index never
+has to be rebuilt, and building it costs nothing but lowercasing the texts.
+"""
+from textutil import words
+
+# Words kept in the index; the oldest are dropped first
+MAX_INDEXED_WORDS = 256
+
+
+class SearchIndex:
+    def __init__(self, posts=()):
+        # post id -> its texts, lowercase, one per line
+        self.texts = {post_id: self._text(texts) for post_id, texts in posts}
+        # word -> ids of the posts containing it (insertion ordered, oldest first)
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.texts)
+
+    @staticmethod
+    def _text(texts):
+        return "\n".join(text for text in texts if text).lower()
+
+    def add_post(self, post_id, texts):
+        """Index the texts (name, text, media names) of a post, replacing what it had."""
+        text = self._text(texts)
+        self.texts[post_id] = text
+        for word, posting in self.postings.items():
+            if word in text:
+                posting.add(post_id)
+            else:
+                posting.discard(post_id)
+
+    def remove_post(self, post_id):
+        if self.texts.pop(post_id, None) is None:
+            return
+        for posting in self.postings.values():
+            posting.discard(post_id)
+
+    def _posts_with(self, word):
+        posting = self.postings.get(word)
+        if posting is not None:
+            return posting
+
+        # A word contained in this one matches every post this one matches, and more;
+        # checking most of the posts one by one is slower than scanning them all
+        candidates = min((posting for indexed, posting in self.postings.items() if indexed in word),
+                         key=len, default=None)
+        if candidates is not None and len(candidates) < len(self.texts) // 2:
+            posting = {post_id for post_id in candidates if word in self.texts[post_id]}
+        else:
+            posting = {post_id for post_id, text in self.texts.items() if word in text}
+
+        if len(self.postings) >= MAX_INDEXED_WORDS:
+            del self.postings[next(iter(self.postings))]
+        self.postings[word] = posting
+        return posting
+
+    def search(self, query):
+        """Return the ids of the posts matching the query, in ascending order."""
+        # The longest word is usually the most selective one
+        terms = sorted(words(query), key=len, reverse=True)
+        if not terms:
+            return []
+        found = self._posts_with(terms[0])
+        for term in terms[1:]:
+            if term in self.postings or len(found) >= len(self.texts) // 2:
+                found = found & self._posts_with(term)
+            else:
+                found = {post_id for post_id in found if term in self.texts[post_id]}
+        return sorted(found)
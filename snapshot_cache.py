@@ -0,0 +1,156 @@
+"""On-disk cache of the last View Data and Statistics results.
+
+Tabs are drawn from the snapshot as soon as it is read, then revalidated in
+the background: the snapshot's change log watermark lets the window fetch only
+what changed since it was saved instead of everything.
+
+Snapshots live in an SQLite file in the user's data directory
+(SNAPSHOT_CACHE_PATH). Each is keyed by its kind (view_data, stats), the
+parameters of the query (filters), the database it came from and the local
+time zone, and carries the schema version it was written with; snapshots of
+another schema version are dropped. When the file grows past
+SNAPSHOT_CACHE_MAX_MB, the least recently used snapshots are evicted.
+"""
+import json
+import os
+import pickle
+import sqlite3
+import time
+import zlib
+import db
+import timeconv
+from appdata import user_data_path
+from migrations import MIGRATIONS
+
+# Bump when the layout of the cached rows changes
+SNAPSHOT_FORMAT = 1
+SCHEMA_VERSION = f"{SNAPSHOT_FORMAT}.{MIGRATIONS[-1][0]}"
+
+SNAPSHOT_CACHE = os.getenv("SNAPSHOT_CACHE", "1").lower() in ("1", "true", "yes")
+SNAPSHOT_CACHE_MAX_BYTES = int(float(os.getenv("SNAPSHOT_CACHE_MAX_MB", "200")) * 1024 * 1024)
+SNAPSHOT_CACHE_PATH = os.getenv("SNAPSHOT_CACHE_PATH") or user_data_path("snapshots.sqlite3")
+
+
+def _connect():
+    os.makedirs(os.path.dirname(os.path.abspath(SNAPSHOT_CACHE_PATH)), exist_ok=True)
+    connection = sqlite3.connect(SNAPSHOT_CACHE_PATH, timeout=10)
+    # Evicted snapshots give their space back to the file system (only takes effect on a new file)
+    connection.execute("PRAGMA auto_vacuum=FULL")
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS snapshots (
+            key TEXT PRIMARY KEY,
+            schema_version TEXT NOT NULL,
+            watermark INTEGER,
+            synced_at REAL NOT NULL,
+            used_at REAL NOT NULL,
+            size INTEGER NOT NULL,
+            payload BLOB NOT NULL
+        )
+    """)
+    return connection
+
+
+def _key(kind, params):
+    # A snapshot is only valid for the database and time zone it was read with
+    return json.dumps({
+        'kind': kind,
+        'params': params or {},
+        'database': [db.DB_HOST, db.DB_PORT, db.DB_NAME, db.TABLE_NAME_TPD, db.TABLE_NAME_STATS,
+                     os.getenv("PGOPTIONS", "")],
+        'zone': timeconv.local_zone_name(),
+    }, sort_keys=True, default=str)
+
+
+def load_snapshot(kind, params=None):
+    """Return (watermark, synced_at, payload) of the cached snapshot, or None."""
+    if not SNAPSHOT_CACHE:
+        return None
+    connection = None
+    try:
+        connection = _connect()
+        key = _key(kind, params)
+        row = connection.execute("SELECT schema_version, watermark, synced_at, payload FROM snapshots WHERE key = ?",
+                                 (key,)).fetchone()
+        if row is None:
+            return None
+        schema_version, watermark, synced_at, payload = row
+        if schema_version != SCHEMA_VERSION:
+            connection.execute("DELETE FROM snapshots WHERE key = ?", (key,))
+            connection.commit()
+            return None
+        connection.execute("UPDATE snapshots SET used_at = ? WHERE key = ?", (time.time(), key))
+        connection.commit()
+        return watermark, synced_at, pickle.loads(zlib.decompress(payload))
+
+    except Exception as error:
+        print(f"Error reading snapshot cache: {error}")
+        return None
+
+    finally:
+        if connection:
+            connection.close()
+
+
+def save_snapshot(kind, watermark, synced_at, payload, params=None):
+    """Store a snapshot, evicting the least recently used ones over the size limit.
+
+    synced_at is when the data was last brought up to date with the database,
+    so a stale snapshot can be reloaded in full instead of revalidated.
+    """
+    if not SNAPSHOT_CACHE:
+        return 0
+    connection = None
+    try:
+        data = zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        if len(data) > SNAPSHOT_CACHE_MAX_BYTES:
+            print(f"Snapshot of {kind} ({len(data)} bytes) is over the cache size limit, not saved")
+            return 1
+
+        connection = _connect()
+        now = time.time()
+        connection.execute("""
+            INSERT INTO snapshots (key, schema_version, watermark, synced_at, used_at, size, payload)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET schema_version = excluded.schema_version,
+                watermark = excluded.watermark, synced_at = excluded.synced_at, used_at = excluded.used_at,
+                size = excluded.size, payload = excluded.payload
+        """, (_key(kind, params), SCHEMA_VERSION, watermark, synced_at, now, len(data), data))
+
+        total = 0
+        evicted = []
+        for key, size in connection.execute("SELECT key, size FROM snapshots ORDER BY used_at DESC").fetchall():
+            total += size
+            if total > SNAPSHOT_CACHE_MAX_BYTES:
+                evicted.append((key,))
+        connection.executemany("DELETE FROM snapshots WHERE key = ?", evicted)
+        connection.commit()
+        return 0
+
+    except Exception as error:
+        print(f"Error writing snapshot cache: {error}")
+        return 1
+
+    finally:
+        if connection:
+            connection.close()
+
+
+def clear_snapshots():
+    if not os.path.exists(SNAPSHOT_CACHE_PATH):
+        return 0
+    connection = None
+    try:
+        connection = _connect()
+        connection.execute("DELETE FROM snapshots")
+        connection.commit()
+        connection.execute("VACUUM")
+        return 0
+
+    except Exception as error:
+        print(f"Error clearing snapshot cache: {error}")
+        return 1
+
+    finally:
+        if connection:
+            connection.close()
@@ -0,0 +1,264 @@
+"""Durable local queue of posts entered in the Add Data tab.
+
+A submission is written to an SQLite file in the user's data directory,
+together with copies of its media files, before it is acknowledged; the
+database is only contacted later by flush_submissions(), which the window
+runs in the background. Every submission carries a random submission_key that
+is stored with the post, so a batch that reached the server but whose commit
+was never confirmed can be sent again without creating duplicates.
+
+First attempts are sent in batches of SUBMISSION_BATCH_SIZE; a submission
+that failed is retried on its own with exponential back-off, so one bad entry
+can't hold up the others. A submission the database rejects on its own (a
+constraint violation, an unknown week day...) is marked failed at once, and
+one that still can't be sent after SUBMISSION_MAX_ATTEMPTS attempts is marked
+failed too; failed submissions are kept, but no longer sent or counted as
+pending, until the user discards them.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from db import save_posts_batch
+from appdata import user_data_path
+
+SUBMISSION_QUEUE_PATH = os.getenv("SUBMISSION_QUEUE_PATH") or user_data_path("submissions.sqlite3")
+SUBMISSION_MEDIA_DIR = os.path.join(os.path.dirname(os.path.abspath(SUBMISSION_QUEUE_PATH)), "submission_media")
+
+SUBMISSION_BATCH_SIZE = int(os.getenv("SUBMISSION_BATCH_SIZE", "20"))
+SUBMISSION_RETRY_SECONDS = float(os.getenv("SUBMISSION_RETRY_SECONDS", "5"))
+SUBMISSION_RETRY_MAX_SECONDS = float(os.getenv("SUBMISSION_RETRY_MAX_SECONDS", "600"))
+SUBMISSION_MAX_ATTEMPTS = int(os.getenv("SUBMISSION_MAX_ATTEMPTS", "20"))
+
+# A flusher owns the submissions it picked for this long (another instance of
+# the application may flush the same queue)
+SUBMISSION_LEASE_SECONDS = 600
+
+
+def _connect():
+    os.makedirs(os.path.dirname(os.path.abspath(SUBMISSION_QUEUE_PATH)), exist_ok=True)
+    connection = sqlite3.connect(SUBMISSION_QUEUE_PATH, timeout=30, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    # An acknowledged submission must survive a power cut
+    connection.execute("PRAGMA synchronous=FULL")
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS submissions (
+            key TEXT PRIMARY KEY,
+            created_at REAL NOT NULL,
+            post TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            claimed_until REAL NOT NULL DEFAULT 0,
+            failed_at REAL,
+            failure TEXT
+        )
+    """)
+    # Queues written before failed submissions were tracked
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(submissions)")}
+    if 'failed_at' not in columns:
+        connection.execute("ALTER TABLE submissions ADD COLUMN failed_at REAL")
+        connection.execute("ALTER TABLE submissions ADD COLUMN failure TEXT")
+    return connection
+
+
+def _copy_durably(source, destination):
+    with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+        shutil.copyfileobj(source_file, destination_file, 1024 * 1024)
+        destination_file.flush()
+        os.fsync(destination_file.fileno())
+
+
+def enqueue_submission(name, text, is_random, media_files, week_days, tweet_times):
+    """Store a post in the queue; return its submission key, or None on error."""
+    key = str(uuid.uuid4())
+    media_dir = os.path.join(SUBMISSION_MEDIA_DIR, key)
+    connection = None
+
+    try:
+        # Each file gets its own directory, so files with the same name keep it
+        queued_files = []
+        for index, media_file in enumerate(media_files):
+            file_dir = os.path.join(media_dir, str(index))
+            os.makedirs(file_dir)
+            queued_file = os.path.join(file_dir, os.path.basename(media_file))
+            _copy_durably(media_file, queued_file)
+            queued_files.append(queued_file)
+
+        post = {
+            'name': name,
+            'text': text,
+            'is_random': is_random,
+            'media_files': queued_files,
+            'week_days': list(week_days),
+            'tweet_times': list(tweet_times),
+        }
+        now = time.time()
+        connection = _connect()
+        connection.execute("INSERT INTO submissions (key, created_at, post, next_attempt_at) VALUES (?, ?, ?, ?)",
+                           (key, now, json.dumps(post), now))
+        return key
+
+    except Exception as error:
+        print(f"Error queueing submission: {error}")
+        shutil.rmtree(media_dir, ignore_errors=True)
+        return None
+
+    finally:
+        if connection:
+            connection.close()
+
+
+def _claim(connection, batch_size):
+    """Pick the next submissions to send and lease them; [] when none is due."""
+    now = time.time()
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        due = "failed_at IS NULL AND next_attempt_at <= ? AND claimed_until <= ?"
+        rows = connection.execute(
+            f"SELECT key, post FROM submissions WHERE {due} AND attempts = 0 ORDER BY created_at LIMIT ?",
+            (now, now, batch_size)
+        ).fetchall()
+        if not rows:
+            rows = connection.execute(
+                f"SELECT key, post FROM submissions WHERE {due} ORDER BY next_attempt_at LIMIT 1",
+                (now, now)
+            ).fetchall()
+        connection.executemany("UPDATE submissions SET claimed_until = ? WHERE key = ?",
+                               [(now + SUBMISSION_LEASE_SECONDS, key) for key, _ in rows])
+        connection.execute("COMMIT")
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+    return rows
+
+
+def _mark_failed(connection, keys, failure):
+    connection.executemany("UPDATE submissions SET failed_at = ?, failure = ?, claimed_until = 0 WHERE key = ?",
+                           [(time.time(), failure, key) for key in keys])
+
+
+def _failed(connection):
+    return connection.execute(
+        "SELECT key, post, failure FROM submissions WHERE failed_at IS NOT NULL ORDER BY created_at"
+    ).fetchall()
+
+
+def _pending(connection):
+    return connection.execute("SELECT count(*) FROM submissions WHERE failed_at IS NULL").fetchone()[0]
+
+
+def flush_submissions(batch_size=SUBMISSION_BATCH_SIZE, progress_callback=None):
+    """Send the due submissions to the database.
+
+    Stops at the first batch that fails for a reason other than its data (the
+    database is likely unreachable). Returns (sent, pending, failed), failed
+    being the list of failed_submissions(), or None if the queue could not be
+    read. progress_callback(bytes_done, total_bytes) reports the media upload
+    of each batch, as in save_posts_batch.
+    """
+    connection = None
+    sent = 0
+
+    try:
+        connection = _connect()
+        while True:
+            rows = _claim(connection, batch_size)
+            if not rows:
+                break
+
+            keys = [key for key, _ in rows]
+            posts = [dict(json.loads(post), submission_key=key) for key, post in rows]
+            result = save_posts_batch(posts, progress_callback)
+            if result == 1 and len(keys) == 1:
+                # Sending it again would fail the same way
+                _mark_failed(connection, keys, "rejected by the database")
+                continue
+            if result == 1:
+                # One of the posts is at fault; retry them one by one right away
+                connection.executemany("UPDATE submissions SET attempts = attempts + 1, claimed_until = 0 WHERE key = ?",
+                                       [(key,) for key in keys])
+                continue
+            if result != 0:
+                now = time.time()
+                connection.executemany("""
+                    UPDATE submissions SET attempts = attempts + 1, claimed_until = 0,
+                        next_attempt_at = ? + min(? * (1 << min(attempts, 20)), ?)
+                    WHERE key = ?
+                """, [(now, SUBMISSION_RETRY_SECONDS, SUBMISSION_RETRY_MAX_SECONDS, key) for key in keys])
+                given_up = connection.execute(
+                    f"SELECT key FROM submissions WHERE attempts >= ? AND key IN ({', '.join('?' * len(keys))})",
+                    (SUBMISSION_MAX_ATTEMPTS, *keys)
+                ).fetchall()
+                _mark_failed(connection, [key for key, in given_up],
+                             f"could not be sent in {SUBMISSION_MAX_ATTEMPTS} attempts")
+                break
+
+            connection.executemany("DELETE FROM submissions WHERE key = ?", [(key,) for key in keys])
+            for key in keys:
+                shutil.rmtree(os.path.join(SUBMISSION_MEDIA_DIR, key), ignore_errors=True)
+            sent += len(keys)
+
+        return sent, _pending(connection), [(key, json.loads(post)['name'], failure)
+                                            for key, post, failure in _failed(connection)]
+
+    except Exception as error:
+        print(f"Error flushing submission queue: {error}")
+        return None
+
+    finally:
+        if connection:
+            connection.close()
+
+
+def pending_submissions():
+    """Number of submissions waiting to be sent, or None on error."""
+    connection = None
+    try:
+        connection = _connect()
+        return _pending(connection)
+
+    except Exception as error:
+        print(f"Error reading submission queue: {error}")
+        return None
+
+    finally:
+        if connection:
+            connection.close()
+
+
+def failed_submissions():
+    """(key, name, reason) of the submissions given up on, oldest first, or None on error."""
+    connection = None
+    try:
+        connection = _connect()
+        return [(key, json.loads(post)['name'], failure) for key, post, failure in _failed(connection)]
+
+    except Exception as error:
+        print(f"Error reading submission queue: {error}")
+        return None
+
+    finally:
+        if connection:
+            connection.close()
+
+
+def discard_submissions(keys):
+    """Remove failed submissions and their media copies; return 0 on success, 1 on error."""
+    connection = None
+    try:
+        connection = _connect()
+        for key in keys:
+            # Only failed submissions: a pending one may be being sent right now
+            if connection.execute("DELETE FROM submissions WHERE key = ? AND failed_at IS NOT NULL", (key,)).rowcount:
+                shutil.rmtree(os.path.join(SUBMISSION_MEDIA_DIR, key), ignore_errors=True)
+        return 0
+
+    except Exception as error:
+        print(f"Error discarding submissions: {error}")
+        return 1
+
+    finally:
+        if connection:
+            connection.close()
@@ -0,0 +1,9 @@
+"""Text helpers shared by the database queries and the UI."""
+import re
+
+WORD = re.compile(r"\w+")
+
+
+def words(text):
+    """Distinct lowercase words of a text, in order."""
+    return list(dict.fromkeys(WORD.findall(text.lower()))) if text else []
@@ -0,0 +1,125 @@
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from tzlocal import get_localzone
+
+MINUTES_PER_DAY = 24 * 60
+
+_zone = None
+
+
+def local_zone():
+    """Return the local time zone, resolved once per process."""
+    global _zone
+    if _zone is None:
+        _zone = get_localzone()
+    return _zone
+
+
+def local_zone_name():
+    """Return the IANA name of the local zone (e.g. 'Europe/Warsaw') when known, else its str()."""
+    zone = local_zone()
+    return getattr(zone, 'key', None) or getattr(zone, 'zone', None) or str(zone)
+
+
+_sql_zone_name = None
+_sql_zone_checked = False
+
+
+def sql_zone_name(cursor):
+    """Return the local zone name if the database recognises it, else None.
+
+    tzlocal may only know the zone by an abbreviation or a fixed offset, which
+    AT TIME ZONE rejects; callers then convert in Python. The name is checked
+    against pg_timezone_names once per process.
+    """
+    global _sql_zone_name, _sql_zone_checked
+    if not _sql_zone_checked:
+        name = local_zone_name()
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_timezone_names WHERE name = %s)", (name,))
+        _sql_zone_name = name if cursor.fetchone()[0] else None
+        _sql_zone_checked = True
+    return _sql_zone_name
+
+
+@lru_cache(maxsize=None)
+def _minute_labels(offset_minutes):
+    # Shared by every day with this offset; only a handful of offsets ever occur
+    return tuple(f"{(minute + offset_minutes) // 60 % 24:02}:{(minute + offset_minutes) % 60:02}"
+                 for minute in range(MINUTES_PER_DAY))
+
+
+# Stats span many dates: a day costs two offset lookups unless its DST changes
+@lru_cache(maxsize=4096)
+def _utc_to_local_table(day):
+    """'HH:MM' local label for every UTC minute of the given day."""
+    zone = local_zone()
+    start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+    first_offset = start.astimezone(zone).utcoffset()
+    last_offset = (start + timedelta(minutes=MINUTES_PER_DAY - 1)).astimezone(zone).utcoffset()
+
+    if first_offset == last_offset:
+        # No DST change on this day: one offset for every minute
+        return _minute_labels(int(first_offset.total_seconds() // 60))
+
+    return [(start + timedelta(minutes=minute)).astimezone(zone).strftime('%H:%M')
+            for minute in range(MINUTES_PER_DAY)]
+
+
+@lru_cache(maxsize=4096)
+def _local_to_utc_table(day):
+    """'HH:MM' UTC label for every local minute of the given day."""
+    zone = local_zone()
+    start = datetime(day.year, day.month, day.day)
+    first_offset = start.replace(tzinfo=zone).utcoffset()
+    last_offset = (start + timedelta(minutes=MINUTES_PER_DAY - 1)).replace(tzinfo=zone).utcoffset()
+
+    if first_offset == last_offset:
+        return _minute_labels(-int(first_offset.total_seconds() // 60))
+
+    # Same rules as datetime.replace(tzinfo=...): gaps and repeated times use fold=0
+    return [(start + timedelta(minutes=minute)).replace(tzinfo=zone).astimezone(timezone.utc).strftime('%H:%M')
+            for minute in range(MINUTES_PER_DAY)]
+
+
+def _split(value):
+    """Return (minute of day, ':SS' suffix) of a 'HH:MM[:SS]' string or time object."""
+    if isinstance(value, str):
+        return int(value[0:2]) * 60 + int(value[3:5]), value[5:8] or ':00'
+    return value.hour * 60 + value.minute, f":{value.second:02}"
+
+
+def _convert_column(values, days, table, default_day):
+    if days is None:
+        labels = table(default_day)
+    converted = []
+    for position, value in enumerate(values):
+        if value is None:
+            converted.append(None)
+            continue
+        if days is not None:
+            labels = table(days[position])
+        minute, seconds = _split(value)
+        converted.append(labels[minute] + seconds)
+    return converted
+
+
+def utc_to_local_column(values, days=None):
+    """Convert UTC times to local 'HH:MM:SS' strings in one pass.
+
+    days gives the date of each value (e.g. the stats row date); by default
+    every value is converted as of today. None values are kept.
+    """
+    return _convert_column(values, days, _utc_to_local_table, datetime.now(timezone.utc).date())
+
+
+def local_to_utc_column(values, days=None):
+    """Convert local times to UTC 'HH:MM:SS' strings in one pass."""
+    return _convert_column(values, days, _local_to_utc_table, datetime.now().date())
+
+
+def utc_to_local(value, day=None):
+    return utc_to_local_column([value], None if day is None else [day])[0]
+
+
+def local_to_utc(value, day=None):
+    return local_to_utc_column([value], None if day is None else [day])[0]
@@ -1,12 +1,82 @@
 from PyQt6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QFormLayout, QLabel, QLineEdit, QTextEdit, QFileDialog,
-                             QPushButton, QCheckBox, QComboBox, QListWidget, QTabWidget,
-                             QHBoxLayout, QAbstractItemView, QTableWidget, QTableWidgetItem, QHeaderView)
+                             QPushButton, QCheckBox, QComboBox, QListWidget, QListWidgetItem, QTabWidget,
+                             QHBoxLayout, QAbstractItemView, QTableView, QHeaderView,
+                             QProgressBar, QMessageBox, QDockWidget)
 from PyQt6.QtCore import Qt, QTimer
-from db import save_complete_tpd, select_from_db_stats, select_from_db_view_data, delete_record_from_db
+from PyQt6.QtGui import QKeySequence, QShortcut
+import os
+import time
+from datetime import date, datetime, timedelta
+import metrics
+from models import RowTableModel
+from workers import TaskRunner
+from listener import ChangeListener
+from snapshot_cache import load_snapshot, save_snapshot
+from submission_queue import (enqueue_submission, flush_submissions, pending_submissions, failed_submissions,
+                              discard_submissions)
+from schedule import ScheduleIndex
+from search import SearchIndex
+from textutil import words
+from db import (select_stats_page, count_stats_estimate, select_from_db_view_data,
+                delete_records_from_db, get_change_watermark, select_view_data_changes, select_stats_changes,
+                prune_change_log, load_lookup_cache, select_stats_summary_by_post, select_stats_summary_by_hour,
+                export_stats_csv, export_stats_parquet, select_schedule, select_schedule_changes,
+                search_posts, CHANGE_LOG_RETENTION_DAYS, STATS_SUCCESS_STATUS)
+
+# Polling interval used while the change listener is connected / disconnected
+REFRESH_INTERVAL = 600000  # 10 min
+FALLBACK_REFRESH_INTERVAL = int(float(os.getenv("LISTEN_FALLBACK_POLL_SECONDS", "60")) * 1000)
+
+# Groupings offered by the Statistics summary: label -> (headers, query taking the stats filters)
+STATS_SUMMARIES = {
+    "Per post": (["ID", "Name", "Total", "Successes", "Success %"],
+                 lambda filters: select_stats_summary_by_post(filters.get('date_from'), filters.get('date_to'))),
+    "Per post and week day": (["ID", "Name", "Week day", "Total", "Successes", "Success %"],
+                              lambda filters: select_stats_summary_by_post(filters.get('date_from'),
+                                                                           filters.get('date_to'), by_weekday=True)),
+    "Per week day and hour (UTC)": (["Week day", "Hour", "Total", "Successes", "Success %"],
+                                    lambda filters: select_stats_summary_by_hour()),
+}
+
+# The View Data search runs this long after the last keystroke
+SEARCH_DEBOUNCE_MS = 200
+# Matching posts shown at most; the count covers all of them
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "1000"))
+
+# Ranges offered by the Upcoming tab, in minutes
+UPCOMING_RANGES = {
+    "Next hour": 60,
+    "Next 6 hours": 6 * 60,
+    "Next 24 hours": 24 * 60,
+    "Next 7 days": 7 * 24 * 60,
+}
+UPCOMING_INTERVAL = 60000  # The list moves on every minute
+
+# Load a tab's data the first time it is opened instead of all tabs at start-up
+LAZY_TABS = os.getenv("LAZY_TABS", "1").lower() in ("1", "true", "yes")
+
+# Work not needed for the first screen (change listener, change log pruning) starts this much later
+DEFERRED_START_MS = int(float(os.getenv("DEFERRED_START_SECONDS", "2")) * 1000)
+
+# Queued submissions are sent this often (and right after a new one is queued)
+SUBMISSION_FLUSH_INTERVAL = int(float(os.getenv("SUBMISSION_FLUSH_SECONDS", "10")) * 1000)
+
+# Snapshots of the tables are written to the local cache this long after they last changed
+SNAPSHOT_SAVE_DELAY = 5000
+
+# Database metrics panel: shown at start-up when set, toggled with F12
+DEBUG_PANEL = os.getenv("DEBUG_PANEL", "0").lower() in ("1", "true", "yes")
+DEBUG_PANEL_INTERVAL = 2000
+
+# Without a delta refresh for this long the change log may have been pruned, so reload everything
+FULL_RELOAD_AFTER = CHANGE_LOG_RETENTION_DAYS * 86400 / 2
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, started_at=None):
         super().__init__()
+        # perf_counter() at process start (main.py), for the cold start timings
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self.startup_phases = set()
         self.setWindowTitle("TID")
         self.setGeometry(100, 100, 800, 600)
 
@@ -17,9 +87,27 @@ class MainWindow(QMainWindow):
         self.tab_widget = QTabWidget()
         self.layout.addWidget(self.tab_widget)
 
+        # All database work runs on a thread pool, results come back as signals
+        self.tasks = TaskRunner(self)
+
+        # Change log watermarks of the data shown, used for delta refreshes
+        self.view_watermark = None
+        self.view_synced_at = 0
+        self.stats_watermark = None
+        self.stats_synced_at = 0
+        self.schedule_watermark = None
+
         self.create_add_tab()
         self.create_view_tab()
         self.create_stats_tab()
+        self.create_upcoming_tab()
+        self.create_debug_panel()
+
+        # Tab -> function loading its data; loaded_tabs holds the tabs loaded at least once
+        self.tab_loaders = {self.view_tab: self.load_view_tab, self.stats_tab: self.load_stats_tab,
+                            self.upcoming_tab: self.load_upcoming_tab}
+        self.loaded_tabs = set()
+        self.tab_widget.currentChanged.connect(self.load_tab)
 
         # Initialize tweet_times
         self.tweet_times = []
@@ -28,6 +116,15 @@ class MainWindow(QMainWindow):
         self.status_label = QLabel("")
         self.layout.addWidget(self.status_label)
 
+        # Busy indicator shown while background queries run
+        self.loading_bar = QProgressBar()
+        self.loading_bar.setRange(0, 0)
+        self.loading_bar.setMaximumHeight(10)
+        self.loading_bar.setTextVisible(False)
+        self.loading_bar.setVisible(bool(self.tasks.running))
+        self.layout.addWidget(self.loading_bar)
+        self.tasks.active_changed.connect(lambda count: self.loading_bar.setVisible(count > 0))
+
         # Timer for hiding status message
         self.timer = QTimer()
         self.timer.setSingleShot(True)
@@ -35,9 +132,82 @@ class MainWindow(QMainWindow):
         
         # Timer for refreshing stats
         self.refresh_timer = QTimer()
-        self.refresh_timer.timeout.connect(self.update_stats)
+        self.refresh_timer.timeout.connect(self.refresh_stats)
         self.refresh_timer.timeout.connect(self.refresh_data)
-        self.refresh_timer.start(600000)  # Refresh every 10 min
+        self.refresh_timer.timeout.connect(self.refresh_schedule)
+        self.refresh_timer.start(REFRESH_INTERVAL)
+
+        # Changes pushed by the database are applied shortly after they arrive;
+        # bursts of notifications are coalesced into one delta refresh
+        self.view_change_timer = QTimer()
+        self.view_change_timer.setSingleShot(True)
+        self.view_change_timer.setInterval(300)
+        self.view_change_timer.timeout.connect(self.refresh_data)
+        self.view_change_timer.timeout.connect(self.refresh_schedule)
+
+        self.stats_change_timer = QTimer()
+        self.stats_change_timer.setSingleShot(True)
+        self.stats_change_timer.setInterval(300)
+        self.stats_change_timer.timeout.connect(self.refresh_stats)
+
+        # Until the listener first connects, changes are caught up on when it does
+        self.listener_down = True
+        self.listener = ChangeListener(self)
+        self.listener.changed.connect(self.handle_change)
+        self.listener.connected.connect(self.listener_connected)
+        self.listener.disconnected.connect(self.listener_disconnected)
+
+        # Coalesce the snapshot writes of a burst of refreshes
+        self.view_snapshot_timer = QTimer()
+        self.view_snapshot_timer.setSingleShot(True)
+        self.view_snapshot_timer.setInterval(SNAPSHOT_SAVE_DELAY)
+        self.view_snapshot_timer.timeout.connect(self.save_view_snapshot)
+
+        self.stats_snapshot_timer = QTimer()
+        self.stats_snapshot_timer.setSingleShot(True)
+        self.stats_snapshot_timer.setInterval(SNAPSHOT_SAVE_DELAY)
+        self.stats_snapshot_timer.timeout.connect(self.save_stats_snapshot)
+
+        # Runs once the window is on screen
+        QTimer.singleShot(0, self.start_up)
+        QTimer.singleShot(DEFERRED_START_MS, self.start_background_work)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.startup_phase('window_shown')
+
+    def startup_phase(self, phase):
+        """Record the first time a start-up phase is reached."""
+        if phase not in self.startup_phases:
+            self.startup_phases.add(phase)
+            metrics.record_startup(phase, time.perf_counter() - self.started_at)
+
+    def start_up(self):
+        if LAZY_TABS:
+            self.load_tab(self.tab_widget.currentIndex())
+        else:
+            for index in range(self.tab_widget.count()):
+                self.load_tab(index)
+        # Opens the connection pool in the background, so the first tab opened doesn't wait for it
+        self.tasks.run(None, load_lookup_cache)
+
+        # Posts queued in an earlier session are sent first
+        self.tasks.run(None, pending_submissions, on_result=self.update_pending_label)
+        self.tasks.run(None, failed_submissions, on_result=self.update_failed_list)
+        self.flush_queue()
+        self.flush_timer.start()
+
+    def load_tab(self, index):
+        tab = self.tab_widget.widget(index)
+        if tab in self.tab_loaders and tab not in self.loaded_tabs:
+            self.loaded_tabs.add(tab)
+            self.tab_loaders[tab]()
+
+    def start_background_work(self):
+        if self.listener.isRunning() or self.listener.isFinished():
+            return  # Already started, or the window was closed
+        self.listener.start()
+        self.tasks.run(None, prune_change_log)
 
     def create_add_tab(self):
         self.add_tab = QWidget()
@@ -115,15 +285,65 @@ class MainWindow(QMainWindow):
         self.submit_button.clicked.connect(self.submit)
         self.add_tab_layout.addWidget(self.submit_button)
 
+        # Submissions are saved to a local queue first and sent in the background
+        self.pending_label = QLabel("")
+        self.pending_label.hide()
+        self.add_tab_layout.addWidget(self.pending_label)
+
+        self.upload_progress = QProgressBar()
+        self.upload_progress.setRange(0, 100)
+        self.upload_progress.setFormat("Uploading media... %p%")
+        self.upload_progress.hide()
+        self.add_tab_layout.addWidget(self.upload_progress)
+
+        # Submissions given up on stay in the queue until they're discarded
+        self.failed_label = QLabel("")
+        self.failed_label.setStyleSheet("color: red;")
+        self.failed_list = QListWidget()
+        self.failed_list.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.discard_failed_button = QPushButton("Discard Selected")
+        self.discard_failed_button.clicked.connect(self.discard_failed)
+        for widget in (self.failed_label, self.failed_list, self.discard_failed_button):
+            widget.hide()
+            self.add_tab_layout.addWidget(widget)
+
+        self.flush_timer = QTimer()
+        self.flush_timer.setInterval(SUBMISSION_FLUSH_INTERVAL)
+        self.flush_timer.timeout.connect(lambda: self.submissions_pending and self.flush_queue())
+        self.submissions_pending = 0
+
     def create_view_tab(self):
         self.view_tab = QWidget()
         self.tab_widget.addTab(self.view_tab, "View Data")
 
         self.view_tab_layout = QVBoxLayout(self.view_tab)
-        
-        self.data_table = QTableWidget()
-        self.data_table.setColumnCount(7)
-        self.data_table.setHorizontalHeaderLabels(["ID", "Name", "Text", "Media", "Is Random", "Week Days", "Tweet Times"])
+
+        # Search box: the table shows the matching posts while it isn't empty
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search name, text and media")
+        self.search_input.setClearButtonEnabled(True)
+        self.view_tab_layout.addWidget(self.search_input)
+        self.search_label = QLabel("")
+        self.search_label.hide()
+        self.view_tab_layout.addWidget(self.search_label)
+
+        self.search_timer = QTimer()
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.run_search)
+        self.search_input.textChanged.connect(lambda text: self.search_timer.start())
+
+        # Built from the loaded rows in the background; until then the database is searched
+        self.search_index = None
+
+        view_headers = ["ID", "Name", "Text", "Media", "Is Random", "Week Days", "Tweet Times"]
+        self.data_model = RowTableModel(view_headers)
+        self.search_model = RowTableModel(view_headers)
+        self.data_table = QTableView()
+        self.data_table.setModel(self.data_model)
+        self.data_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        # Ctrl/Shift-click selects several posts for a bulk delete
+        self.data_table.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
         self.data_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
 
         # Set column widths
@@ -142,14 +362,14 @@ class MainWindow(QMainWindow):
 
         # Set cell styles
         self.data_table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 background-color: #f5f5f5;
                 gridline-color: #ddd;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 5px;
             }
-            QTableWidget::item:selected {
+            QTableView::item:selected {
                 background-color: #c8e6c9;
             }
         """)
@@ -163,21 +383,49 @@ class MainWindow(QMainWindow):
         self.refresh_button.clicked.connect(self.refresh_data)
         self.view_tab_layout.addWidget(self.refresh_button)
 
-        self.delete_button = QPushButton("Delete Selected Record")
+        self.delete_button = QPushButton("Delete Selected Records")
         self.delete_button.clicked.connect(self.delete_record)
         self.view_tab_layout.addWidget(self.delete_button)
 
-        self.refresh_data()  # Initial load of data
-
     def create_stats_tab(self):
         self.stats_tab = QWidget()
         self.tab_widget.addTab(self.stats_tab, "Statistics")
 
         self.stats_tab_layout = QVBoxLayout(self.stats_tab)
-        
-        self.stats_table = QTableWidget()
-        self.stats_table.setColumnCount(6)
-        self.stats_table.setHorizontalHeaderLabels(["ID", "Name", "Date", "Time", "Week day", "Status"])
+
+        # Filters
+        self.stats_filter_layout = QHBoxLayout()
+        self.stats_tab_layout.addLayout(self.stats_filter_layout)
+
+        self.stats_name_filter = QLineEdit()
+        self.stats_name_filter.setPlaceholderText("Name")
+        self.stats_filter_layout.addWidget(self.stats_name_filter)
+
+        self.stats_status_filter = QLineEdit()
+        self.stats_status_filter.setPlaceholderText("Status")
+        self.stats_filter_layout.addWidget(self.stats_status_filter)
+
+        self.stats_date_from_filter = QLineEdit()
+        self.stats_date_from_filter.setPlaceholderText("From (YYYY-MM-DD)")
+        self.stats_filter_layout.addWidget(self.stats_date_from_filter)
+
+        self.stats_date_to_filter = QLineEdit()
+        self.stats_date_to_filter.setPlaceholderText("To (YYYY-MM-DD)")
+        self.stats_filter_layout.addWidget(self.stats_date_to_filter)
+
+        self.stats_filter_button = QPushButton("Apply Filters")
+        self.stats_filter_button.clicked.connect(self.apply_stats_filters)
+        self.stats_filter_layout.addWidget(self.stats_filter_button)
+
+        self.stats_export_button = QPushButton("Export...")
+        self.stats_export_button.clicked.connect(self.export_stats)
+        self.stats_filter_layout.addWidget(self.stats_export_button)
+
+        self.stats_model = RowTableModel(["ID", "Name", "Date", "Time", "Week day", "Status"],
+                                         fetch_more=self.fetch_stats_page)
+        self.stats_table = QTableView()
+        self.stats_table.setModel(self.stats_model)
+        self.stats_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
 
         # Set header styles
         header = self.stats_table.horizontalHeader()
@@ -191,14 +439,14 @@ class MainWindow(QMainWindow):
 
         # Set cell styles
         self.stats_table.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 background-color: #f5f5f5;
                 gridline-color: #ddd;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 5px;
             }
-            QTableWidget::item:selected {
+            QTableView::item:selected {
                 background-color: #c8e6c9;
             }
         """)
@@ -208,13 +456,128 @@ class MainWindow(QMainWindow):
 
         self.stats_tab_layout.addWidget(self.stats_table)
 
+        # Further pages are loaded as the table is scrolled
+        self.stats_page_label = QLabel("")
+        self.stats_page_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.stats_tab_layout.addWidget(self.stats_page_label)
+
+        self.stats_next_key = None
+        self.stats_total = None
+        self.stats_filters = {}
+        self.stats_model.rowsInserted.connect(lambda *args: self.update_stats_label())
+        self.stats_model.modelReset.connect(self.update_stats_label)
+
+        # Aggregates answered from the rollup tables instead of the raw rows
+        self.stats_summary_layout = QHBoxLayout()
+        self.stats_tab_layout.addLayout(self.stats_summary_layout)
+        self.stats_summary_layout.addWidget(QLabel(f"Summary (success = '{STATS_SUCCESS_STATUS}'):"))
+        self.stats_summary_combo = QComboBox()
+        self.stats_summary_combo.addItems(STATS_SUMMARIES)
+        self.stats_summary_combo.currentTextChanged.connect(lambda text: self.update_stats_summary())
+        self.stats_summary_layout.addWidget(self.stats_summary_combo)
+        self.stats_summary_layout.addStretch()
+
+        self.stats_summary_model = RowTableModel([])
+        self.stats_summary_table = QTableView()
+        self.stats_summary_table.setModel(self.stats_summary_model)
+        self.stats_summary_table.setMaximumHeight(200)
+        self.stats_summary_table.setAlternatingRowColors(True)
+        self.stats_summary_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.stats_tab_layout.addWidget(self.stats_summary_table)
+
         # Add Refresh Button
         self.refresh_button = QPushButton("Refresh")
-        self.refresh_button.clicked.connect(self.update_stats)
+        self.refresh_button.clicked.connect(self.refresh_stats)
         self.stats_tab_layout.addWidget(self.refresh_button)
 
-        self.update_stats()
+    def create_upcoming_tab(self):
+        self.upcoming_tab = QWidget()
+        self.tab_widget.addTab(self.upcoming_tab, "Upcoming")
+
+        self.upcoming_tab_layout = QVBoxLayout(self.upcoming_tab)
+
+        self.upcoming_range_layout = QHBoxLayout()
+        self.upcoming_tab_layout.addLayout(self.upcoming_range_layout)
+        self.upcoming_range_combo = QComboBox()
+        self.upcoming_range_combo.addItems(UPCOMING_RANGES)
+        self.upcoming_range_combo.currentTextChanged.connect(lambda text: self.update_upcoming())
+        self.upcoming_range_layout.addWidget(self.upcoming_range_combo)
+        self.upcoming_label = QLabel("")
+        self.upcoming_range_layout.addWidget(self.upcoming_label)
+        self.upcoming_range_layout.addStretch()
+
+        self.upcoming_model = RowTableModel(["Time", "ID", "Name", "Is Random"])
+        self.upcoming_table = QTableView()
+        self.upcoming_table.setModel(self.upcoming_model)
+        self.upcoming_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.upcoming_table.setAlternatingRowColors(True)
+        header = self.upcoming_table.horizontalHeader()
+        header.setStyleSheet("background-color: #4CAF50; color: white; font-weight: bold;")
+        header.setSectionResizeMode(QHeaderView.ResizeMode.Stretch)
+        self.upcoming_tab_layout.addWidget(self.upcoming_table)
+
+        # Posts are indexed by the minute of the week they fire at; kept up to date with the change log
+        self.schedule = ScheduleIndex()
+
+        # Only redrawn while the tab is shown
+        self.upcoming_timer = QTimer()
+        self.upcoming_timer.setInterval(UPCOMING_INTERVAL)
+        self.upcoming_timer.timeout.connect(
+            lambda: self.tab_widget.currentWidget() is self.upcoming_tab and self.update_upcoming())
+
+    def create_debug_panel(self):
+        self.debug_dock = QDockWidget("Database metrics", self)
+        self.debug_dock.setObjectName("debug_dock")
+        self.debug_panel = QWidget()
+        self.debug_layout = QVBoxLayout(self.debug_panel)
+
+        self.debug_connections_label = QLabel("")
+        self.debug_layout.addWidget(self.debug_connections_label)
+
+        self.debug_model = RowTableModel(["Function", "Calls", "Errors", "Avg ms", "p50 ms", "p95 ms", "Max ms",
+                                          "Round trips", "Rows", "kB sent", "kB received"])
+        self.debug_table = QTableView()
+        self.debug_table.setModel(self.debug_model)
+        self.debug_table.setAlternatingRowColors(True)
+        self.debug_table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.debug_layout.addWidget(self.debug_table)
+
+        self.debug_reset_button = QPushButton("Reset")
+        self.debug_reset_button.clicked.connect(self.reset_debug_metrics)
+        self.debug_layout.addWidget(self.debug_reset_button)
+
+        self.debug_dock.setWidget(self.debug_panel)
+        self.addDockWidget(Qt.DockWidgetArea.BottomDockWidgetArea, self.debug_dock)
+
+        # Only refreshed while visible
+        self.debug_timer = QTimer()
+        self.debug_timer.setInterval(DEBUG_PANEL_INTERVAL)
+        self.debug_timer.timeout.connect(self.update_debug_panel)
+        self.debug_dock.visibilityChanged.connect(self.debug_panel_visibility_changed)
+
+        self.debug_shortcut = QShortcut(QKeySequence("F12"), self)
+        self.debug_shortcut.activated.connect(lambda: self.debug_dock.setVisible(not self.debug_dock.isVisible()))
+        self.debug_dock.setVisible(DEBUG_PANEL)
+
+    def debug_panel_visibility_changed(self, visible):
+        if visible:
+            self.update_debug_panel()
+            self.debug_timer.start()
+        else:
+            self.debug_timer.stop()
+
+    def update_debug_panel(self):
+        connections = metrics.connection_summary()
+        startup = ", ".join(f"{phase} {ms} ms" for phase, ms in sorted(metrics.startup_summary().items()))
+        self.debug_connections_label.setText(
+            f"Connections opened: {connections['opened']}, closed: {connections['closed']}, "
+            f"in use: {connections['in_use']}, pool wait p95: {connections['pool_wait_p95_ms']} ms"
+            f"\nStartup: {startup or '-'}")
+        self.debug_model.set_rows(metrics.function_summary())
 
+    def reset_debug_metrics(self):
+        metrics.REGISTRY.reset()
+        self.update_debug_panel()
 
     def select_files(self):
         files, _ = QFileDialog.getOpenFileNames(self, "Select Media Files", "", "All Files (*);;Text Files (*.txt)")
@@ -227,9 +590,9 @@ class MainWindow(QMainWindow):
     def add_time(self):
         hour = self.hour_combo.currentText()
         minute = self.minute_combo.currentText()
-        time = f"{hour}:{minute}"
-        if time not in self.tweet_times:
-            self.tweet_times.append(time)
+        tweet_time = f"{hour}:{minute}"
+        if tweet_time not in self.tweet_times:
+            self.tweet_times.append(tweet_time)
             self.tweet_times.sort()
             self.update_time_list_widget()
 
@@ -242,8 +605,8 @@ class MainWindow(QMainWindow):
 
     def update_time_list_widget(self):
         self.tweet_times_list_widget.clear()
-        for time in self.tweet_times:
-            self.tweet_times_list_widget.addItem(time)
+        for tweet_time in self.tweet_times:
+            self.tweet_times_list_widget.addItem(tweet_time)
 
     def submit(self):
         name = self.name_input.text()
@@ -257,19 +620,13 @@ class MainWindow(QMainWindow):
         # Here, you would normally save to the database, but for now, we'll just print.
         print(f"Submitting:\nName: {name}\nText: {text}\nMedia: {media_files}\nIs Random: {is_random}\nWeek Days: {week_days}\nTweet Times: {tweet_times}")
 
-        # Save to database
-        err_code = save_complete_tpd(name, text, is_random, media_files, week_days, tweet_times)
-
-        # Update status label based on result
-        if err_code == 0:
-            self.status_label.setText("Done")
-            self.status_label.setStyleSheet("color: green;")
-        else:
-            self.status_label.setText("Error")
-            self.status_label.setStyleSheet("color: red;")
-        
-        # Start timer to clear status label after 3 seconds
-        self.timer.start(5000)
+        # Write to the local queue; the database is contacted later by flush_queue
+        post = (name, text, is_random, list(media_files), week_days, list(tweet_times))
+        self.status_label.setText("Saving...")
+        self.status_label.setStyleSheet("")
+        self.tasks.run(None, enqueue_submission, *post,
+                       on_result=lambda key: self.submit_finished(key, post),
+                       on_error=lambda message: self.submit_finished(None, post))
 
         # Clear all fields
         self.name_input.clear()
@@ -286,62 +643,527 @@ class MainWindow(QMainWindow):
         for checkbox in self.week_day_checkboxes.values():
             checkbox.setChecked(False)
 
+    def submit_finished(self, key, post):
+        # Update status label based on result
+        if key is not None:
+            self.status_label.setText("Saved, sending in the background")
+            self.status_label.setStyleSheet("color: green;")
+            self.update_pending_label(self.submissions_pending + 1)
+            self.flush_queue()
+        else:
+            self.status_label.setText("Error saving the post locally, the form was restored")
+            self.status_label.setStyleSheet("color: red;")
+            self.restore_form(*post)
+
+        # Start timer to clear status label after 5 seconds
+        self.timer.start(5000)
+
+    def restore_form(self, name, text, is_random, media_files, week_days, tweet_times):
+        self.name_input.setText(name)
+        self.text_input.setPlainText(text)
+        self.is_random_check.setChecked(is_random)
+
+        self.media_files = media_files
+        self.media_list_widget.clear()
+        for file in self.media_files:
+            self.media_list_widget.addItem(file)
+
+        self.tweet_times = tweet_times
+        self.update_time_list_widget()
+
+        for day, checkbox in self.week_day_checkboxes.items():
+            checkbox.setChecked(day in week_days)
+
+    def flush_queue(self):
+        if not self.tasks.is_running('flush_submissions'):
+            self.tasks.run('flush_submissions', flush_submissions, on_result=self.queue_flushed,
+                           on_error=lambda message: self.upload_progress.hide(),
+                           on_progress=self.update_upload_progress)
+
+    def update_upload_progress(self, bytes_done, total_bytes):
+        if total_bytes:
+            self.upload_progress.setValue(int(bytes_done * 100 / total_bytes))
+            self.upload_progress.setVisible(bytes_done < total_bytes)
+
+    def queue_flushed(self, result):
+        self.upload_progress.hide()
+        if result is None:
+            return
+        sent, pending, failed = result
+        self.update_pending_label(pending)
+        self.update_failed_list(failed)
+        if sent:
+            self.refresh_data()
+
+    def update_pending_label(self, pending):
+        if pending is None:
+            return
+        self.submissions_pending = pending
+        self.pending_label.setText(f"Posts waiting to be sent: {pending}")
+        self.pending_label.setVisible(bool(pending))
+
+    def update_failed_list(self, failed):
+        if failed is None:
+            return
+        self.failed_list.clear()
+        for key, name, reason in failed:
+            item = QListWidgetItem(f"{name}: {reason}")
+            item.setData(Qt.ItemDataRole.UserRole, key)
+            self.failed_list.addItem(item)
+        self.failed_label.setText(f"Posts that could not be sent: {len(failed)}")
+        for widget in (self.failed_label, self.failed_list, self.discard_failed_button):
+            widget.setVisible(bool(failed))
+
+    def discard_failed(self):
+        keys = [item.data(Qt.ItemDataRole.UserRole) for item in self.failed_list.selectedItems()]
+        if keys:
+            self.tasks.run(None, discard_submissions, keys,
+                           on_result=lambda _: self.tasks.run(None, failed_submissions,
+                                                              on_result=self.update_failed_list))
+
+    def handle_change(self, source, ids):
+        if source == 'stats':
+            self.stats_change_timer.start()
+        else:
+            self.view_change_timer.start()
+
+    def listener_connected(self):
+        self.refresh_timer.setInterval(REFRESH_INTERVAL)
+        if self.listener_down:
+            # Catch up on whatever changed while the listener was away
+            self.listener_down = False
+            self.refresh_data()
+            self.refresh_stats()
+            self.flush_queue()
+
+    def listener_disconnected(self, message):
+        # Fall back to polling until the listener is back
+        self.listener_down = True
+        self.refresh_timer.setInterval(FALLBACK_REFRESH_INTERVAL)
+
+    def closeEvent(self, event):
+        self.listener.stop()
+
+        # Let saves and deletes that are still running finish before exiting
+        self.tasks.cancel('view_data')
+        self.tasks.cancel('stats')
+        self.tasks.cancel('stats_page')
+        self.tasks.cancel('stats_summary')
+        self.tasks.cancel('view_snapshot')
+        self.tasks.cancel('stats_snapshot')
+        self.tasks.cancel('schedule')
+        self.tasks.cancel('search')
+        self.tasks.cancel('search_index')
+        self.debug_timer.stop()
+        self.search_timer.stop()
+        self.upcoming_timer.stop()
+        self.flush_timer.stop()
+        # Write pending snapshots before exiting
+        if self.view_snapshot_timer.isActive():
+            self.view_snapshot_timer.stop()
+            self.save_view_snapshot()
+        if self.stats_snapshot_timer.isActive():
+            self.stats_snapshot_timer.stop()
+            self.save_stats_snapshot()
+        self.tasks.wait()
+        super().closeEvent(event)
+
     def clear_status(self):
         self.status_label.setText("")
 
+    def load_view_tab(self):
+        # Draw the last snapshot right away, then bring it up to date
+        self.tasks.run('view_snapshot', load_snapshot, 'view_data',
+                       on_result=self.apply_view_snapshot, on_error=lambda message: self.refresh_data())
+
+    def apply_view_snapshot(self, snapshot):
+        if snapshot is not None and self.view_watermark is None and not self.tasks.is_running('view_data'):
+            self.view_watermark, self.view_synced_at, rows = snapshot
+            self.data_model.set_rows(rows)
+            self.startup_phase('cached_data')
+            self.rebuild_search_index()
+        # With a snapshot only the changes since its watermark are fetched
+        self.refresh_data()
+
+    def save_view_snapshot(self):
+        if self.view_watermark is not None:
+            self.tasks.run(None, save_snapshot, 'view_data', self.view_watermark, self.view_synced_at,
+                           list(self.data_model.rows))
+
     def refresh_data(self):
-        # Clear existing rows
-        self.data_table.setRowCount(0)
-        
-        # Fetch the data from the database
-        data = select_from_db_view_data()
-        
+        if self.view_tab not in self.loaded_tabs:
+            return  # Loaded in full when the tab is first opened
+        if self.view_watermark is None and self.tasks.is_running('view_data'):
+            return  # The first full load is still on its way
+        if self.view_watermark is None or time.time() - self.view_synced_at > FULL_RELOAD_AFTER:
+            # Fetch all the data from the database; a refresh still running is superseded
+            self.tasks.run('view_data', load_view_data, on_result=self.apply_view_data)
+        elif not self.tasks.is_running('view_data'):
+            # Fetch only the posts changed since the last refresh
+            self.tasks.run('view_data', select_view_data_changes, self.view_watermark,
+                           on_result=self.apply_view_changes)
+
+    def apply_view_data(self, result):
+        watermark, data = result
         if data is None:
-            data = []  # Default to an empty list if None is returned
-
-        # Populate the table
-        for row_data in data:
-            row_position = self.data_table.rowCount()
-            self.data_table.insertRow(row_position)
-            for column, value in enumerate(row_data):
-                self.data_table.setItem(row_position, column, QTableWidgetItem(str(value)))
+            return  # Keep the current rows if the query failed
+
+        # Only changed, new and removed rows touch the table
+        self.data_model.replace_rows(data)
+        self.view_watermark = watermark
+        self.view_synced_at = time.time()
+        self.startup_phase('first_data')
+        self.view_snapshot_timer.start()
+        self.rebuild_search_index()
+
+    def apply_view_changes(self, result):
+        if result is None:
+            # Delta failed, start over with a full reload next time
+            self.view_watermark = None
+            return
+
+        rows, deleted_ids, self.view_watermark = result
+        self.data_model.remove_ids(deleted_ids)
+        self.data_model.upsert_rows(rows)
+        self.view_synced_at = time.time()
+        self.view_snapshot_timer.start()
+        self.update_search_index(rows, deleted_ids)
+
+    def rebuild_search_index(self):
+        # A build still running is superseded, its rows are older
+        self.tasks.run('search_index', build_search_index, list(self.data_model.rows),
+                       on_result=self.apply_search_index)
+
+    def apply_search_index(self, index):
+        self.search_index = index
+        if self.search_input.text():
+            self.run_search()
+
+    def update_search_index(self, rows, deleted_ids):
+        if not rows and not deleted_ids:
+            return
+        if self.tasks.is_running('search_index'):
+            # The index being built misses these changes
+            self.rebuild_search_index()
+        elif self.search_index is not None:
+            for post_id in deleted_ids:
+                self.search_index.remove_post(post_id)
+            for row in rows:
+                self.search_index.add_post(row[0], search_texts(row))
+        if self.search_input.text():
+            self.run_search()
+
+    def run_search(self):
+        query = self.search_input.text()
+        if not words(query):
+            self.tasks.cancel('search')
+            self.data_table.setModel(self.data_model)
+            self.search_label.hide()
+            return
+
+        started = time.perf_counter()
+        if self.search_index is None:
+            # The posts aren't loaded yet, ask the database
+            self.tasks.run('search', search_view_data, query,
+                           on_result=lambda result: self.show_search_results(*result, started),
+                           on_error=lambda message: self.show_search_results(None, 0, started))
+            return
+
+        self.tasks.cancel('search')
+        post_ids = self.search_index.search(query)
+        row_index = self.data_model.row_index
+        rows = [self.data_model.rows[row_index[post_id]] for post_id in post_ids[:SEARCH_LIMIT]
+                if post_id in row_index]
+        self.show_search_results(rows, len(post_ids), started)
+
+    def show_search_results(self, rows, matches, started):
+        if rows is None:
+            self.search_label.setText("Error searching posts")
+            self.search_label.setStyleSheet("color: red;")
+            self.search_label.show()
+            return
+
+        self.search_model.set_rows(rows)
+        if self.data_table.model() is not self.search_model:
+            self.data_table.setModel(self.search_model)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        text = f"{matches:,} matching posts ({elapsed_ms:.0f} ms)"
+        if matches > len(rows):
+            text += f", showing the first {len(rows):,}"
+        self.search_label.setText(text)
+        self.search_label.setStyleSheet("")
+        self.search_label.show()
 
     def delete_record(self):
-        selected_row = self.data_table.currentRow()
-        if selected_row >= 0:
-            item_id = self.data_table.item(selected_row, 0).text()
-            
-            # Delete the record from the database
-            err_code = delete_record_from_db(item_id)
-            
-            if err_code == 0:
-                # Remove the row from the table
-                self.data_table.removeRow(selected_row)
-                # Optionally show a success message
+        model = self.data_table.model()
+        item_ids = [model.row_id(index.row()) for index in self.data_table.selectionModel().selectedRows()]
+        if not item_ids:
+            return
+        if len(item_ids) > 1:
+            answer = QMessageBox.question(self, "Delete Records", f"Delete {len(item_ids)} selected records?")
+            if answer != QMessageBox.StandardButton.Yes:
+                return
+
+        # Delete all selected records from the database in one transaction
+        self.tasks.run(None, delete_records_from_db, item_ids,
+                       on_result=lambda err_code: self.delete_finished(item_ids, err_code),
+                       on_error=lambda message: self.delete_finished(item_ids, 1))
+
+    def delete_finished(self, item_ids, err_code):
+        if err_code == 0:
+            # Remove the rows from the table
+            self.data_model.remove_ids(item_ids)
+            self.search_model.remove_ids(item_ids)
+            if self.search_index is not None:
+                for item_id in item_ids:
+                    self.search_index.remove_post(item_id)
+            if self.search_input.text():
+                self.run_search()
+            if self.upcoming_tab in self.loaded_tabs:
+                for item_id in item_ids:
+                    self.schedule.remove_post(item_id)
+                self.update_upcoming()
+            # Optionally show a success message
+            if len(item_ids) == 1:
                 self.status_label.setText("Record deleted successfully")
-                self.status_label.setStyleSheet("color: green;")
-                self.timer.start(5000)  # Clear status after 5 seconds
             else:
-                # Optionally show an error message
-                self.status_label.setText("Error deleting record")
-                self.status_label.setStyleSheet("color: red;")
-                self.timer.start(5000)  # Clear status after 5 seconds
+                self.status_label.setText(f"{len(item_ids)} records deleted successfully")
+            self.status_label.setStyleSheet("color: green;")
+            self.timer.start(5000)  # Clear status after 5 seconds
+        else:
+            # Optionally show an error message
+            self.status_label.setText("Error deleting records")
+            self.status_label.setStyleSheet("color: red;")
+            self.timer.start(5000)  # Clear status after 5 seconds
+
+    def apply_stats_filters(self):
+        try:
+            date_from = self.stats_date_from_filter.text().strip()
+            date_to = self.stats_date_to_filter.text().strip()
+            self.stats_filters = {
+                'name': self.stats_name_filter.text().strip() or None,
+                'status': self.stats_status_filter.text().strip() or None,
+                'date_from': date.fromisoformat(date_from) if date_from else None,
+                'date_to': date.fromisoformat(date_to) if date_to else None
+            }
+        except ValueError:
+            self.status_label.setText("Invalid date, use YYYY-MM-DD")
+            self.status_label.setStyleSheet("color: red;")
+            self.timer.start(5000)
+            return
+
+        self.stats_watermark = None
+        self.load_stats_tab()
+
+    def export_stats(self):
+        path, selected_filter = QFileDialog.getSaveFileName(self, "Export Statistics", "stats.csv",
+                                                            "CSV (*.csv);;Parquet (*.parquet)")
+        if not path:
+            return
+        if not os.path.splitext(path)[1]:
+            path += ".parquet" if selected_filter.startswith("Parquet") else ".csv"
+        exporter = export_stats_parquet if path.lower().endswith(".parquet") else export_stats_csv
+
+        # The export streams in the background with the filters currently applied
+        self.stats_export_button.setEnabled(False)
+        self.status_label.setText("Exporting statistics...")
+        self.status_label.setStyleSheet("")
+        self.tasks.run('stats_export', export_stats_to_file, path, exporter, dict(self.stats_filters),
+                       on_result=lambda exported: self.export_stats_finished(path, exported),
+                       on_error=lambda message: self.export_stats_finished(path, None),
+                       on_progress=lambda rows, total: self.status_label.setText(f"Exporting statistics... {rows:,} rows"))
+
+    def export_stats_finished(self, path, exported):
+        self.stats_export_button.setEnabled(True)
+        if exported is None:
+            self.status_label.setText("Error exporting statistics")
+            self.status_label.setStyleSheet("color: red;")
+        else:
+            self.status_label.setText(f"Exported {exported:,} rows to {path}")
+            self.status_label.setStyleSheet("color: green;")
+        self.timer.start(5000)
 
-    def update_stats(self):
-        # Fetch the data from the database
-        data = select_from_db_stats()
+    def fetch_stats_page(self):
+        # Called by the stats model when the table is scrolled to the end
+        self.tasks.run('stats_page', select_stats_page, after=self.stats_next_key, **self.stats_filters,
+                       on_result=self.apply_stats_page,
+                       on_error=lambda message: self.stats_model.fetch_failed())
+        return None
+
+    def apply_stats_page(self, result):
+        data, self.stats_next_key = result
+        self.stats_model.append_rows(data, has_more=self.stats_next_key is not None)
+
+    def update_stats_label(self):
+        loaded = self.stats_model.row_count_loaded()
+        if self.stats_total is not None:
+            self.stats_page_label.setText(f"Loaded {loaded:,} of ~{max(self.stats_total, loaded):,} rows")
+        else:
+            self.stats_page_label.setText(f"Loaded {loaded:,} rows")
+
+    def load_stats_tab(self):
+        # Draw the last snapshot for these filters right away, then bring it up to date
+        self.tasks.cancel('stats_page')
+        self.tasks.cancel('stats')
+        self.tasks.run('stats_snapshot', load_snapshot, 'stats', self.stats_filters,
+                       on_result=self.apply_stats_snapshot, on_error=lambda message: self.update_stats())
+
+    def apply_stats_snapshot(self, snapshot):
+        if snapshot is None:
+            self.update_stats()
+            return
+        self.stats_watermark, self.stats_synced_at, (data, self.stats_next_key, self.stats_total) = snapshot
+        self.stats_model.set_rows(data, has_more=self.stats_next_key is not None)
+        self.startup_phase('cached_data')
+        self.update_stats_summary()
+        self.refresh_stats()
+
+    def save_stats_snapshot(self):
+        if self.stats_watermark is not None:
+            self.tasks.run(None, save_snapshot, 'stats', self.stats_watermark, self.stats_synced_at,
+                           (list(self.stats_model.rows), self.stats_next_key, self.stats_total), self.stats_filters)
 
-        if data is None:
-            data = []  # Default to an empty list if None is returned
-    
-        self.stats_table.setRowCount(0)  # Clear existing rows
-
-        # Assuming data is a list of tuples: (id, name, date, time, day_week, status)
-        for row_data in data:
-            row_position = self.stats_table.rowCount()
-            self.stats_table.insertRow(row_position)
-            for column, value in enumerate(row_data):
-                self.stats_table.setItem(row_position, column, QTableWidgetItem(str(value)))
+    def update_stats(self):
+        # Fetch only the first page, the rest is loaded while scrolling
+        self.tasks.cancel('stats_page')
+        self.tasks.run('stats', load_first_stats_page, self.stats_filters, on_result=self.apply_stats)
+        self.update_stats_summary()
+
+    def update_stats_summary(self):
+        label = self.stats_summary_combo.currentText()
+        headers, query = STATS_SUMMARIES[label]
+        self.tasks.run('stats_summary', query, dict(self.stats_filters),
+                       on_result=lambda rows: self.apply_stats_summary(headers, rows))
+
+    def apply_stats_summary(self, headers, rows):
+        self.stats_summary_model.headers = headers
+        self.stats_summary_model.set_rows(rows)
+
+    def apply_stats(self, result):
+        watermark, data, self.stats_next_key, self.stats_total = result
+        self.stats_model.set_rows(data, has_more=self.stats_next_key is not None)
+        self.stats_watermark = watermark
+        self.stats_synced_at = time.time()
+        self.startup_phase('first_data')
+        self.stats_snapshot_timer.start()
+
+    def refresh_stats(self):
+        if self.stats_tab not in self.loaded_tabs:
+            return
+        if self.stats_watermark is None and self.tasks.is_running('stats'):
+            return
+        if self.stats_watermark is None or time.time() - self.stats_synced_at > FULL_RELOAD_AFTER:
+            self.update_stats()
+        elif not self.tasks.is_running('stats'):
+            # Fetch only the stats rows changed since the last refresh
+            self.tasks.run('stats', select_stats_changes, self.stats_watermark, **self.stats_filters,
+                           on_result=self.apply_stats_changes)
+
+    def apply_stats_changes(self, result):
+        if result is None:
+            self.stats_watermark = None
+            return
+
+        rows, deleted_ids, self.stats_watermark = result
+        self.stats_model.remove_ids(deleted_ids)
+        if rows or deleted_ids:
+            self.update_stats_summary()
+
+        # Update loaded rows in place; rows newer than anything loaded go on top, older
+        # ones not loaded yet will come with their page
+        known_ids = self.stats_model.row_index
+        newest_id = max(known_ids, default=0)
+        rows = [row for row in rows
+                if row['id'] in known_ids or row['id'] > newest_id or not self.stats_model.has_more]
+        self.stats_model.upsert_rows(rows, at_top=True)
+        self.stats_synced_at = time.time()
+        self.stats_snapshot_timer.start()
+
+    def load_upcoming_tab(self):
+        self.tasks.run('schedule', load_schedule, on_result=self.apply_schedule)
+        self.upcoming_timer.start()
+
+    def apply_schedule(self, result):
+        watermark, schedule = result
+        if schedule is None:
+            return  # Retried on the next refresh
+        self.schedule = schedule
+        self.schedule_watermark = watermark
+        self.startup_phase('first_data')
+        self.update_upcoming()
+
+    def refresh_schedule(self):
+        if self.upcoming_tab not in self.loaded_tabs or self.tasks.is_running('schedule'):
+            return
+        if self.schedule_watermark is None:
+            self.load_upcoming_tab()
+        else:
+            # Only the posts changed since the last refresh are re-indexed
+            self.tasks.run('schedule', select_schedule_changes, self.schedule_watermark,
+                           on_result=self.apply_schedule_changes)
+
+    def apply_schedule_changes(self, result):
+        if result is None:
+            self.schedule_watermark = None
+            return
+
+        rows, deleted_ids, self.schedule_watermark = result
+        for post_id in deleted_ids:
+            self.schedule.remove_post(post_id)
+        for row in rows:
+            self.schedule.add_post(*row)
+        if rows or deleted_ids:
+            self.update_upcoming()
+
+    def update_upcoming(self):
+        minutes = UPCOMING_RANGES[self.upcoming_range_combo.currentText()]
+        started = time.perf_counter()
+        now = datetime.now()
+        fired = self.schedule.upcoming(now, now + timedelta(minutes=minutes))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.upcoming_model.set_rows([(when.strftime("%a %H:%M"), post_id, name, is_random)
+                                      for when, post_id, name, is_random in fired])
+        self.upcoming_label.setText(f"{len(fired):,} posts to fire, {len(self.schedule):,} posts scheduled "
+                                    f"(looked up in {elapsed_ms:.1f} ms)")
+
+def load_view_data():
+    # Read the watermark first so changes made during the query are seen again
+    watermark = get_change_watermark()
+    return watermark, select_from_db_view_data()
+
+def search_texts(row):
+    # Name, text and media names of a View Data row
+    return (row[1], row[2], *(row[3] or ()))
+
+def build_search_index(rows):
+    return SearchIndex((row[0], search_texts(row)) for row in rows)
+
+def search_view_data(query):
+    # Returns (rows of the first SEARCH_LIMIT matches, number of matches), or (None, 0) on error
+    post_ids = search_posts(query)
+    if post_ids is None:
+        return None, 0
+    rows = select_from_db_view_data(ids=post_ids[:SEARCH_LIMIT]) if post_ids else []
+    return rows, len(post_ids)
+
+def export_stats_to_file(path, exporter, filters, progress_callback=None):
+    with open(path, 'wb') as file:
+        exported = exporter(file, **filters, progress_callback=progress_callback)
+    if exported is None:
+        # Don't leave a truncated file behind
+        os.remove(path)
+    return exported
+
+def load_schedule():
+    # The index is built here, off the UI thread
+    watermark = get_change_watermark()
+    rows = select_schedule()
+    return watermark, ScheduleIndex(rows) if rows is not None else None
+
+def load_first_stats_page(filters):
+    watermark = get_change_watermark()
+    data, next_key = select_stats_page(**filters)
+    return watermark, data, next_key, count_stats_estimate(**filters)
 
 if __name__ == '__main__':
     from PyQt6.QtWidgets import QApplication
@@ -0,0 +1,125 @@
+import inspect
+import traceback
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from db import DB_POOL_MAX
+
+
+class WorkerSignals(QObject):
+    result = pyqtSignal(object)
+    error = pyqtSignal(str)
+    progress = pyqtSignal(object, object)
+    finished = pyqtSignal()
+
+
+class Worker(QRunnable):
+    """Run a function on a QThreadPool thread and report back through signals.
+
+    If the function takes a progress_callback argument, it is wired to the
+    progress signal.
+    """
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+        self.cancelled = False
+
+        try:
+            accepts_progress = 'progress_callback' in inspect.signature(fn).parameters
+        except (TypeError, ValueError):
+            accepts_progress = False
+        if accepts_progress and 'progress_callback' not in kwargs:
+            self.kwargs['progress_callback'] = self.signals.progress.emit
+
+    def cancel(self):
+        """Drop the result of this worker; a query already running is left to finish."""
+        self.cancelled = True
+
+    def run(self):
+        try:
+            if self.cancelled:
+                return
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as error:
+            traceback.print_exc()
+            if not self.cancelled:
+                self.signals.error.emit(str(error))
+        else:
+            if not self.cancelled:
+                self.signals.result.emit(result)
+        finally:
+            self.signals.finished.emit()
+
+
+class TaskRunner(QObject):
+    """Run db.py calls in the background and deliver results on the GUI thread.
+
+    Tasks started with the same key replace each other: starting a new refresh
+    cancels the previous one, so only the latest result is applied. Tasks
+    started with key=None are never cancelled.
+    """
+
+    active_changed = pyqtSignal(int)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool()
+        # More threads than pooled connections would only wait for a connection
+        self.pool.setMaxThreadCount(DB_POOL_MAX)
+        self.current = {}
+        self.running = set()
+
+    def run(self, key, fn, *args, on_result=None, on_error=None, on_progress=None, **kwargs):
+        if key is not None:
+            self.cancel(key)
+
+        worker = Worker(fn, *args, **kwargs)
+        worker.setAutoDelete(False)
+
+        def handle_result(result):
+            if not worker.cancelled and on_result:
+                on_result(result)
+
+        def handle_error(message):
+            if not worker.cancelled and on_error:
+                on_error(message)
+
+        def handle_progress(done, total):
+            if not worker.cancelled and on_progress:
+                on_progress(done, total)
+
+        worker.signals.result.connect(handle_result)
+        worker.signals.error.connect(handle_error)
+        worker.signals.progress.connect(handle_progress)
+        worker.signals.finished.connect(lambda: self._finished(key, worker))
+
+        if key is not None:
+            self.current[key] = worker
+        self.running.add(worker)
+        self.active_changed.emit(len(self.running))
+        self.pool.start(worker)
+        return worker
+
+    def cancel(self, key):
+        worker = self.current.pop(key, None)
+        if worker is None:
+            return
+        worker.cancel()
+        # Not started yet: take it off the queue altogether
+        if self.pool.tryTake(worker):
+            self._finished(key, worker)
+
+    def is_running(self, key):
+        return key in self.current
+
+    def wait(self, msecs=-1):
+        return self.pool.waitForDone(msecs)
+
+    def _finished(self, key, worker):
+        if key is not None and self.current.get(key) is worker:
+            del self.current[key]
+        if worker in self.running:
+            self.running.discard(worker)
+            self.active_changed.emit(len(self.running))